@@ -0,0 +1,127 @@
+"""Admission control and request coalescing.
+
+Per-client token buckets cap how fast one client can hit each endpoint
+class; ADMISSION_LIMITS sets "endpoint=rate/burst" pairs (requests per second,
+bucket size), e.g. "chat=0.5/5,flowchart=20/40". Buckets live in each uvicorn
+worker, so with several workers a client spread over them gets up to that many
+times the limit. Clients are told when to retry (429 with Retry-After).
+
+Admission control is off unless ADMISSION_CONTROL=1. A client is its
+connecting address, so behind a load balancer, reverse proxy or campus NAT
+every user would share one bucket: enable it there only together with
+TRUST_FORWARDED_FOR=1 (and a proxy that sets X-Forwarded-For).
+
+SingleFlight shares one in-flight computation between concurrent callers with
+the same key: when a snippet is shared with a class, the identical requests
+that arrive together parse it (or call the LLM) once.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_CONTROL", "0") == "1"
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "flowchart=20/40,batch=0.2/2,visualize=2/10,sql=5/20,chat=0.5/5")
+# Behind a reverse proxy the client address is the first X-Forwarded-For hop
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+# Clients tracked per endpoint; the least recently seen is dropped (its bucket would be full again soon anyway)
+MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+
+
+def parse_limits(spec):
+    """"chat=0.5/5,sql=5/20" -> {"chat": (0.5, 5.0), "sql": (5.0, 20.0)}"""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        endpoint, _, limit = item.partition("=")
+        rate, _, burst = limit.partition("/")
+        rate = float(rate)
+        limits[endpoint.strip()] = (rate, float(burst) if burst else max(1.0, rate))
+    return limits
+
+
+class TokenBuckets:
+    """One token bucket per client for a single endpoint class."""
+
+    def __init__(self, rate, burst, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> (tokens, last update), least recently seen first
+        self.buckets = OrderedDict()
+
+    def take(self, client, now=None):
+        """Takes a token. Returns 0 if the request is admitted, otherwise the
+        seconds until the client's next token."""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self.buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[client] = (tokens, now)
+        if len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionControl:
+    def __init__(self, limits=None, enabled=ADMISSION_ENABLED):
+        limits = parse_limits(ADMISSION_LIMITS) if limits is None else limits
+        self.enabled = enabled
+        self.buckets = {endpoint: TokenBuckets(rate, burst) for endpoint, (rate, burst) in limits.items() if rate > 0}
+
+    def client_of(self, request):
+        if TRUST_FORWARDED_FOR:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    def admit(self, endpoint, request):
+        """Returns 0 if the request may proceed, else seconds to wait before retrying."""
+        buckets = self.buckets.get(endpoint)
+        if not self.enabled or buckets is None:
+            return 0.0
+        wait = buckets.take(self.client_of(request))
+        if wait:
+            metrics.ADMISSION_REJECTED.labels(endpoint).inc()
+        return wait
+
+
+class SingleFlight:
+    """Concurrent run() calls with the same key await one shared task. The
+    task is shielded, so a caller that disconnects doesn't cancel it for the
+    others (or for the cache it fills)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+
+    async def run(self, key, factory):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.finish(key, done))
+        else:
+            metrics.COALESCED_REQUESTS.labels(self.name).inc()
+        return await asyncio.shield(task)
+
+    def finish(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception retrieved, every caller may have gone already
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {"in_flight": len(self.calls)}
+
+
+admission = AdmissionControl()
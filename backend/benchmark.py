@@ -0,0 +1,292 @@
+"""Offline benchmarks for the Python and Java flowchart generators.
+
+Generates synthetic corpora at several scales and shapes, runs each generator
+in-process (no server needed) and records wall time, peak memory and output
+size. Results are written as JSON; --compare flags regressions against a
+previously saved run.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --scales 10,1000 --compare bench.json --threshold 0.15
+
+The full default run (up to 100k lines) takes several minutes; use --scales
+and --corpora for a quick check.
+"""
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from python_parser import GENERATOR_VERSION as PYTHON_GENERATOR_VERSION, MermaidGenerator
+from java_parser import GENERATOR_VERSION as JAVA_GENERATOR_VERSION, JavaMermaidGenerator
+
+DEFAULT_SCALES = (10, 100, 1000, 10000, 100000)
+
+# Python caps statically nested blocks at 20; `if` doesn't count towards it,
+# but keep both languages at the same depth so results are comparable
+NESTING_DEPTH = 40
+EXPRESSION_TERMS = 60
+
+
+# -- synthetic corpora ---------------------------------------------------------
+
+def python_function(index):
+    return [
+        f"def func_{index}(a, b):",
+        f"    total = a + b * {index}",
+        "    for i in range(a):",
+        "        if i % 2 == 0:",
+        "            total += i",
+        "        else:",
+        "            print(i)",
+        "    while total > 100:",
+        "        total -= 7",
+        "    return total",
+        "",
+    ]
+
+
+def python_nested(index):
+    lines = [f"def nested_{index}(x):"]
+    for depth in range(NESTING_DEPTH):
+        lines.append("    " * (depth + 1) + f"if x > {depth}:")
+    lines.append("    " * (NESTING_DEPTH + 1) + "print(x)")
+    lines.append("    return x")
+    lines.append("")
+    return lines
+
+
+def python_expression(index):
+    terms = " + ".join(f"(v{index} * {n} - {n} // 3)" for n in range(EXPRESSION_TERMS))
+    return [f"v{index} = {index}", f"result_{index} = {terms}", f"print(result_{index})", ""]
+
+
+def java_method(index):
+    return [
+        f"    public static int method{index}(int a, int b) {{",
+        f"        int total = a + b * {index};",
+        "        for (int i = 0; i < a; i++) {",
+        "            if (i % 2 == 0) {",
+        "                total += i;",
+        "            } else {",
+        "                System.out.println(i);",
+        "            }",
+        "        }",
+        "        while (total > 100) {",
+        "            total -= 7;",
+        "        }",
+        "        return total;",
+        "    }",
+    ]
+
+
+def java_nested(index):
+    lines = [f"    public static int nested{index}(int x) {{"]
+    for depth in range(NESTING_DEPTH):
+        lines.append("    " * (depth + 2) + f"if (x > {depth}) {{")
+    lines.append("    " * (NESTING_DEPTH + 2) + "System.out.println(x);")
+    for depth in reversed(range(NESTING_DEPTH)):
+        lines.append("    " * (depth + 2) + "}")
+    lines.append("        return x;")
+    lines.append("    }")
+    return lines
+
+
+def java_expression(index):
+    terms = " + ".join(f"(v * {n} - {n} / 3)" for n in range(EXPRESSION_TERMS))
+    return [
+        f"    public static int expr{index}(int v) {{",
+        f"        int result = {terms};",
+        "        System.out.println(result);",
+        "        return result;",
+        "    }",
+    ]
+
+
+def build_corpus(block, target_lines, header=(), footer=()):
+    lines = list(header)
+    index = 0
+    while len(lines) + len(footer) < target_lines:
+        lines.extend(block(index))
+        index += 1
+    lines.extend(footer)
+    return "\n".join(lines) + "\n"
+
+
+def python_corpora(scale):
+    return {
+        "many_functions": build_corpus(python_function, scale),
+        "deep_nesting": build_corpus(python_nested, scale),
+        "long_expressions": build_corpus(python_expression, scale),
+    }
+
+
+def java_corpora(scale):
+    header, footer = ["public class Bench {"], ["}"]
+    return {
+        "many_methods": build_corpus(java_method, scale, header, footer),
+        "deep_nesting": build_corpus(java_nested, scale, header, footer),
+        "long_expressions": build_corpus(java_expression, scale, header, footer),
+    }
+
+
+GENERATORS = {
+    "python": (MermaidGenerator, python_corpora, PYTHON_GENERATOR_VERSION),
+    "java": (JavaMermaidGenerator, java_corpora, JAVA_GENERATOR_VERSION),
+}
+
+
+# -- measurement -----------------------------------------------------------------
+
+def measure(generator_class, code, repeat):
+    times = []
+    output = ""
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        output = generator_class().generate(code)
+        times.append(time.perf_counter() - started)
+
+    # Separate run: tracemalloc slows allocation down too much to time under it
+    gc.collect()
+    tracemalloc.start()
+    try:
+        generator = generator_class()
+        generator.generate(code)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "wall_time_s": statistics.median(times),
+        "wall_time_min_s": min(times),
+        "runs": repeat,
+        "peak_memory_bytes": peak,
+        "output_bytes": len(output.encode("utf-8")),
+        "nodes": generator.graph.node_count,
+        "edges": generator.graph.edge_count,
+        "error": generator.error,
+    }
+
+
+def run_benchmarks(languages, scales, repeat, corpus_names=None, log=print):
+    results = []
+    for language in languages:
+        generator_class, corpora, _ = GENERATORS[language]
+        for scale in scales:
+            for corpus, code in corpora(scale).items():
+                if corpus_names and corpus not in corpus_names:
+                    continue
+                # Large inputs take long enough that one run is representative
+                runs = repeat if scale <= 10000 else 1
+                result = {
+                    "generator": language,
+                    "corpus": corpus,
+                    "scale": scale,
+                    "lines": code.count("\n"),
+                    "input_bytes": len(code.encode("utf-8")),
+                    **measure(generator_class, code, runs),
+                }
+                results.append(result)
+                log(
+                    f"{language:6} {corpus:17} {scale:>7} lines  "
+                    f"{result['wall_time_s'] * 1000:10.1f} ms  "
+                    f"{result['peak_memory_bytes'] / 1024 / 1024:8.1f} MB  "
+                    f"{result['output_bytes']:>10} B"
+                    + (f"  error: {result['error']}" if result["error"] else "")
+                )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "generator_versions": {language: GENERATORS[language][2] for language in languages},
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+# -- comparison ------------------------------------------------------------------
+
+COMPARED_METRICS = ("wall_time_s", "peak_memory_bytes", "output_bytes")
+
+# Timings below this are mostly noise
+MIN_COMPARED_TIME = 0.005
+
+
+def compare(current, baseline, threshold):
+    """Returns a list of regressions, one per metric that grew by more than threshold."""
+    previous = {(r["generator"], r["corpus"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["generator"], result["corpus"], result["scale"]))
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            if metric == "wall_time_s" and max(before, after) < MIN_COMPARED_TIME:
+                continue
+            ratio = after / before
+            if ratio > 1 + threshold:
+                regressions.append({
+                    "generator": result["generator"],
+                    "corpus": result["corpus"],
+                    "scale": result["scale"],
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "ratio": round(ratio, 3),
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the flowchart generators offline")
+    parser.add_argument("--languages", default="python,java", help="comma separated: python,java")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="comma separated line counts")
+    parser.add_argument("--corpora", help="comma separated corpus names, e.g. many_functions,deep_nesting (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per corpus (median is reported)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative growth before a regression is flagged")
+    args = parser.parse_args(argv)
+
+    languages = [language.strip() for language in args.languages.split(",") if language.strip()]
+    for language in languages:
+        if language not in GENERATORS:
+            parser.error(f"unknown language: {language}")
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+
+    # Deeply nested corpora recurse through the generators' visitors
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+    corpus_names = {name.strip() for name in args.corpora.split(",")} if args.corpora else None
+    current = run_benchmarks(languages, scales, max(1, args.repeat), corpus_names)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        current["regressions"] = regressions
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for r in regressions:
+                print(f"  {r['generator']} {r['corpus']} {r['scale']}: {r['metric']} {r['baseline']} -> {r['current']} (x{r['ratio']})")
+        else:
+            print(f"\nNo regressions over {args.threshold:.0%} against {args.compare}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""Picks the part of the editor's code that goes into a chat prompt.
+
+Small files are sent as they are. Anything over CHAT_CONTEXT_TOKENS
+(estimated at CHAT_CHARS_PER_TOKEN characters per token) is cut down using the
+Python / Java parse, in this order while it fits:
+
+1. the full source of definitions the message mentions by name, of the
+   innermost definition (or top-level statement) around every line it refers
+   to ("line 42", "lines 10-20", "L7"), and of the functions those call;
+2. signature-only stubs for the enclosing classes of those, then for every
+   other definition, in source order;
+3. the remaining top-level code (imports, globals, fields), in source order.
+
+Everything left out is replaced by a "... lines a-b omitted" comment, so the
+model still knows where it is. Code that doesn't parse is cut around the
+referenced lines instead.
+"""
+import ast
+import bisect
+import os
+import re
+
+from javalang.tokenizer import Identifier, Separator, tokenize
+from javalang.tree import MethodInvocation
+
+from java_parser import JavaMermaidGenerator, java_nodes
+from outline import index_java, index_python
+
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+CHARS_PER_TOKEN = float(os.getenv("CHAT_CHARS_PER_TOKEN", "4"))
+# Room for the omission comments, which are only known once everything is chosen
+MARKER_RESERVE = 0.1
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+LINE_REFERENCE = re.compile(r"\b(?:lines?\s*|L)(\d+)(?:\s*(?:-|–|to)\s*(\d+))?", re.IGNORECASE)
+COMMENT = {"python": "#", "java": "//"}
+
+
+class Item:
+    """A definition or top-level statement: what it takes to show it in full, or as a stub."""
+    __slots__ = ("name", "parent", "start", "end", "stub", "calls", "is_definition")
+
+    def __init__(self, name, parent, start, end, stub, calls=(), is_definition=True):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end = end
+        self.stub = stub # line numbers kept when stubbed
+        self.calls = calls
+        self.is_definition = is_definition
+
+
+def referenced_lines(message):
+    lines = set()
+    for match in LINE_REFERENCE.finditer(message or ""):
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first <= last <= first + 200:
+            lines.update(range(first, last + 1))
+    return lines
+
+
+def python_items(code):
+    tree = ast.parse(code)
+    items = []
+    parents = {}
+    for entry, node in index_python(tree):
+        start = min([decorator.lineno for decorator in node.decorator_list] + [node.lineno])
+        # The header runs up to the body; a one-line definition is its own stub
+        header_end = max(node.body[0].lineno - 1, node.lineno)
+        calls = {
+            call.func.id if isinstance(call.func, ast.Name) else call.func.attr
+            for call in ast.walk(node)
+            if isinstance(call, ast.Call) and isinstance(call.func, (ast.Name, ast.Attribute))
+        }
+        item = Item(entry["name"], parents.get(entry["parent"]), start, node.end_lineno, range(start, header_end + 1), calls)
+        parents[entry["id"]] = item
+        items.append(item)
+        if isinstance(node, ast.ClassDef):
+            items.extend(statement_items(node.body, item))
+    items.extend(statement_items(tree.body, None))
+    return items
+
+
+def statement_items(body, parent):
+    return [
+        Item(None, parent, stmt.lineno, stmt.end_lineno, (), is_definition=False)
+        for stmt in body
+        if not isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+
+
+def java_items(code, lines):
+    tree = JavaMermaidGenerator().parse(code)
+    tokens = list(tokenize(code))
+    positions = [(token.position.line, token.position.column) for token in tokens]
+    items = []
+    parents = {}
+    covered = set()
+    for entry, node in index_java(tree):
+        if not node.position:
+            continue
+        line, column = node.position.line, node.position.column
+        # Line 1 may have been wrapped (see java_parser.WRAPPERS), so its columns don't match
+        index = bisect.bisect_left(positions, (line, column if line > 1 else 0))
+        open_index = body_start(tokens, index, node.name)
+        if open_index is None:
+            continue
+        start = line
+        while start > 1 and lines[start - 2].strip().startswith("@"):
+            start -= 1 # annotations belong to the definition
+        open_token = tokens[open_index]
+        if open_token.value == ";":
+            end, stub = open_token.position.line, range(start, open_token.position.line + 1)
+        else:
+            end = closing_line(tokens, open_index)
+            stub = list(range(start, open_token.position.line + 1))
+            if end > open_token.position.line and lines[end - 1].strip() == "}":
+                stub.append(end)
+        calls = {invocation.member for invocation in java_nodes(node, MethodInvocation)}
+        item = Item(entry["name"], parents.get(entry["parent"]), start, end, stub, calls)
+        parents[entry["id"]] = item
+        items.append(item)
+        covered.update(range(start, end + 1))
+
+    # Whatever is outside every definition (package, imports, fields) is plain context
+    run_start = None
+    for number in range(1, len(lines) + 2):
+        inside = number > len(lines) or number in covered or not lines[number - 1].strip()
+        if not inside and run_start is None:
+            run_start = number
+        elif inside and run_start is not None:
+            items.append(Item(None, None, run_start, number - 1, (), is_definition=False))
+            run_start = None
+    return items
+
+
+def body_start(tokens, index, name):
+    """Index of the `{` (or `;` of an abstract method) that ends the declaration at `index`."""
+    seen_name = False
+    depth = 0
+    for position in range(index, len(tokens)):
+        token = tokens[position]
+        if isinstance(token, Identifier) and token.value == name:
+            seen_name = True
+        elif isinstance(token, Separator) and seen_name:
+            if token.value == "(":
+                depth += 1
+            elif token.value == ")":
+                depth -= 1
+            elif depth == 0 and token.value in ("{", ";"):
+                return position
+    return None
+
+
+def closing_line(tokens, open_index):
+    depth = 0
+    for token in tokens[open_index:]:
+        if isinstance(token, Separator):
+            if token.value == "{":
+                depth += 1
+            elif token.value == "}":
+                depth -= 1
+                if depth == 0:
+                    return token.position.line
+    return tokens[-1].position.line
+
+
+class Selection:
+    def __init__(self, lines, budget):
+        self.lines = lines
+        self.budget = budget
+        self.kept = [False] * (len(lines) + 1)
+        self.chars = 0
+
+    def cost(self, numbers):
+        return sum(len(self.lines[number - 1]) + 1 for number in numbers if not self.kept[number])
+
+    def keep(self, numbers):
+        """Keeps the lines if they fit; returns whether they did."""
+        numbers = [number for number in numbers if 1 <= number < len(self.kept)]
+        cost = self.cost(numbers)
+        if self.chars + cost > self.budget:
+            return False
+        for number in numbers:
+            self.kept[number] = True
+        self.chars += cost
+        return True
+
+    def render(self, comment):
+        out = []
+        number = 1
+        while number <= len(self.lines):
+            if self.kept[number]:
+                out.append(self.lines[number - 1])
+                number += 1
+                continue
+            first = number
+            while number <= len(self.lines) and not self.kept[number]:
+                number += 1
+            omitted = self.lines[first - 1:number - 1]
+            if any(line.strip() for line in omitted):
+                text = next(line for line in omitted if line.strip())
+                indent = text[:len(text) - len(text.lstrip())]
+                span = f"line {first}" if first == number - 1 else f"lines {first}-{number - 1}"
+                out.append(f"{indent}{comment} ... {span} omitted")
+        return "\n".join(out)
+
+
+def select_items(items, message, selection):
+    mentioned = set(IDENTIFIER.findall(message or ""))
+    lines = referenced_lines(message)
+
+    focus = [item for item in items if item.is_definition and item.name in mentioned]
+    for number in sorted(lines):
+        around = [item for item in items if item.start <= number <= item.end]
+        if around:
+            # Innermost: the one that starts last
+            focus.append(max(around, key=lambda item: (item.start, -item.end)))
+    callees = {name for item in focus for name in item.calls}
+    focus += [item for item in items if item.is_definition and item.name in callees]
+
+    shown = []
+    for item in focus:
+        if item in shown:
+            continue
+        if selection.keep(range(item.start, item.end + 1)):
+            shown.append(item)
+        else:
+            selection.keep(item.stub)
+    # Where the focused code sits
+    for item in shown:
+        parent = item.parent
+        while parent is not None:
+            selection.keep(parent.stub)
+            parent = parent.parent
+    for item in items:
+        if item.is_definition:
+            selection.keep(item.stub)
+    for item in sorted((item for item in items if not item.is_definition), key=lambda item: item.start):
+        selection.keep(range(item.start, item.end + 1))
+
+
+def trim_plain(code, message, budget, comment):
+    """Unparseable code: the referenced lines with some surroundings, else the start."""
+    lines = code.split("\n")
+    selection = Selection(lines, budget)
+    for number in sorted(referenced_lines(message)):
+        selection.keep(range(max(1, number - 10), number + 11))
+    for number in range(1, len(lines) + 1):
+        if not selection.keep([number]):
+            break
+    return selection.render(comment)
+
+
+def full_context(code, language=None):
+    """The whole file as context, with the report select_context() gives."""
+    return code, {"language": language, "original_chars": len(code), "sent_chars": len(code), "saved_chars": 0, "trimmed": False}
+
+
+def select_context(code, message, language=None, max_tokens=CHAT_CONTEXT_TOKENS):
+    """Returns (context, report). `report` has the original and sent sizes in characters."""
+    budget = int(max_tokens * CHARS_PER_TOKEN)
+    if len(code) <= budget:
+        return full_context(code, language)
+    _, report = full_context(code, language)
+
+    lines = code.split("\n")
+    items = None
+    for candidate in ([language] if language in COMMENT else ["python", "java"]):
+        try:
+            items = python_items(code) if candidate == "python" else java_items(code, lines)
+        except Exception:
+            # Any failure to index the file just means trimming it as plain text
+            continue
+        language = candidate
+        break
+
+    comment = COMMENT.get(language, "#")
+    if items is None:
+        context = trim_plain(code, message, int(budget * (1 - MARKER_RESERVE)), comment)
+    else:
+        selection = Selection(lines, int(budget * (1 - MARKER_RESERVE)))
+        select_items(items, message, selection)
+        context = selection.render(comment)
+    if len(context) > budget:
+        context = context[:budget].rsplit("\n", 1)[0] + f"\n{comment} ... truncated"
+
+    report.update(language=language, sent_chars=len(context), saved_chars=len(code) - len(context), trimmed=True)
+    return context, report
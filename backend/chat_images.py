@@ -0,0 +1,190 @@
+"""Image uploads for multimodal chat.
+
+POST /api/chat/upload takes the chat fields plus an `image` file as
+multipart/form-data. The body is parsed as it streams in: the file goes into a
+spooled temporary file (in memory up to CHAT_IMAGE_SPOOL_BYTES, then on disk)
+and is hashed on the way, and the upload is refused once it passes
+CHAT_IMAGE_MAX_BYTES. The image is then decoded at reduced size (JPEG draft
+mode), scaled to fit CHAT_IMAGE_MAX_SIDE and re-encoded as JPEG, so what is
+held in memory and sent upstream depends on the target size rather than on the
+upload. Prepared images are cached by the SHA-256 of the upload.
+
+Without Pillow images are forwarded unchanged (still subject to the size cap).
+"""
+import base64
+import hashlib
+import io
+import os
+import tempfile
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError: # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from flowchart_cache import FlowchartCache
+
+CHAT_IMAGE_MAX_BYTES = int(os.getenv("CHAT_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+CHAT_IMAGE_SPOOL_BYTES = int(os.getenv("CHAT_IMAGE_SPOOL_BYTES", str(1024 * 1024)))
+CHAT_IMAGE_MAX_SIDE = int(os.getenv("CHAT_IMAGE_MAX_SIDE", "1280"))
+CHAT_IMAGE_QUALITY = int(os.getenv("CHAT_IMAGE_QUALITY", "80"))
+CHAT_IMAGE_CACHE_BYTES = int(os.getenv("CHAT_IMAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Text fields (message, currentCode, ...) together
+CHAT_FIELDS_MAX_BYTES = int(os.getenv("CHAT_FIELDS_MAX_BYTES", str(2 * 1024 * 1024)))
+# Refuse decompression bombs before decoding
+MAX_PIXELS = 40_000_000
+
+# Prepared data URIs by upload hash
+image_cache = FlowchartCache(CHAT_IMAGE_CACHE_BYTES)
+
+
+class UploadError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Upload:
+    """Form fields and the spooled image of one multipart request."""
+
+    def __init__(self):
+        self.fields = {}
+        self.file = None
+        self.content_type = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.field_bytes = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+async def receive_upload(request):
+    """Parses a multipart/form-data request body as it arrives. Raises UploadError."""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError(400, "Expected multipart/form-data")
+
+    upload = Upload()
+    part = {}
+    ended = False
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=None, data=[], open=True)
+
+    def on_header_field(data, start, end):
+        part["header"] = part.get("header", b"") + data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] = part.get("value", b"") + data[start:end]
+
+    def on_header_end():
+        part["headers"][part.pop("header", b"").lower()] = part.pop("value", b"")
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in disposition:
+            if name != "image" or upload.file is not None:
+                raise UploadError(400, "Only one file, named 'image', can be uploaded")
+            upload.file = tempfile.SpooledTemporaryFile(max_size=CHAT_IMAGE_SPOOL_BYTES)
+            upload.content_type = part["headers"].get(b"content-type", b"").decode("latin-1") or None
+        else:
+            part["field"] = name
+
+    def on_part_data(data, start, end):
+        chunk = data[start:end]
+        if part["field"] is None:
+            upload.size += len(chunk)
+            if upload.size > CHAT_IMAGE_MAX_BYTES:
+                raise UploadError(413, f"Images are limited to {CHAT_IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+            upload.digest.update(chunk)
+            upload.file.write(chunk)
+        else:
+            upload.field_bytes += len(chunk)
+            if upload.field_bytes > CHAT_FIELDS_MAX_BYTES:
+                raise UploadError(413, "Form fields are too large")
+            part["data"].append(chunk)
+
+    def on_part_end():
+        part["open"] = False
+        if part["field"] is not None:
+            upload.fields[part["field"]] = b"".join(part["data"]).decode("utf-8", "replace")
+
+    def on_end():
+        nonlocal ended
+        ended = True
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_end": on_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+        # finalize() doesn't check that the closing boundary arrived
+        if not ended or part.get("open"):
+            raise UploadError(400, "Incomplete multipart data")
+    except UploadError:
+        upload.close()
+        raise
+    except Exception:
+        upload.close()
+        raise UploadError(400, "Invalid multipart data")
+    if upload.file is not None:
+        upload.file.seek(0)
+    return upload
+
+
+def prepare_image(upload):
+    """Returns the image as a (downscaled JPEG) data URI, from the cache when
+    the same bytes were prepared before. Runs in a thread: decoding is CPU bound."""
+    key = upload.digest.hexdigest()
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if Image is None:
+        data = upload.file.read()
+        uri = f"data:{upload.content_type or 'image/jpeg'};base64,{base64.b64encode(data).decode('ascii')}"
+    else:
+        try:
+            with Image.open(upload.file) as image:
+                if image.width * image.height > MAX_PIXELS:
+                    raise UploadError(413, "Image resolution is too large")
+                # JPEG: let the decoder skip detail we'd throw away anyway
+                image.draft("RGB", (CHAT_IMAGE_MAX_SIDE, CHAT_IMAGE_MAX_SIDE))
+                image.thumbnail((CHAT_IMAGE_MAX_SIDE, CHAT_IMAGE_MAX_SIDE))
+                if image.mode in ("RGBA", "LA", "P"):
+                    # JPEG has no alpha: flatten onto white like most viewers do
+                    image = image.convert("RGBA")
+                    background = Image.new("RGB", image.size, "white")
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                elif image.mode != "RGB":
+                    image = image.convert("RGB")
+                encoded = io.BytesIO()
+                image.save(encoded, "JPEG", quality=CHAT_IMAGE_QUALITY, optimize=True)
+        except UploadError:
+            raise
+        except Exception:
+            raise UploadError(400, "Unsupported or corrupt image")
+        uri = "data:image/jpeg;base64," + base64.b64encode(encoded.getbuffer()).decode("ascii")
+
+    image_cache.put(key, uri, size=len(uri))
+    return uri
@@ -0,0 +1,151 @@
+import ast
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from python_parser import GENERATOR_VERSION as PYTHON_GENERATOR_VERSION
+from java_parser import GENERATOR_VERSION as JAVA_GENERATOR_VERSION
+from javascript_parser import GENERATOR_VERSION as JS_GENERATOR_VERSION
+from flowchart_simplify import SIMPLIFY_VERSION
+
+GENERATOR_VERSIONS = {
+    "python": PYTHON_GENERATOR_VERSION,
+    "java": JAVA_GENERATOR_VERSION,
+    "javascript": JS_GENERATOR_VERSION,
+}
+
+DEFAULT_MAX_BYTES = int(os.getenv("FLOWCHART_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Rough per-entry bookkeeping cost (key, dict, OrderedDict link)
+ENTRY_OVERHEAD = 256
+
+
+def python_fingerprint(code):
+    """Fingerprint Python source by its AST so whitespace/comment-only edits still hit.
+
+    Statement line numbers are part of the fingerprint because they end up in
+    the node IDs (N{n}_L{line}).
+    """
+    tree = ast.parse(code)
+    lines = ",".join(str(n.lineno) for n in ast.walk(tree) if isinstance(n, ast.stmt))
+    return ast.dump(tree) + "|" + lines
+
+
+def source_fingerprint(code):
+    # Trailing whitespace never changes the output; line breaks do (line numbers)
+    return "\n".join(line.rstrip() for line in code.splitlines())
+
+
+def cache_key(language, code):
+    fingerprint = None
+    if language == "python":
+        try:
+            fingerprint = python_fingerprint(code)
+        except (SyntaxError, ValueError):
+            # Unparseable input still gets cached (as its error chart) by raw text
+            fingerprint = None
+        except (RecursionError, MemoryError):
+            # ast.dump recurses per nesting level and gives up on long
+            # expressions the generators handle; fall back to the text
+            fingerprint = None
+    if fingerprint is None:
+        fingerprint = source_fingerprint(code)
+
+    digest = hashlib.sha256(fingerprint.encode("utf-8", "surrogatepass")).hexdigest()
+    return f"{language}:{GENERATOR_VERSIONS.get(language, '0')}:{digest}"
+
+
+def source_key(language, code):
+    """Key of the exact source text. Needs no parsing, used by the persistent store."""
+    digest = hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
+    return f"{language}:{GENERATOR_VERSIONS.get(language, '0')}:src:{digest}"
+
+
+def variant_key(key, language, output_format="mermaid", max_nodes=None, detail=None, simplify=False):
+    """Adds the request options that change the result to a cache key."""
+    if output_format != "mermaid":
+        key = f"{output_format}:{key}"
+    if language in ("python", "java") and (max_nodes or detail is not None):
+        key = f"lod{max_nodes}/{detail}:{key}"
+    if language in ("python", "java") and simplify:
+        key = f"simple{SIMPLIFY_VERSION}:{key}"
+    return key
+
+
+def result_size(key, result):
+    size = len(key) + ENTRY_OVERHEAD
+    for value in result.values():
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, dict):
+            # Structured graphs (format=json) are roughly as large as their JSON text
+            size += len(json.dumps(value))
+        else:
+            size += ENTRY_OVERHEAD
+    return size
+
+
+class FlowchartCache:
+    """In-process LRU cache for generated flowcharts, bounded by a byte budget."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count=True):
+        """`count=False` leaves the hit/miss statistics alone, for follow-up
+        lookups of a request whose first lookup has been counted already."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def put(self, key, result, size=None):
+        if size is None:
+            size = result_size(key, result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self.entries[key] = (result, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+flowchart_cache = FlowchartCache()
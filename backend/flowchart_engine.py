@@ -0,0 +1,360 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+POOL_SIZE = int(os.getenv("FLOWCHART_WORKERS", str(os.cpu_count() or 1)))
+REQUEST_TIMEOUT = float(os.getenv("FLOWCHART_TIMEOUT", "10"))
+MAX_QUEUE = int(os.getenv("FLOWCHART_MAX_QUEUE", "64"))
+TRACE_WORKERS = int(os.getenv("TRACE_WORKERS", "2"))
+
+# Lower runs first. A free worker goes to the waiting Python request before any
+# queued Java parse, so a burst of slow Java snippets can't hold up quick ones.
+# JavaScript (esprima) sits in between.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+LANGUAGE_PRIORITY = {"python": PRIORITY_HIGH, "javascript": PRIORITY_NORMAL, "java": PRIORITY_LOW}
+
+
+class EngineBusy(Exception):
+    """Raised when too many requests are already waiting for a worker."""
+
+
+class EngineTimeout(Exception):
+    """Raised when a generator exceeds the per-request timeout (the worker is killed)."""
+
+
+WARM_PYTHON = "x = 1\nif x > 0:\n    print(x)\nfor i in range(3):\n    x += i\n"
+WARM_JAVA = "public class Warm { void run(int x) { if (x > 0) { System.out.println(x); } for (int i = 0; i < 3; i++) { x = x + i; } } }"
+WARM_JAVASCRIPT = "function run(x) { if (x > 0) { console.log(x); } while (x < 3) { x = x + 1; } return x; }"
+
+
+def exit_with_parent(parent_pid):
+    # Sibling workers inherit each other's queue pipes, so a worker whose
+    # server process was killed never sees EOF; watch the parent instead.
+    while True:
+        time.sleep(1)
+        if os.getppid() != parent_pid:
+            os._exit(0)
+
+
+def warm_worker():
+    threading.Thread(target=exit_with_parent, args=(os.getppid(),), daemon=True).start()
+
+    # Runs once in every worker process, so the first real request
+    # doesn't pay for importing javalang, esprima and the generators.
+    import javalang  # noqa: F401
+    import python_parser  # noqa: F401
+    import java_parser  # noqa: F401
+    import javascript_parser
+    import incremental  # noqa: F401
+    import outline  # noqa: F401
+    import tracer  # noqa: F401
+    import profiling  # noqa: F401
+    import flowchart_simplify  # noqa: F401
+    import chat_context  # noqa: F401
+
+    # One tiny run per generator also fills the lazily built state
+    # (javalang's tokenizer/parser internals, the snippet classifier)
+    run_generator("python", WARM_PYTHON, simplify=True)
+    run_generator("java", WARM_JAVA, simplify=True)
+    if javascript_parser.esprima is not None:
+        run_generator("javascript", WARM_JAVASCRIPT)
+
+
+def warm_trace_worker():
+    threading.Thread(target=exit_with_parent, args=(os.getppid(),), daemon=True).start()
+    import tracer
+    tracer.lock_down()
+
+
+def run_generator(language, code, output_format="mermaid", profile=None, max_nodes=None, detail=None, simplify=False):
+    """Returns (result, stats); stats holds parse/render seconds and the graph size,
+    plus the profile report when `profile` is one of the profiling modes."""
+    if language == "python":
+        from python_parser import MermaidGenerator
+        generator = MermaidGenerator(max_nodes, detail)
+    elif language == "java":
+        from java_parser import JavaMermaidGenerator
+        generator = JavaMermaidGenerator(max_nodes, detail)
+    elif language == "javascript":
+        # Same charts as the Node service: no level of detail, no simplification
+        from javascript_parser import JavaScriptMermaidGenerator
+        generator = JavaScriptMermaidGenerator()
+        simplify = False
+    else:
+        raise ValueError(f"No in-process generator for {language}")
+
+    from flowchart_render import to_json, to_mermaid
+    session = None
+    if profile:
+        import profiling
+        session = profiling.ProfileSession(generator, language, with_cprofile=profile != profiling.STAGES)
+        session.start()
+
+    started = time.perf_counter()
+    graph = generator.generate_graph(code)
+    line_map = None
+    if simplify and graph is not None:
+        from flowchart_simplify import simplify as simplify_graph
+        summaries = [summary["id"] for summary in generator.lod.summaries] if generator.lod is not None else ()
+        graph, line_map = simplify_graph(graph, keep=summaries)
+    parsed = time.perf_counter()
+    if output_format == "json":
+        result = {"graph": to_json(graph) if graph is not None else None}
+    else:
+        result = {"mermaid": to_mermaid(graph) if graph is not None else generator.error_chart()}
+    rendered = time.perf_counter()
+
+    if session is not None:
+        session.stop()
+    if generator.error:
+        result["error"] = generator.error
+    if generator.lod is not None and graph is not None:
+        # Line ranges of the summary nodes, for drilling down
+        result["collapsed"] = generator.lod.summaries
+    if line_map:
+        # Every source line of the merged basic-block nodes
+        result["lines"] = line_map
+    if language == "java":
+        result["metadata"] = {
+            "classified_as": generator.classified_as,
+            "parse_path": generator.parse_path,
+        }
+    stats = {
+        "parse": parsed - started,
+        "render": rendered - parsed,
+        "nodes": graph.node_count if graph is not None else None,
+        "edges": graph.edge_count if graph is not None else None,
+    }
+    if session is not None:
+        if profile == profiling.SAMPLE:
+            profiling.store_profile(language, code, session.profiler)
+        else:
+            stats["profile"] = session.report(parsed - started, rendered - parsed)
+    return result, stats
+
+
+def run_incremental(language, code):
+    from incremental import generate_incremental
+    return generate_incremental(language, code)
+
+
+def run_outline(language, code):
+    from flowchart_cache import cache_key
+    from outline import generate_outline
+    source_id = cache_key(language, code)
+    return {**generate_outline(language, source_id, code), "sourceId": source_id}
+
+
+def run_expand(language, source_id, code, def_id, verify=False):
+    """`verify` checks that code sent by the client really is the source
+    `source_id` names before anything is parsed or cached under that id."""
+    from flowchart_cache import cache_key
+    from outline import UnknownDefinition, expand
+    if verify and cache_key(language, code) != source_id:
+        return {"error": "The code does not match sourceId", "status": 400}
+    try:
+        return expand(language, source_id, code, def_id)
+    except UnknownDefinition:
+        return {"error": f"Unknown definition: {def_id}", "status": 404}
+
+
+def run_select_context(language, code, message):
+    # Trimming a large file parses it
+    from chat_context import select_context
+    return select_context(code, message, language)
+
+
+def run_trace(code, encoding="full"):
+    # User code runs here, in a locked down worker (warm_trace_worker) that
+    # runs only this trace and is killed and replaced if it hangs
+    from tracer import expand_steps, run_trace as trace
+    result = trace(code)
+    if encoding == "full":
+        result["steps"] = expand_steps(result["steps"], code)
+    return result
+
+
+def ping():
+    return True
+
+
+class WorkerSlot:
+    """One single-process executor, so a runaway parse can be killed without
+    taking down requests running on the other workers."""
+
+    def __init__(self, initializer=warm_worker, mp_context=None, max_tasks_per_child=None):
+        self.initializer = initializer
+        self.mp_context = mp_context
+        self.max_tasks_per_child = max_tasks_per_child
+        self.executor = None
+        self.start()
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=self.mp_context,
+            initializer=self.initializer,
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+        # Force the worker process to spawn (and import javalang) now
+        self.executor.submit(ping).result()
+
+    def kill(self):
+        for process in list((self.executor._processes or {}).values()):
+            process.kill()
+        # Waiting lets the executor's manager thread finish before the
+        # executor's state is torn down (it may still be replacing a worker
+        # that exited after max_tasks_per_child), and the processes are dead
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def restart(self):
+        self.kill()
+        self.start()
+
+
+class FlowchartEngine:
+    def __init__(self, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT, max_queue=MAX_QUEUE, **slot_options):
+        self.pool_size = max(1, pool_size)
+        # WorkerSlot arguments: worker initializer, process start method, ...
+        self.slot_options = slot_options
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.idle = None
+        # Startup event and first request may race to start the pool
+        self.start_lock = asyncio.Lock()
+        # (priority, arrival, future) of requests waiting for a worker
+        self.waiters = []
+        self.arrivals = itertools.count()
+        self.slots = []
+        self.waiting = 0
+        self.running = 0
+
+    async def start(self):
+        """Starts the workers, once; later calls wait for the first to finish."""
+        async with self.start_lock:
+            if self.idle is not None:
+                return
+            loop = asyncio.get_running_loop()
+            slots = await asyncio.gather(
+                *[loop.run_in_executor(None, functools.partial(WorkerSlot, **self.slot_options)) for _ in range(self.pool_size)]
+            )
+            self.idle = []
+            self.slots = slots
+            for slot in self.slots:
+                self.release(slot)
+
+    @property
+    def ready(self):
+        return self.idle is not None and len(self.slots) == self.pool_size
+
+    def shutdown(self):
+        # In-flight requests have drained by the time the app shuts down
+        for slot in self.slots:
+            slot.kill()
+        self.slots = []
+        self.idle = None
+
+    async def generate(self, language, code, output_format="mermaid", profile=None, max_nodes=None, detail=None, simplify=False):
+        """Returns (result, stats), see run_generator."""
+        return await self.submit(
+            run_generator, language, code, output_format, profile, max_nodes, detail, simplify,
+            priority=LANGUAGE_PRIORITY.get(language, PRIORITY_NORMAL),
+        )
+
+    async def acquire(self, priority):
+        if self.idle and not self.waiters:
+            return self.idle.pop()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.arrivals), future))
+        self.waiting += 1
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Handed a worker just as the request was cancelled: pass it on
+            if future.done() and not future.cancelled():
+                self.release(future.result())
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self, slot):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(slot)
+                return
+        self.idle.append(slot)
+
+    async def submit(self, fn, *args, priority=PRIORITY_NORMAL):
+        """Runs a picklable top-level function on a worker, subject to the queue
+        limit and timeout. Waiting requests get a worker in priority order."""
+        if self.idle is None:
+            await self.start()
+        if not self.idle and self.waiting >= self.max_queue:
+            raise EngineBusy(f"{self.waiting} requests already queued")
+
+        slot = await self.acquire(priority)
+
+        loop = asyncio.get_running_loop()
+        self.running += 1
+        try:
+            try:
+                future = slot.executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # The worker died while idle (e.g. OOM killed): replace it, this job never ran
+                await loop.run_in_executor(None, slot.restart)
+                future = slot.executor.submit(fn, *args)
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            await loop.run_in_executor(None, slot.restart)
+            raise EngineTimeout(f"Generation exceeded {self.timeout}s")
+        except BrokenProcessPool:
+            # Died mid-job (killed, or crashed in C code): replace the worker
+            await loop.run_in_executor(None, slot.restart)
+            raise
+        finally:
+            self.running -= 1
+            self.release(slot)
+
+    def stats(self):
+        return {
+            "workers": self.pool_size,
+            "running": self.running,
+            "queued": self.waiting,
+            "max_queue": self.max_queue,
+            "timeout": self.timeout,
+        }
+
+
+flowchart_engine = FlowchartEngine()
+
+
+def trace_context():
+    # Trace workers are forked from a fork server that has only imported the
+    # tracer, never from the API process (whose memory holds other users'
+    # requests), and each one runs a single trace before it is replaced.
+    # Under `python main.py` each worker also imports main.py again (about a
+    # second); uvicorn started with -m, as start_services.py does, avoids that.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["tracer"])
+    return context
+
+
+# Separate pool so long-running traces can't starve flowchart requests. The
+# tracer enforces its own time budget; the engine timeout is the hard backstop.
+trace_engine = FlowchartEngine(
+    pool_size=TRACE_WORKERS,
+    timeout=float(os.getenv("TRACE_TIME_BUDGET", "5")) + 5,
+    initializer=warm_trace_worker,
+    mp_context=trace_context(),
+    max_tasks_per_child=1,
+)
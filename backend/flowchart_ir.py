@@ -0,0 +1,105 @@
+"""Compact intermediate representation shared by the flowchart generators.
+
+Nodes and edges live in parallel typed arrays, labels are interned, and the
+emission order is kept so the Mermaid renderer reproduces the generators'
+historical output byte for byte. Renderers live in flowchart_render.
+"""
+from array import array
+
+# Node shapes
+TERMINAL = 0   # ([label])
+BOX = 1        # ["label"]
+RAW_BOX = 2    # [label]
+IO = 3         # [/"label"/]
+DECISION = 4   # {"label"}
+CIRCLE = 5     # (( ))
+PLACEHOLDER = 6  # not rendered, stands in for a node outside a fragment
+HEXAGON = 7    # {{"label"}}, the JavaScript generator's decisions
+
+SHAPE_NAMES = ("terminal", "box", "box", "io", "decision", "circle", "placeholder", "decision")
+
+NO_LINE = 0
+NO_LABEL = -1
+
+
+class FlowchartGraph:
+    __slots__ = (
+        "node_ids", "node_index", "shapes", "labels", "lines", "classes",
+        "edge_from", "edge_to", "edge_labels", "order",
+        "strings", "string_index",
+    )
+
+    def __init__(self):
+        self.node_ids = []
+        self.node_index = {}
+        self.shapes = array("b")
+        self.labels = array("i")
+        self.lines = array("i")
+        self.classes = array("i")
+        self.edge_from = array("i")
+        self.edge_to = array("i")
+        self.edge_labels = array("i")
+        # Emission order: node k is stored as k, edge k as ~k
+        self.order = array("i")
+        self.strings = []
+        self.string_index = {}
+
+    def intern(self, text):
+        if text is None:
+            return NO_LABEL
+        index = self.string_index.get(text)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(text)
+            self.string_index[text] = index
+        return index
+
+    def string(self, index):
+        return None if index == NO_LABEL else self.strings[index]
+
+    def add_node(self, node_id, shape, label=None, line=None, css_class=None):
+        index = len(self.node_ids)
+        self.node_ids.append(node_id)
+        self.node_index[node_id] = index
+        self.shapes.append(shape)
+        self.labels.append(self.intern(label))
+        self.lines.append(line or NO_LINE)
+        self.classes.append(self.intern(css_class))
+        if shape != PLACEHOLDER:
+            self.order.append(index)
+        return index
+
+    def add_edge(self, from_node, to_node, label=None):
+        index = len(self.edge_from)
+        self.edge_from.append(self.node_index[from_node])
+        self.edge_to.append(self.node_index[to_node])
+        self.edge_labels.append(self.intern(label))
+        self.order.append(~index)
+        return index
+
+    @property
+    def node_count(self):
+        return len(self.order) - len(self.edge_from)
+
+    @property
+    def edge_count(self):
+        return len(self.edge_from)
+
+    def node(self, index):
+        """(id, shape, label, line, css_class) of node `index`."""
+        line = self.lines[index]
+        return (
+            self.node_ids[index],
+            self.shapes[index],
+            self.string(self.labels[index]),
+            line if line != NO_LINE else None,
+            self.string(self.classes[index]),
+        )
+
+    def edge(self, index):
+        """(from_id, to_id, label) of edge `index`."""
+        return (
+            self.node_ids[self.edge_from[index]],
+            self.node_ids[self.edge_to[index]],
+            self.string(self.edge_labels[index]),
+        )
@@ -0,0 +1,301 @@
+"""Node label rendering shared by the flowchart generators.
+
+Labels are cut to a fixed number of characters, so there is no point in
+rendering more of an expression than that: the renderers here take a character
+budget and stop as soon as it is exceeded, which keeps a 20 KB list literal as
+cheap as a short one. Rendering `limit + 1` characters is enough to produce
+exactly the label the full text would have given, because escaping only ever
+makes text longer.
+
+Escaping is a single str.translate pass. Both renderers walk operator chains
+in a loop rather than one call per operand, so a generated 3,000-term sum
+doesn't hit the recursion limit.
+"""
+import ast
+import re
+from contextlib import contextmanager
+
+from javalang.tree import ArrayInitializer, ArraySelector, BinaryOperation, ClassCreator, Literal, MemberReference, MethodInvocation, This
+
+ESCAPES = str.maketrans({
+    '"': "'",
+    "\n": " ",
+    "{": "&#123;",
+    "}": "&#125;",
+    "[": "&#91;",
+    "]": "&#93;",
+})
+
+
+class BudgetReached(Exception):
+    pass
+
+
+def escape(text):
+    return text.translate(ESCAPES)
+
+
+def safe_label(text, limit):
+    """Escapes text for a quoted Mermaid label and truncates it to `limit` characters."""
+    text = escape(text)
+    if len(text) > limit:
+        return text[:limit - 3] + "..."
+    return text
+
+
+# -- Python ------------------------------------------------------------------
+
+# Private, see unparser_works()
+Unparser = getattr(ast, "_Unparser", ast.NodeVisitor)
+
+# Lines as the tokenizer splits them (str.splitlines also breaks at \f, \x1c, ...)
+SOURCE_LINE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$")
+
+
+class SourceSegments:
+    """Exact source text of parsed nodes, sliced by their positions. That is
+    much cheaper than unparsing them, so the text serves as the memo key for
+    expressions that occur more than once in a file."""
+
+    def __init__(self, code):
+        self.lines = SOURCE_LINE.findall(code)
+        # Column offsets count UTF-8 bytes
+        self.encoded = {}
+
+    def line(self, lineno):
+        data = self.encoded.get(lineno)
+        if data is None:
+            data = self.encoded[lineno] = self.lines[lineno - 1].encode("utf-8", "surrogatepass")
+        return data
+
+    def text(self, node):
+        first, last = node.lineno, node.end_lineno
+        if first == last:
+            data = self.line(first)[node.col_offset:node.end_col_offset]
+        else:
+            data = b"".join(
+                [self.line(first)[node.col_offset:]]
+                + [self.line(lineno) for lineno in range(first + 1, last)]
+                + [self.line(last)[:node.end_col_offset]]
+            )
+        return data.decode("utf-8", "surrogatepass")
+
+
+class BoundedUnparser(Unparser):
+    """ast.unparse that gives up once more than `budget` characters are written.
+    The unparser writes strictly left to right, so what it has at that point
+    is a prefix of the full text. Writes into a temporary buffer (f-string
+    parts) don't count, the buffer is written out afterwards."""
+
+    def __init__(self, budget=None, **kwargs):
+        # f-strings unparse their parts with a fresh type(self)(...), unbounded
+        super().__init__(**kwargs)
+        self.budget = budget
+        self.length = 0
+        self.buffering = 0
+
+    @contextmanager
+    def buffered(self, buffer=None):
+        self.buffering += 1
+        try:
+            with super().buffered(buffer) as buffer:
+                yield buffer
+        finally:
+            self.buffering -= 1
+
+    def write(self, *text):
+        super().write(*text)
+        if self.budget is not None and not self.buffering:
+            self.length += sum(map(len, text))
+            if self.length > self.budget:
+                raise BudgetReached
+
+    def visit_BinOp(self, node):
+        # ast._Unparser.visit_BinOp, with the left operands walked in a loop:
+        # a + b + c nests to the left, and nothing is written before the innermost
+        chain = []
+        while isinstance(node, ast.BinOp):
+            operator = self.binop[node.op.__class__.__name__]
+            precedence = self.binop_precedence[operator]
+            if operator in self.binop_rassoc:
+                left_precedence, right_precedence = precedence.next(), precedence
+            else:
+                left_precedence, right_precedence = precedence, precedence.next()
+            parens = self.get_precedence(node) > precedence
+            if parens:
+                self.write("(")
+            chain.append((node, operator, right_precedence, parens))
+            self.set_precedence(left_precedence, node.left)
+            node = node.left
+
+        self.traverse(node)
+        for node, operator, right_precedence, parens in reversed(chain):
+            self.write(f" {operator} ")
+            self.set_precedence(right_precedence, node.right)
+            self.traverse(node.right)
+            if parens:
+                self.write(")")
+
+
+def bounded_expression_text(node, budget=None):
+    """Source text of an expression, or its first `budget`+ characters."""
+    unparser = BoundedUnparser(budget)
+    try:
+        return unparser.visit(node)
+    except BudgetReached:
+        return "".join(unparser._source)
+
+
+def full_expression_text(node, budget=None):
+    # The whole text, the caller's safe_label() truncates it
+    return ast.unparse(node)
+
+
+def unparser_works():
+    """BoundedUnparser builds on ast._Unparser, which is private: check once
+    that it still renders exactly what ast.unparse does."""
+    sample = ast.parse('f(a + b * (c - d), [1, 2], *e)[k] if x else -y ** f"{z!r:>4}" + w', mode="eval").body
+    try:
+        text = bounded_expression_text(sample)
+        return text == ast.unparse(sample) and bounded_expression_text(sample, 10) == text[:len(bounded_expression_text(sample, 10))]
+    except Exception:
+        return False
+
+
+# Without a compatible ast._Unparser labels are rendered in full and truncated
+python_expression_text = bounded_expression_text if unparser_works() else full_expression_text
+
+
+# -- Java --------------------------------------------------------------------
+
+class TextWriter:
+    __slots__ = ("parts", "length", "budget")
+
+    def __init__(self, budget=None):
+        self.parts = []
+        self.length = 0
+        self.budget = budget
+
+    def write(self, text):
+        self.parts.append(text)
+        if self.budget is not None:
+            self.length += len(text)
+            if self.length > self.budget:
+                raise BudgetReached
+
+
+def literal_parts(expr):
+    return (str(expr.value),)
+
+
+def member_reference_parts(expr):
+    if expr.qualifier:
+        return (f"{expr.qualifier}.", str(expr.member))
+    return (str(expr.member),)
+
+
+def binary_operation_parts(expr):
+    return (expr.operandl, f" {expr.operator} ", expr.operandr)
+
+
+def method_invocation_parts(expr):
+    call = f"{expr.member}("
+    return ((f"{expr.qualifier}.", call) if expr.qualifier else (call,)) + interleave(expr.arguments, ", ") + (")",)
+
+
+def this_parts(expr):
+    return ("this",)
+
+
+def class_creator_parts(expr):
+    return (f"new {expr.type.name}(...)",)
+
+
+def array_initializer_parts(expr):
+    return ("{",) + interleave(expr.initializers, ", ") + ("}",)
+
+
+def array_selector_parts(expr):
+    return (expr.member, "[", expr.index, "]")
+
+
+def other_parts(expr):
+    # Fallback for other types
+    if hasattr(expr, "member"):
+        return (str(expr.member),)
+    if hasattr(expr, "value"):
+        return (str(expr.value),)
+    if hasattr(expr, "name"):
+        return (str(expr.name),)
+    return ("...",)
+
+
+# What each kind of expression writes: text, and the subexpressions to write in
+# between. A node type uses the first entry it is an instance of.
+JAVA_PARTS = {
+    Literal: literal_parts,
+    MemberReference: member_reference_parts,
+    BinaryOperation: binary_operation_parts,
+    MethodInvocation: method_invocation_parts,
+    This: this_parts,
+    ClassCreator: class_creator_parts,
+    ArrayInitializer: array_initializer_parts,
+    ArraySelector: array_selector_parts,
+}
+
+# JAVA_PARTS resolved per concrete node type
+java_parts_by_type = {}
+
+
+def java_parts(expr):
+    node_type = expr.__class__
+    parts = java_parts_by_type.get(node_type)
+    if parts is None:
+        parts = next((parts for base, parts in JAVA_PARTS.items() if issubclass(node_type, base)), other_parts)
+        java_parts_by_type[node_type] = parts
+    return parts(expr)
+
+
+def interleave(exprs, separator):
+    parts = []
+    for index, expr in enumerate(exprs):
+        if index:
+            parts.append(separator)
+        parts.append(expr)
+    return tuple(parts)
+
+
+def write_java_expressions(exprs, separator, out):
+    """Writes the expressions joined by `separator`; an explicit stack holds
+    what is still to be written, text and subexpressions."""
+    stack = list(reversed(interleave(exprs, separator)))
+    while stack:
+        item = stack.pop()
+        if item.__class__ is str:
+            out.write(item)
+        elif item is not None:
+            prefix = getattr(item, "prefix_operators", None)
+            if prefix:
+                out.write("".join(prefix))
+            postfix = getattr(item, "postfix_operators", None)
+            if postfix:
+                stack.append("".join(postfix))
+            stack.extend(reversed(java_parts(item)))
+
+
+def write_java_expression(expr, out):
+    write_java_expressions((expr,), None, out)
+
+
+def java_expression_text(expr, budget=None, separator=None):
+    """Source-like text of a javalang expression (or of a list of them joined
+    by `separator`), or its first `budget`+ characters."""
+    out = TextWriter(budget)
+    try:
+        if separator is None:
+            write_java_expression(expr, out)
+        else:
+            write_java_expressions(expr, separator, out)
+    except BudgetReached:
+        pass
+    return "".join(out.parts)
@@ -0,0 +1,129 @@
+"""Level-of-detail for large flowcharts.
+
+Mermaid's layout cost grows faster than linearly with the node count, so a
+request can ask for at most `max_nodes` nodes and/or at most `detail` levels of
+nested blocks. Blocks are statement lists the generators visit as a unit
+(function, loop and branch bodies, plus the top level). Collapsed blocks are
+drawn as a single "12 statements (L40–L71)" node that keeps its first line in
+the node ID, so the editor highlight and drill-down still work.
+
+The generator first renders everything while recording how many nodes each
+block produced; if that is over budget the collapse plan is made from those
+exact counts and the tree is rendered again with the chosen blocks collapsed.
+"""
+import math
+
+from flowchart_ir import BOX
+
+
+class Block:
+    __slots__ = ("key", "parent", "depth", "items", "nodes")
+
+    def __init__(self, key, parent, depth, items):
+        self.key = key
+        self.parent = parent
+        self.depth = depth
+        self.items = items
+        self.nodes = 0
+
+
+class LevelOfDetail:
+    def __init__(self, max_nodes=None, detail=None):
+        self.max_nodes = max_nodes
+        self.detail = detail
+        self.recording = True
+        self.blocks = []
+        self.stack = []
+        self.collapsed = set()
+        # Top-level blocks that are still over budget are drawn in chunks of this many items
+        self.chunk_size = {}
+        # One entry per summary node, returned to the client
+        self.summaries = []
+
+    def visit_block(self, generator, key, items):
+        """Yields a statement list for the generator to walk (see flowchart_walk),
+        or draws it as summary nodes if it is collapsed. `key` must identify the
+        block in both passes over the same tree."""
+        if self.recording:
+            parent = self.stack[-1] if self.stack else None
+            block = Block(key, parent, len(self.stack), len(items))
+            self.blocks.append(block)
+            self.stack.append(block)
+            before = generator.node_counter
+            yield items
+            block.nodes = generator.node_counter - before
+            self.stack.pop()
+            return
+
+        if key in self.chunk_size:
+            size = self.chunk_size[key]
+            for start in range(0, len(items), size):
+                self.add_summary(generator, items[start:start + size])
+        elif key in self.collapsed:
+            self.add_summary(generator, items)
+        else:
+            yield items
+
+    def add_summary(self, generator, items):
+        statements, first_line, last_line = generator.summarize_block(items)
+        if not statements:
+            return
+        noun = "statement" if statements == 1 else "statements"
+        node = generator.add_node(BOX, f"{statements} {noun} (L{first_line}–L{last_line})", first_line, "process")
+        generator.add_edge(generator.last_node, node)
+        generator.last_node = node
+        self.summaries.append({
+            "id": node,
+            "statements": statements,
+            "start_line": first_line,
+            "end_line": last_line,
+        })
+
+    def plan(self, total_nodes):
+        """Chooses the blocks to collapse from the recorded counts. Returns True if
+        the graph has to be rendered again."""
+        self.recording = False
+        current = {block.key: block.nodes for block in self.blocks}
+
+        def collapse(block):
+            saving = current[block.key] - 1
+            if saving <= 0:
+                return 0
+            self.collapsed.add(block.key)
+            current[block.key] = 1
+            parent = block.parent
+            while parent is not None:
+                current[parent.key] -= saving
+                parent = parent.parent
+            return saving
+
+        # Deepest blocks first, so the outer structure survives the longest
+        nested = sorted((block for block in self.blocks if block.depth > 0), key=lambda block: -block.depth)
+
+        if self.detail is not None:
+            for block in nested:
+                if block.depth > self.detail:
+                    total_nodes -= collapse(block)
+
+        if self.max_nodes is not None and total_nodes > self.max_nodes:
+            by_depth = {}
+            for block in nested:
+                by_depth.setdefault(block.depth, []).append(block)
+            for depth in sorted(by_depth, reverse=True):
+                # Within a level, the biggest savings first
+                for block in sorted(by_depth[depth], key=lambda block: -current[block.key]):
+                    if total_nodes <= self.max_nodes:
+                        break
+                    total_nodes -= collapse(block)
+                if total_nodes <= self.max_nodes:
+                    break
+
+            if total_nodes > self.max_nodes:
+                # Even the top level alone is too big: summarise it in chunks
+                # (Start and End are the two nodes outside every block)
+                available = max(1, self.max_nodes - 2)
+                for block in self.blocks:
+                    if block.depth == 0 and current[block.key] > available:
+                        self.chunk_size[block.key] = math.ceil(block.items / available)
+
+        return bool(self.collapsed or self.chunk_size)
@@ -0,0 +1,64 @@
+from flowchart_ir import BOX, CIRCLE, DECISION, HEXAGON, IO, RAW_BOX, SHAPE_NAMES, TERMINAL
+
+STYLE_LINES = (
+    "    classDef startend fill:#003366,stroke:#333,stroke-width:2px,color:white",
+    "    classDef process fill:#0070C0,stroke:#333,stroke-width:2px,color:white",
+    "    classDef decision fill:#4CAF50,stroke:#333,stroke-width:2px,color:white",
+    "    classDef io fill:#0070C0,stroke:#333,stroke-width:2px,color:white",
+    "    style Start fill:#003366,stroke:#333,stroke-width:2px,color:white",
+)
+
+SHAPE_TEMPLATES = {
+    TERMINAL: "([{}])",
+    BOX: '["{}"]',
+    RAW_BOX: "[{}]",
+    IO: '[/"{}"/]',
+    DECISION: '{{"{}"}}',
+    CIRCLE: "(( ))",
+    HEXAGON: '{{{{"{}"}}}}',
+}
+
+
+def mermaid_node(graph, index):
+    node_id, shape, label, _, css_class = graph.node(index)
+    declaration = node_id + SHAPE_TEMPLATES[shape].format(label)
+    if css_class:
+        declaration += f":::{css_class}"
+    return declaration
+
+
+def mermaid_edge(graph, index):
+    from_node, to_node, label = graph.edge(index)
+    if label:
+        return f"{from_node} -->|{label}| {to_node}"
+    return f"{from_node} --> {to_node}"
+
+
+def to_mermaid(graph):
+    lines = ["flowchart TD"]
+    for item in graph.order:
+        if item >= 0:
+            lines.append("    " + mermaid_node(graph, item))
+        else:
+            lines.append("    " + mermaid_edge(graph, ~item))
+    lines.extend(STYLE_LINES)
+    return "\n".join(lines)
+
+
+def to_json(graph):
+    nodes = []
+    for item in graph.order:
+        if item >= 0:
+            node_id, shape, label, line, css_class = graph.node(item)
+            nodes.append({
+                "id": node_id,
+                "shape": SHAPE_NAMES[shape],
+                "label": label,
+                "line": line,
+                "class": css_class,
+            })
+    edges = [
+        dict(zip(("from", "to", "label"), graph.edge(index)))
+        for index in range(graph.edge_count)
+    ]
+    return {"nodes": nodes, "edges": edges}
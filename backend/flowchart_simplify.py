@@ -0,0 +1,146 @@
+"""Graph simplification applied after generation.
+
+Two passes over the IR:
+
+1. Placeholder elimination: the generators emit "Yes"/"No", "Loop Body",
+   "Next Item", "End Loop" boxes and empty merge circles that carry no
+   information beyond the edge labels around them. Such a node (no line, no
+   class, a single unlabelled way out) is bypassed and its incoming edges are
+   re-pointed at its successor.
+2. Basic-block coalescing: straight-line runs of statement nodes (a single
+   unlabelled edge between them, no other way in) become one node with a
+   multi-line label, capped at MAX_BLOCK_STATEMENTS.
+
+A merged node keeps the ID (and so the `_L<line>` suffix) of its first
+statement; the lines of every merged statement are returned in the line map.
+"""
+import os
+
+from flowchart_ir import BOX, CIRCLE, IO, FlowchartGraph
+
+# Bump whenever the simplified output changes, cached results include it
+SIMPLIFY_VERSION = "1"
+
+MAX_BLOCK_STATEMENTS = int(os.getenv("FLOWCHART_MAX_BLOCK_STATEMENTS", "10"))
+
+STATEMENT_CLASSES = ("process", "io")
+
+# Function entries stay separate nodes, so every function is visible at a glance
+LEADER_PREFIXES = ("Def ",)
+
+
+def simplify(graph, keep=(), max_block=MAX_BLOCK_STATEMENTS):
+    """Returns (simplified graph, {node_id: [lines]} for every merged node).
+    Nodes whose IDs are in `keep` (e.g. level-of-detail summaries) are never merged."""
+    count = len(graph.node_ids)
+    shapes = list(graph.shapes)
+    labels = [graph.string(index) for index in graph.labels]
+    lines = [line or None for line in graph.lines]
+    classes = [graph.string(index) for index in graph.classes]
+    keep = set(keep)
+
+    # Edges as mutable [from, to, label]; None once removed
+    edges = [
+        [graph.edge_from[index], graph.edge_to[index], graph.string(graph.edge_labels[index])]
+        for index in range(graph.edge_count)
+    ]
+    outgoing = [[] for _ in range(count)]
+    incoming = [[] for _ in range(count)]
+    for index, (from_node, to_node, _) in enumerate(edges):
+        outgoing[from_node].append(index)
+        incoming[to_node].append(index)
+    removed = [False] * count
+
+    # 1. Placeholders
+    for node in range(count):
+        if shapes[node] not in (BOX, CIRCLE) or lines[node] is not None or classes[node] is not None:
+            continue
+        if graph.node_ids[node] in keep or len(outgoing[node]) != 1 or not incoming[node]:
+            continue
+        exit_index = outgoing[node][0]
+        _, successor, exit_label = edges[exit_index]
+        if successor == node:
+            continue
+        if exit_label and (len(incoming[node]) > 1 or any(edges[index][2] for index in incoming[node])):
+            continue # both sides labelled, nothing to fold the label into
+        if any(edges[index][0] == successor for index in incoming[node]):
+            continue # would become a self-loop (e.g. an empty loop body)
+
+        incoming[successor].remove(exit_index)
+        edges[exit_index] = None
+        for index in incoming[node]:
+            edge = edges[index]
+            edge[1] = successor
+            edge[2] = edge[2] or exit_label
+            incoming[successor].append(index)
+        incoming[node] = []
+        outgoing[node] = []
+        removed[node] = True
+
+    # 2. Basic blocks
+    def is_statement(node):
+        return (
+            not removed[node]
+            and shapes[node] in (BOX, IO)
+            and classes[node] in STATEMENT_CLASSES
+            and lines[node] is not None
+            and graph.node_ids[node] not in keep
+            and not (labels[node] or "").startswith(LEADER_PREFIXES)
+        )
+
+    line_map = {}
+    for node in range(count):
+        if not is_statement(node):
+            continue
+        block_labels = [labels[node]]
+        block_lines = [lines[node]]
+        block_shapes = {shapes[node]}
+        while len(block_labels) < max_block and len(outgoing[node]) == 1:
+            index = outgoing[node][0]
+            _, follower, label = edges[index]
+            if label or follower == node or len(incoming[follower]) != 1 or not is_statement(follower):
+                break
+            block_labels.append(labels[follower])
+            block_lines.append(lines[follower])
+            block_shapes.add(shapes[follower])
+            edges[index] = None
+            outgoing[node] = outgoing[follower]
+            for follower_index in outgoing[follower]:
+                edges[follower_index][0] = node
+            incoming[follower] = []
+            outgoing[follower] = []
+            removed[follower] = True
+
+        if len(block_labels) > 1:
+            labels[node] = "<br/>".join(block_labels)
+            if block_shapes == {IO}:
+                shapes[node], classes[node] = IO, "io"
+            else:
+                shapes[node], classes[node] = BOX, "process"
+            line_map[graph.node_ids[node]] = block_lines
+
+    # Rebuild in the original emission order. A re-pointed edge can now refer
+    # to a node declared further down; it is emitted right after that node.
+    simplified = FlowchartGraph()
+    added = [False] * count
+    waiting = {}
+
+    def emit(edge):
+        from_node, to_node, label = edge
+        missing = to_node if not added[to_node] else from_node if not added[from_node] else None
+        if missing is None:
+            simplified.add_edge(graph.node_ids[from_node], graph.node_ids[to_node], label)
+        else:
+            waiting.setdefault(missing, []).append(edge)
+
+    for item in graph.order:
+        if item >= 0:
+            if removed[item]:
+                continue
+            simplified.add_node(graph.node_ids[item], shapes[item], labels[item], lines[item], classes[item])
+            added[item] = True
+            for edge in waiting.pop(item, ()):
+                emit(edge)
+        elif edges[~item] is not None:
+            emit(edges[~item])
+    return simplified, line_map
@@ -0,0 +1,243 @@
+"""Persistent flowchart results, shared by all uvicorn workers and kept across restarts.
+
+A SQLite database in WAL mode, so every worker can read while one writes.
+Keys are the exact-source keys from flowchart_cache.source_key (language,
+generator version, SHA-256 of the source, plus the output options), so a
+lookup needs no parsing; results are stored as zlib-compressed JSON. When the
+stored bytes exceed FLOWCHART_STORE_BYTES the least recently used entries are
+deleted (access times are only refreshed once per ACCESS_RESOLUTION, so reads
+stay reads).
+
+Pre-populate it from the exercise bank with
+
+    python flowchart_store.py prepopulate path/to/exercises [--store PATH]
+
+which renders every .py, .java and .js file below the directory in the variant
+the editor requests (Mermaid, simplified). Set FLOWCHART_STORE_PATH to "" to
+disable the store.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from flowchart_cache import source_key, variant_key
+
+STORE_PATH = os.getenv("FLOWCHART_STORE_PATH", "flowchart_store.sqlite3")
+STORE_MAX_BYTES = int(os.getenv("FLOWCHART_STORE_BYTES", str(512 * 1024 * 1024)))
+# Writers wait at most this long for another worker's write to finish
+BUSY_TIMEOUT_MS = 200
+ACCESS_RESOLUTION = 3600
+# Evict down to this fraction of the budget, so eviction doesn't run on every write
+EVICT_TO = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+"""
+
+EXTENSIONS = {".py": "python", ".java": "java", ".js": "javascript"}
+
+
+class FlowchartStore:
+    def __init__(self, path=STORE_PATH, max_bytes=STORE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def connection(self):
+        # One connection per thread and process (uvicorn workers fork after import)
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            # WAL + NORMAL: commits don't fsync, a power cut can only lose the latest results
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            connection = self.connection()
+            row = connection.execute("SELECT value, accessed FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - row[1] > ACCESS_RESOLUTION:
+                connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(zlib.decompress(row[0]))
+        except sqlite3.Error:
+            # The store is an optimisation; a locked or broken file means a miss
+            self.errors += 1
+            return None
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        value = zlib.compress(json.dumps(result, separators=(",", ":")).encode("utf-8", "surrogatepass"))
+        try:
+            connection = self.connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, len(value) + len(key), time.time()),
+            )
+            with self.lock:
+                if self.total_bytes is None:
+                    self.total_bytes = self.stored_bytes(connection)
+                else:
+                    self.total_bytes += len(value) + len(key)
+                over = self.total_bytes > self.max_bytes
+            if over:
+                self.evict(connection)
+        except sqlite3.Error:
+            self.errors += 1
+
+    def stored_bytes(self, connection):
+        return connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def evict(self, connection):
+        """Deletes least recently used entries until the store is under EVICT_TO of its budget."""
+        # Other workers write too: recount rather than trust the running total
+        total = self.stored_bytes(connection)
+        target = self.max_bytes * EVICT_TO
+        if total > self.max_bytes:
+            excess = total - target
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                freed = 0
+                doomed = []
+                for key, size in connection.execute("SELECT key, size FROM results ORDER BY accessed"):
+                    if freed >= excess:
+                        break
+                    doomed.append((key,))
+                    freed += size
+                connection.executemany("DELETE FROM results WHERE key = ?", doomed)
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+            total -= freed
+        with self.lock:
+            self.total_bytes = total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+flowchart_store = FlowchartStore()
+
+
+# -- prepopulation ---------------------------------------------------------------
+
+def source_files(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            language = EXTENSIONS.get(os.path.splitext(name)[1])
+            if language is not None:
+                yield os.path.join(root, name), language
+
+
+def render_file(path, language):
+    from flowchart_engine import run_generator
+    with open(path, encoding="utf-8", errors="surrogateescape") as f:
+        code = f.read()
+    result, _ = run_generator(language, code, simplify=True)
+    # The variant the editor requests: Mermaid, simplified, no level of detail
+    return variant_key(source_key(language, code), language, simplify=True), result
+
+
+def prepopulate(directory, store, workers=None):
+    """Renders every source file below `directory` into the store, skipping
+    files that are already stored. Returns (rendered, skipped, failed)."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    pending = []
+    skipped = 0
+    for path, language in source_files(directory):
+        with open(path, encoding="utf-8", errors="surrogateescape") as f:
+            code = f.read()
+        if store.get(variant_key(source_key(language, code), language, simplify=True)) is not None:
+            skipped += 1
+        else:
+            pending.append((path, language))
+
+    rendered = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(path, executor.submit(render_file, path, language)) for path, language in pending]
+        for path, future in futures:
+            try:
+                key, result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{path}: {e}", file=sys.stderr)
+                continue
+            store.put(key, result)
+            rendered += 1
+    return rendered, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the persistent flowchart store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("prepopulate", help="render every .py/.java/.js file below a directory into the store")
+    fill.add_argument("directory")
+    fill.add_argument("--store", default=STORE_PATH or "flowchart_store.sqlite3", help="store file (default: %(default)s)")
+    fill.add_argument("--max-bytes", type=int, default=STORE_MAX_BYTES)
+    fill.add_argument("--workers", type=int, default=None, help="rendering processes (default: one per core)")
+    commands.add_parser("stats", help="print the entry count and size of the store").add_argument(
+        "--store", default=STORE_PATH or "flowchart_store.sqlite3"
+    )
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        connection = FlowchartStore(args.store).connection()
+        entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        print(f"{args.store}: {entries} entries, {size} bytes")
+        return
+
+    store = FlowchartStore(args.store, args.max_bytes)
+    started = time.perf_counter()
+    rendered, skipped, failed = prepopulate(args.directory, store, args.workers)
+    print(f"Rendered {rendered}, already stored {skipped}, failed {failed} in {time.perf_counter() - started:.1f}s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Non-recursive statement traversal for the flowchart generators.
+
+The generators used to recurse once per nesting level (visit -> visit_If ->
+visit_body -> visit ...), so deeply nested code could hit the recursion limit
+and every statement paid for a few Python calls and a method lookup by name.
+`walk` keeps the pending blocks on an explicit stack instead, and finds each
+node's handler in a table keyed by its exact type.
+
+A handler is called with the node and returns either None (a simple statement
+that has drawn itself) or an iterable of blocks, usually a generator: it draws
+what comes before a block, yields the block's statements, and is resumed once
+they have all been walked.
+
+    def visit_While(self, node):
+        loop_start = ...
+        yield node.body
+        self.add_edge(self.last_node, loop_start)
+"""
+
+
+def walk(blocks, handlers, default=None):
+    """Walks the statements of each block in `blocks`, depth first and in order.
+
+    `handlers` maps a node's type to its handler; `default` handles the types
+    that aren't in it, and nodes without either are skipped.
+    """
+    pending = []
+    task = iter(blocks)
+    nodes = iter(())
+    while True:
+        for node in nodes:
+            handler = handlers.get(node.__class__, default)
+            if handler is None:
+                continue
+            nested = handler(node)
+            if nested is not None:
+                # Walk the node's blocks first, then carry on with this one
+                pending.append((task, nodes))
+                task = iter(nested)
+                nodes = iter(())
+                break
+        else:
+            block = next(task, None)
+            if block is not None:
+                nodes = iter(block)
+            elif pending:
+                task, nodes = pending.pop()
+            else:
+                return
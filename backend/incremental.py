@@ -0,0 +1,242 @@
+"""Incremental flowchart generation.
+
+The source is split into top-level regions (Python: each top-level statement,
+Java: each MethodDeclaration). Every region is rendered once into a template
+whose node IDs and line numbers are relative to the region, and the template is
+cached under a structural fingerprint. Unchanged regions are reused and only
+get their line numbers shifted. Node IDs don't include line numbers (those are
+sent in a separate map), so they stay stable when lines are added or removed
+elsewhere and the client can patch the graph using the node/edge diff.
+"""
+import ast
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import javalang
+from javalang.tree import MethodDeclaration
+
+from flowchart_cache import FlowchartCache
+from flowchart_ir import PLACEHOLDER, FlowchartGraph
+from flowchart_render import mermaid_node, to_mermaid
+from python_parser import GENERATOR_VERSION as PYTHON_GENERATOR_VERSION, MermaidGenerator
+from java_parser import GENERATOR_VERSION as JAVA_GENERATOR_VERSION, JavaMermaidGenerator, java_nodes
+
+REGION_CACHE_BYTES = int(os.getenv("FLOWCHART_REGION_CACHE_BYTES", str(32 * 1024 * 1024)))
+MAX_VERSIONS = int(os.getenv("FLOWCHART_MAX_VERSIONS", "512"))
+
+# Stands in for the previous region's last node while a region is rendered
+ENTRY_ID = "__entry__"
+ENTRY = 0
+
+region_cache = FlowchartCache(REGION_CACHE_BYTES)
+
+
+def render_region(generator, base_line, visit):
+    """Renders one region into a relocatable fragment of the flowchart IR."""
+    fragment = FlowchartGraph()
+    fragment.add_node(ENTRY_ID, PLACEHOLDER)
+    generator.graph = fragment
+    generator.last_node = ENTRY_ID
+    visit()
+    return {
+        "graph": fragment,
+        "base_line": base_line,
+        "exit": fragment.node_index[generator.last_node],
+    }
+
+
+def template_size(template):
+    graph = template["graph"]
+    return 32 * (len(graph.node_ids) + graph.edge_count) + sum(len(text) for text in graph.strings)
+
+
+def python_region_fingerprint(stmt):
+    lines = ",".join(
+        str(node.lineno - stmt.lineno) for node in ast.walk(stmt) if isinstance(node, ast.stmt)
+    )
+    return ast.dump(stmt) + "|" + lines
+
+
+def java_node_dump(node, base_line, out):
+    if isinstance(node, javalang.ast.Node):
+        out.append(type(node).__name__)
+        if node.position:
+            out.append(f"@{node.position.line - base_line}")
+        out.append("(")
+        for attr in node.attrs:
+            java_node_dump(getattr(node, attr), base_line, out)
+            out.append(",")
+        out.append(")")
+    elif isinstance(node, (list, tuple)):
+        out.append("[")
+        for child in node:
+            java_node_dump(child, base_line, out)
+            out.append(",")
+        out.append("]")
+    elif isinstance(node, set):
+        out.append(repr(sorted(node)))
+    else:
+        out.append(repr(node))
+
+
+def java_region_fingerprint(method, base_line):
+    out = []
+    java_node_dump(method, base_line, out)
+    return "".join(out)
+
+
+def region_template(language, version, fingerprint, render, base_line):
+    key = f"{language}:{version}:" + hashlib.sha256(fingerprint.encode("utf-8", "surrogatepass")).hexdigest()
+    template = region_cache.get(key)
+    if template is None:
+        template = render(base_line)
+        region_cache.put(key, template, size=template_size(template))
+    # 64 bits of the fingerprint hash, so distinct regions don't share IDs
+    return key[-16:], template
+
+
+def python_regions(code):
+    tree = ast.parse(code)
+    for stmt in tree.body:
+        def render(base_line, stmt=stmt):
+            generator = MermaidGenerator()
+            return render_region(generator, base_line, lambda: generator.visit(stmt))
+
+        yield region_template(
+            "python", PYTHON_GENERATOR_VERSION, python_region_fingerprint(stmt), render, stmt.lineno
+        ) + (stmt.lineno,)
+
+
+def java_regions(code):
+    tree = JavaMermaidGenerator().parse(code)
+    for method in java_nodes(tree, MethodDeclaration):
+        base_line = method.position.line if method.position else 0
+
+        def render(base_line, method=method):
+            generator = JavaMermaidGenerator()
+            return render_region(generator, base_line, lambda: generator.visit_method(method))
+
+        yield region_template(
+            "java", JAVA_GENERATOR_VERSION, java_region_fingerprint(method, base_line), render, base_line
+        ) + (base_line,)
+
+
+def generate_incremental(language, code):
+    """Returns {"mermaid", "version", "nodes", "edges", "lines"} where nodes maps
+    node ID to its Mermaid declaration, edges is a list of [from, to, label] and
+    lines maps node ID to its source line."""
+    if language == "python":
+        generator = MermaidGenerator()
+        regions = python_regions
+    elif language == "java":
+        generator = JavaMermaidGenerator()
+        regions = java_regions
+    else:
+        raise ValueError(f"No incremental generator for {language}")
+
+    graph = generator.graph
+    last_node = "Start"
+    seen = {}
+    try:
+        for region_key, template, base_line in regions(code):
+            # Identical regions (e.g. two `x = 1` lines) need distinct IDs
+            occurrence = seen.get(region_key, 0)
+            seen[region_key] = occurrence + 1
+            prefix = f"R{region_key}" + (f"x{occurrence}" if occurrence else "")
+
+            fragment = template["graph"]
+            shift = base_line - template["base_line"]
+            ids = [last_node] + [f"{prefix}N{local}" for local in range(1, len(fragment.node_ids))]
+
+            # Replay in emission order so Mermaid lays it out like the regular generator
+            for item in fragment.order:
+                if item >= 0:
+                    _, shape, label, line, css_class = fragment.node(item)
+                    graph.add_node(ids[item], shape, label, line + shift if line is not None else None, css_class)
+                else:
+                    edge = ~item
+                    graph.add_edge(
+                        ids[fragment.edge_from[edge]],
+                        ids[fragment.edge_to[edge]],
+                        fragment.string(fragment.edge_labels[edge]),
+                    )
+            last_node = ids[template["exit"]]
+    except Exception:
+        # Fall back to the regular generator so the error chart is identical
+        generator = type(generator)()
+        result = {"mermaid": generator.generate(code), "version": None, "nodes": {}, "edges": [], "lines": {}}
+        if generator.error:
+            result["error"] = generator.error
+        return result
+
+    generator.last_node = last_node
+    mermaid = to_mermaid(generator.finish())
+
+    nodes = {}
+    lines = {}
+    for item in graph.order:
+        if item >= 0:
+            node_id = graph.node_ids[item]
+            nodes[node_id] = mermaid_node(graph, item)
+            line = graph.node(item)[3]
+            if line is not None:
+                lines[node_id] = line
+    edges = [list(graph.edge(index)) for index in range(graph.edge_count)]
+
+    # Moving code changes only the line map, which is still a new version
+    version = hashlib.sha256(mermaid.encode("utf-8", "surrogatepass"))
+    version.update(json.dumps(lines).encode("utf-8"))
+    return {
+        "mermaid": mermaid,
+        "version": version.hexdigest()[:16],
+        "nodes": nodes,
+        "edges": edges,
+        "lines": lines,
+    }
+
+
+class VersionStore:
+    """Remembers the node/edge sets of recently served graphs so the next
+    request can be answered with a diff."""
+
+    def __init__(self, max_versions=MAX_VERSIONS):
+        self.max_versions = max_versions
+        self.versions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, version, nodes, edges, lines):
+        with self.lock:
+            self.versions[version] = (nodes, edges, lines)
+            self.versions.move_to_end(version)
+            while len(self.versions) > self.max_versions:
+                self.versions.popitem(last=False)
+
+    def get(self, version):
+        with self.lock:
+            entry = self.versions.get(version)
+            if entry is not None:
+                self.versions.move_to_end(version)
+            return entry
+
+
+def diff_graphs(old_nodes, old_edges, old_lines, new_nodes, new_edges, new_lines):
+    old_edge_set = {tuple(edge) for edge in old_edges}
+    new_edge_set = {tuple(edge) for edge in new_edges}
+    return {
+        "added_nodes": {
+            node_id: decl for node_id, decl in new_nodes.items() if old_nodes.get(node_id) != decl
+        },
+        "removed_nodes": [node_id for node_id in old_nodes if node_id not in new_nodes],
+        "added_edges": [list(edge) for edge in new_edges if tuple(edge) not in old_edge_set],
+        "removed_edges": [list(edge) for edge in old_edges if tuple(edge) not in new_edge_set],
+        # Source lines of nodes that are new or have moved
+        "lines": {
+            node_id: line for node_id, line in new_lines.items() if old_lines.get(node_id) != line
+        },
+    }
+
+
+version_store = VersionStore()
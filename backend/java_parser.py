@@ -1,9 +1,253 @@
 import javalang
-from javalang.tree import MethodDeclaration, BlockStatement, Statement, IfStatement, WhileStatement, ReturnStatement, MethodInvocation, Assignment, VariableDeclarator, LocalVariableDeclaration, ForStatement, MemberReference, Literal, BinaryOperation
+from javalang.ast import Node
+from javalang.tree import MethodDeclaration, BlockStatement, Statement, IfStatement, WhileStatement, ReturnStatement, MethodInvocation, Assignment, VariableDeclarator, LocalVariableDeclaration, ForStatement
+
+from javalang.parser import Parser
+from javalang.tokenizer import Annotation, BasicType, Identifier, Modifier, Separator, tokenize
+
+from flowchart_ir import BOX, CIRCLE, DECISION, IO, RAW_BOX, TERMINAL, FlowchartGraph
+from flowchart_labels import java_expression_text, safe_label
+from flowchart_lod import LevelOfDetail
+from flowchart_render import to_mermaid
+from flowchart_walk import walk
+
+# Bump whenever the generated Mermaid changes, so cached flowcharts are invalidated
+GENERATOR_VERSION = "1"
+
+# Labels longer than this are cut to LABEL_LIMIT - 3 characters plus "...";
+# expressions are rendered up to LABEL_BUDGET characters, which decides the label
+LABEL_LIMIT = 100
+LABEL_BUDGET = LABEL_LIMIT + 1
+
+# Snippet shapes, in the order the old retry chain tried them
+COMPILATION_UNIT = "compilation_unit"
+CLASS_MEMBERS = "class_members"
+STATEMENTS = "statements"
+SNIPPET_SHAPES = (COMPILATION_UNIT, CLASS_MEMBERS, STATEMENTS)
+
+WRAPPERS = {
+    COMPILATION_UNIT: ("", ""),
+    CLASS_MEMBERS: ("public class TempClass { ", " }"),
+    STATEMENTS: ("public class TempClass { public static void main(String[] args) { ", " } }"),
+}
+
+# Pre-tokenized wrappers, so a wrapped snippet is tokenized once and parsed once
+WRAPPER_TOKENS = {
+    shape: (list(tokenize(prefix)), list(tokenize(suffix)))
+    for shape, (prefix, suffix) in WRAPPERS.items()
+}
+
+TYPE_KEYWORDS = {"class", "interface", "enum"}
+HEADER_KEYWORDS = {"package", "import"}
+# Modifiers that are legal on locals; anything else (public, static, ...) means a member
+LOCAL_MODIFIERS = {"final"}
+TYPE_END = (Identifier, BasicType)
+
+
+def parse_tokens(tokens, shape):
+    prefix, suffix = WRAPPER_TOKENS[shape]
+    return Parser(prefix + tokens + suffix).parse()
+
+
+def skip_annotations_and_modifiers(head, i):
+    member_only = False
+    while i < len(head):
+        token = head[i]
+        if isinstance(token, Annotation) and not (i + 1 < len(head) and head[i + 1].value == "interface"):
+            i += 2  # '@' Name
+            if i < len(head) and head[i].value == "(":
+                depth = 0
+                while i < len(head):
+                    depth += {"(": 1, ")": -1}.get(head[i].value, 0)
+                    i += 1
+                    if depth == 0:
+                        break
+        elif isinstance(token, Modifier):
+            member_only = member_only or token.value not in LOCAL_MODIFIERS
+            i += 1
+        else:
+            break
+    return i, member_only
+
+
+def skip_type(head, i):
+    """Returns the index after a type (Foo, int, java.util.List<String>[]), or None."""
+    if i >= len(head) or not (isinstance(head[i], TYPE_END) or head[i].value == "void"):
+        return None
+    i += 1
+    while i < len(head):
+        value = head[i].value
+        if value == "<":
+            depth = 0
+            while i < len(head):
+                value = head[i].value
+                if value in ("<", ">", ">>", ">>>"):
+                    depth += 1 if value == "<" else -len(value)
+                i += 1
+                if depth <= 0:
+                    break
+        elif value == "." and i + 1 < len(head) and isinstance(head[i + 1], Identifier):
+            i += 2
+        elif value == "[" and i + 1 < len(head) and head[i + 1].value == "]":
+            i += 2
+        else:
+            break
+    return i
+
+
+def classify_unit(head):
+    """Classifies one top-level declaration/statement from its leading tokens."""
+    i, member_only = skip_annotations_and_modifiers(head, 0)
+    if i >= len(head):
+        return "member" if member_only else "ambiguous"
+    first = head[i]
+
+    if first.value in HEADER_KEYWORDS:
+        return "header"
+    if first.value in TYPE_KEYWORDS or (isinstance(first, Annotation) and head[i + 1].value == "interface"):
+        return "type"
+    if first.value == "{":
+        # Initializer block when static, otherwise also a valid statement block
+        return "member" if member_only else "ambiguous"
+    if first.value == "<":
+        return "member"  # generic method
+
+    # Constructor: Name(...) { / throws
+    if isinstance(first, Identifier) and i + 1 < len(head) and head[i + 1].value == "(":
+        close = matching_paren(head, i + 1)
+        if close is not None and close + 1 < len(head) and head[close + 1].value in ("{", "throws"):
+            return "member"
+        return "statement"
+
+    after_type = skip_type(head, i)
+    if after_type is not None and after_type < len(head) and isinstance(head[after_type], Identifier):
+        following = head[after_type + 1].value if after_type + 1 < len(head) else ";"
+        if following == "(":
+            return "member"  # method
+        if following in ("=", ";", ",", "["):
+            # Field or local variable: both wrappings accept it
+            return "member" if member_only else "ambiguous"
+    return "statement"
+
+
+def matching_paren(head, i):
+    depth = 0
+    for j in range(i, len(head)):
+        depth += {"(": 1, ")": -1}.get(head[j].value, 0)
+        if depth == 0:
+            return j
+    return None
+
+
+def split_units(tokens):
+    """Yields the leading tokens of each top-level (brace depth 0) unit."""
+    head = []
+    braces = []  # True for a body/block brace, False for an initializer or anonymous class
+    parens = 0
+    assigning = False
+    for token in tokens:
+        value = token.value
+        if not braces:
+            head.append(token)
+        if not isinstance(token, Separator) and not (isinstance(token, javalang.tokenizer.Operator) and value == "="):
+            continue
+        if not braces:
+            parens += {"(": 1, ")": -1}.get(value, 0)
+            if value == "=" and parens == 0:
+                assigning = True
+        if value == "{":
+            braces.append(braces[-1] if braces else not assigning)
+        elif value == "}" and braces:
+            block = braces.pop()
+            if not braces and block:
+                yield head
+                head, parens, assigning = [], 0, False
+        elif value == ";" and not braces:
+            if len(head) > 1:
+                yield head
+            head, parens, assigning = [], 0, False
+    if head:
+        yield head
+
+
+def classify_snippet(tokens):
+    """Decides from one token pass whether the input is a compilation unit,
+    class members or bare statements. Ambiguous input resolves to the first
+    shape the old retry chain would have accepted."""
+    kinds = set()
+    for head in split_units(tokens):
+        kinds.add(classify_unit(head))
+        if "statement" in kinds:
+            return STATEMENTS
+
+    if not kinds or kinds <= {"header", "type"}:
+        return COMPILATION_UNIT
+    if "header" in kinds:
+        return COMPILATION_UNIT  # let the parser report the error
+    return CLASS_MEMBERS
+
+
+def java_nodes(root, node_type=Node):
+    """The nodes of a javalang tree that are instances of node_type, in the
+    order Node.filter yields them, but walked with an explicit stack rather
+    than a generator per level (which is slow on deep trees and can hit the
+    recursion limit)."""
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, Node):
+            if isinstance(item, node_type):
+                yield item
+            stack.extend(reversed(item.children))
+        elif isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+
+
+def statement_handler(node_type):
+    """The name of the visitor for a node type; the checks overlap, so their order matters."""
+    if issubclass(node_type, BlockStatement):
+        return "visit_block"
+    if issubclass(node_type, LocalVariableDeclaration):
+        return "visit_local_variables"
+    if issubclass(node_type, Statement) and "expression" in node_type.attrs:
+        return "visit_statement_expression"
+    if issubclass(node_type, IfStatement):
+        return "visit_if"
+    if issubclass(node_type, ForStatement):
+        return "visit_for"
+    if issubclass(node_type, WhileStatement):
+        return "visit_while"
+    if issubclass(node_type, ReturnStatement):
+        return "visit_return"
+    if issubclass(node_type, MethodDeclaration):
+        return "visit_method_declaration"
+    return None
+
+
+# Visitors by node type; statements without one aren't drawn
+HANDLERS = {
+    node_type: statement_handler(node_type)
+    for node_type in vars(javalang.tree).values()
+    if isinstance(node_type, type) and issubclass(node_type, Node) and statement_handler(node_type)
+}
+HANDLERS[list] = "visit_block"
 
 class JavaMermaidGenerator:
-    def __init__(self):
-        self.graph = ["flowchart TD", "    Start([Start]):::startend"]
+    def __init__(self, max_nodes=None, detail=None):
+        self.reset()
+        self.error = None
+        self.error_message = None
+        self.classified_as = None
+        self.parse_path = None
+        # Rendered expression text by node, shared by both level-of-detail passes
+        self.labels = {}
+        # Only set when the caller asked for a node budget / detail level
+        self.lod = LevelOfDetail(max_nodes, detail) if max_nodes or detail is not None else None
+        self.handlers = {node_type: getattr(self, name) for node_type, name in HANDLERS.items()}
+
+    def reset(self):
+        self.graph = FlowchartGraph()
+        self.graph.add_node("Start", TERMINAL, "Start", css_class="startend")
         self.node_counter = 0
         self.last_node = "Start"
 
@@ -18,302 +262,288 @@ class JavaMermaidGenerator:
         if not text:
             return ""
         # Escape special characters
-        safe = str(text).replace('"', "'").replace('\n', ' ').replace('{', '&#123;').replace('}', '&#125;').replace('[', '&#91;').replace(']', '&#93;')
-        
-        # Relax truncation for "exact values"
-        if len(safe) > 100:
-            return safe[:97] + "..."
-        return safe
+        return safe_label(str(text), LABEL_LIMIT)
+
+    def add_node(self, shape, label, line_number=None, css_class=None):
+        node_id = self.new_node_id(line_number)
+        self.graph.add_node(node_id, shape, label, line_number, css_class)
+        return node_id
 
     def add_edge(self, from_node, to_node, label=None):
-        if label:
-            self.graph.append(f"    {from_node} -->|{label}| {to_node}")
-        else:
-            self.graph.append(f"    {from_node} --> {to_node}")
+        self.graph.add_edge(from_node, to_node, label)
 
-    def get_expression_string(self, expr):
-        """Recursively reconstructs the string representation of an expression."""
-        if expr is None:
-            return ""
-        
-        # Handle operators
-        prefix = ""
-        postfix = ""
-        if hasattr(expr, 'prefix_operators') and expr.prefix_operators:
-            prefix = "".join(expr.prefix_operators)
-        if hasattr(expr, 'postfix_operators') and expr.postfix_operators:
-            postfix = "".join(expr.postfix_operators)
-
-        base = ""
-        
-        if isinstance(expr, Literal):
-            base = str(expr.value)
-        
-        elif isinstance(expr, MemberReference):
-            base = expr.member
-            if expr.qualifier:
-                base = f"{expr.qualifier}.{base}"
-        
-        elif isinstance(expr, BinaryOperation):
-            left = self.get_expression_string(expr.operandl)
-            right = self.get_expression_string(expr.operandr)
-            base = f"{left} {expr.operator} {right}"
-                
-        elif isinstance(expr, MethodInvocation):
-            args = ", ".join([self.get_expression_string(arg) for arg in expr.arguments])
-            qualifier = f"{expr.qualifier}." if expr.qualifier else ""
-            base = f"{qualifier}{expr.member}({args})"
-            
-        elif isinstance(expr, javalang.tree.This):
-            base = "this"
-            
-        elif isinstance(expr, javalang.tree.ClassCreator):
-             base = f"new {expr.type.name}(...)"
+    def statement_list(self, statement):
+        """then/else/loop bodies as a list of statements."""
+        if isinstance(statement, list):
+            return statement
+        if isinstance(statement, BlockStatement):
+            return statement.statements or []
+        return [statement]
 
-        elif isinstance(expr, javalang.tree.ArrayInitializer):
-             vals = ", ".join([self.get_expression_string(val) for val in expr.initializers])
-             base = f"{{{vals}}}"
-        
-        elif isinstance(expr, javalang.tree.ArraySelector):
-            base = f"{self.get_expression_string(expr.member)}[{self.get_expression_string(expr.index)}]"
+    def visit_body(self, owner, part, statements):
+        if self.lod is None:
+            return (statements,)
+        return self.lod.visit_block(self, (id(owner), part), statements)
 
-        else:
-            # Fallback for other types
-            if hasattr(expr, 'member'): base = expr.member
-            elif hasattr(expr, 'value'): base = str(expr.value)
-            elif hasattr(expr, 'name'): base = expr.name
-            else: base = "..."
-        
-        return f"{prefix}{base}{postfix}"
+    def summarize_block(self, statements):
+        """(statement count, first line, last line) of a collapsed block."""
+        count = 0
+        lines = []
+        for statement in statements:
+            for node in java_nodes(statement):
+                if isinstance(node, (Statement, LocalVariableDeclaration)) and not isinstance(node, BlockStatement):
+                    count += 1
+                if getattr(node, "position", None):
+                    lines.append(node.position.line)
+        if not count or not lines:
+            return 0, None, None
+        return count, min(lines), max(lines)
 
-    def generate(self, code):
+    def get_expression_string(self, expr, budget=None, separator=None):
+        """Source-like text of an expression (or of a list of them joined by
+        `separator`), rendered only as far as `budget` characters."""
+        key = (id(expr), budget, separator)
+        entry = self.labels.get(key)
+        if entry is None:
+            # The entry holds on to the node, so its id can't be reused meanwhile
+            entry = self.labels[key] = (expr, java_expression_text(expr, budget, separator))
+        return entry[1]
+
+    def parse(self, code):
+        """Parses the snippet once, using classify_snippet to pick the wrapping.
+
+        Falls back to the old try-each-wrapping chain only if the classifier
+        guessed wrong. Sets self.parse_path to the wrapping that succeeded.
+        """
         try:
-            # Try parsing as is first (maybe it's a full class)
+            tokens = list(tokenize(code))
+        except javalang.tokenizer.LexerError:
+            tokens = None
+
+        shape = classify_snippet(tokens) if tokens is not None else None
+        self.classified_as = shape
+        if shape is not None:
             try:
-                tree = javalang.parse.parse(code)
+                tree = parse_tokens(tokens, shape)
+                self.parse_path = shape
+                return tree
             except javalang.parser.JavaSyntaxError:
-                # If that fails, try wrapping in a class
-                try:
-                    wrapped_code = "public class TempClass { " + code + " }"
-                    tree = javalang.parse.parse(wrapped_code)
-                except javalang.parser.JavaSyntaxError:
-                    # If that fails, try wrapping in main method inside a class
-                    wrapped_code = "public class TempClass { public static void main(String[] args) { " + code + " } }"
-                    tree = javalang.parse.parse(wrapped_code)
+                pass
+
+        # Fallback: try each wrapping in turn, skipping the one already tried
+        last_error = None
+        for fallback in SNIPPET_SHAPES:
+            if fallback == shape:
+                continue
+            try:
+                if tokens is not None:
+                    tree = parse_tokens(tokens, fallback)
+                else:
+                    tree = javalang.parse.parse(WRAPPERS[fallback][0] + code + WRAPPERS[fallback][1])
+                self.parse_path = f"{fallback} (fallback)"
+                return tree
+            except javalang.parser.JavaSyntaxError as e:
+                last_error = e
+        raise last_error
+
+    def visit(self, node):
+        walk(([node],), self.handlers)
+
+    def visit_method(self, node):
+        """Draws a method (or constructor) and its body."""
+        walk(self.visit_method_declaration(node), self.handlers)
+
+    def visit_method_declaration(self, node):
+        method_name = node.name
+        line = node.position.line if node.position else None
+        method_node = self.add_node(RAW_BOX, f"Def {self.safe_label(method_name)}", line, "process")
+        self.add_edge(self.last_node, method_node)
+        self.last_node = method_node
+        
+        if node.body:
+            yield from self.visit_body(node, "body", node.body)
+
+    def finish(self):
+        self.graph.add_node("End", TERMINAL, "End", css_class="startend")
+        self.add_edge(self.last_node, "End")
+        return self.graph
+
+    def generate_graph(self, code):
+        """Builds the flowchart IR, or returns None (with self.error set) on failure."""
+        try:
+            tree = self.parse(code)
 
             # Find main method or just traverse first method found
-            for path, node in tree.filter(MethodDeclaration):
-                method_name = node.name
-                line = node.position.line if node.position else None
-                method_node = self.new_node_id(line)
-                self.graph.append(f'    {method_node}[Def {self.safe_label(method_name)}]:::process')
-                self.add_edge(self.last_node, method_node)
-                self.last_node = method_node
-                
-                if node.body:
-                    for stmt in node.body:
-                        self.visit(stmt)
-            
-            self.graph.append(f"    End([End]):::startend")
-            self.add_edge(self.last_node, "End")
-            
-            # Add Styling Definitions
-            self.graph.append("    classDef startend fill:#003366,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    classDef process fill:#0070C0,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    classDef decision fill:#4CAF50,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    classDef io fill:#0070C0,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    style Start fill:#003366,stroke:#333,stroke-width:2px,color:white")
-            
-            return "\n".join(self.graph)
+            methods = list(java_nodes(tree, MethodDeclaration))
+            walk(self.visit_body(tree, "methods", methods), self.handlers)
+            if self.lod is not None and self.lod.plan(self.node_counter + 2):
+                # Over budget: draw again with the chosen blocks collapsed
+                self.reset()
+                walk(self.visit_body(tree, "methods", methods), self.handlers)
+
+            return self.finish()
         except Exception as e:
-            return f'flowchart TD\n    Error["Error parsing Java code: {self.safe_label(str(e))}"]'
+            self.error = str(e) or type(e).__name__
+            self.error_message = str(e)
+            return None
 
-    def visit(self, node):
-        if isinstance(node, BlockStatement) or isinstance(node, list):
-            # Handle list of statements (block)
-            statements = node if isinstance(node, list) else (node.statements if hasattr(node, 'statements') else [])
-            for stmt in statements:
-                self.visit(stmt)
-                
-        elif isinstance(node, LocalVariableDeclaration):
-            line = node.position.line if node.position else None
-            for declarator in node.declarators:
-                var_name = declarator.name
-                init_val = "..." 
-                if declarator.initializer:
-                    init_val = self.get_expression_string(declarator.initializer)
-                
-                var_node = self.new_node_id(line)
-                self.graph.append(f'    {var_node}["{self.safe_label(f"{var_name} = {init_val}")}"]:::process')
-                self.add_edge(self.last_node, var_node)
-                self.last_node = var_node
-
-        elif isinstance(node, Statement) and hasattr(node, 'expression'):
-            line = node.position.line if node.position else None
-            expr = node.expression
-            
-            if isinstance(expr, MethodInvocation):
-                call_name = expr.member
-                # Check for System.out.println
-                is_io = False
-                qualifier = str(expr.qualifier) if expr.qualifier else ""
-                
-                if (qualifier == "System.out" or qualifier == "out") and (call_name == "println" or call_name == "print"):
-                    is_io = True
-                
-                call_node = self.new_node_id(line)
-                
-                label = f"Call {call_name}"
-                if is_io:
-                    args_str = ", ".join([self.get_expression_string(arg) for arg in expr.arguments])
-                    label = f"print({args_str})"
-                else:
-                    label = f"{call_name}(...)"
+    def error_chart(self):
+        return f'flowchart TD\n    Error["Error parsing Java code: {self.safe_label(self.error_message)}"]'
 
-                if is_io:
-                    self.graph.append(f'    {call_node}[/"{self.safe_label(label)}"/]:::io')
-                else:
-                    self.graph.append(f'    {call_node}["{self.safe_label(label)}"]:::process')
-                
-                self.add_edge(self.last_node, call_node)
-                self.last_node = call_node
-                
-            elif isinstance(expr, Assignment):
-                line = node.position.line if node.position else None
-                target = self.get_expression_string(expr.expressionl)
-                val = self.get_expression_string(expr.value)
-                
-                assign_node = self.new_node_id(line)
-                self.graph.append(f'    {assign_node}["{self.safe_label(f"{target} = {val}")}"]:::process')
-                self.add_edge(self.last_node, assign_node)
-                self.last_node = assign_node
-
-        elif isinstance(node, IfStatement):
-            line = node.position.line if node.position else None
-            condition = self.get_expression_string(node.condition)
-            
-            decision_node = self.new_node_id(line)
-            self.graph.append(f'    {decision_node}{{"{self.safe_label(condition)}?"}}:::decision')
-            self.add_edge(self.last_node, decision_node)
-            
-            entry_node = decision_node
-            
-            # True Branch
-            self.last_node = entry_node
-            yes_node = self.new_node_id()
-            self.graph.append(f'    {yes_node}["Yes"]')
-            self.add_edge(entry_node, yes_node, "True")
-            self.last_node = yes_node
-            
-            if node.then_statement:
-                if isinstance(node.then_statement, list):
-                     for s in node.then_statement: self.visit(s)
-                else:
-                    self.visit(node.then_statement)
+    def generate(self, code):
+        graph = self.generate_graph(code)
+        if graph is None:
+            return self.error_chart()
+        return to_mermaid(graph)
+
+    def visit_block(self, node):
+        # A list of statements, or a nested { ... } block
+        return (node if isinstance(node, list) else node.statements,)
+
+    def visit_local_variables(self, node):
+        line = node.position.line if node.position else None
+        for declarator in node.declarators:
+            var_name = declarator.name
+            init_val = "..." 
+            if declarator.initializer:
+                init_val = self.get_expression_string(declarator.initializer, LABEL_BUDGET)
             
-            true_end = self.last_node
+            var_node = self.add_node(BOX, self.safe_label(f"{var_name} = {init_val}"), line, "process")
+            self.add_edge(self.last_node, var_node)
+            self.last_node = var_node
+
+    def visit_statement_expression(self, node):
+        line = node.position.line if node.position else None
+        expr = node.expression
+        
+        if isinstance(expr, MethodInvocation):
+            call_name = expr.member
+            # Check for System.out.println
+            is_io = False
+            qualifier = str(expr.qualifier) if expr.qualifier else ""
             
-            # False Branch
-            self.last_node = entry_node
-            no_node = self.new_node_id()
-            self.graph.append(f'    {no_node}["No"]')
-            self.add_edge(entry_node, no_node, "False")
-            self.last_node = no_node
+            if (qualifier == "System.out" or qualifier == "out") and (call_name == "println" or call_name == "print"):
+                is_io = True
             
-            if node.else_statement:
-                 if isinstance(node.else_statement, list):
-                     for s in node.else_statement: self.visit(s)
-                 else:
-                    self.visit(node.else_statement)
+            label = f"Call {call_name}"
+            if is_io:
+                args_str = self.get_expression_string(expr.arguments, LABEL_BUDGET, ", ")
+                label = f"print({args_str})"
+            else:
+                label = f"{call_name}(...)"
+
+            if is_io:
+                call_node = self.add_node(IO, self.safe_label(label), line, "io")
+            else:
+                call_node = self.add_node(BOX, self.safe_label(label), line, "process")
             
-            false_end = self.last_node
+            self.add_edge(self.last_node, call_node)
+            self.last_node = call_node
             
-            # Merge
-            merge_node = self.new_node_id()
-            self.graph.append(f'    {merge_node}(( ))')
-            self.add_edge(true_end, merge_node)
-            self.add_edge(false_end, merge_node)
-            self.last_node = merge_node
-
-        elif isinstance(node, ForStatement):
+        elif isinstance(expr, Assignment):
             line = node.position.line if node.position else None
+            target = self.get_expression_string(expr.expressionl, LABEL_BUDGET)
+            val = self.get_expression_string(expr.value, LABEL_BUDGET)
             
-            # Extract init, condition, update
-            init_str = ""
-            if node.control.init:
-                if isinstance(node.control.init, LocalVariableDeclaration):
-                     init_str = self.get_expression_string(node.control.init.declarators[0]) # Simplified
-                elif isinstance(node.control.init, list):
-                     init_str = ", ".join([self.get_expression_string(i) for i in node.control.init])
-            
-            condition = self.get_expression_string(node.control.condition) if node.control.condition else "True"
-            update = ", ".join([self.get_expression_string(u) for u in node.control.update]) if node.control.update else ""
+            assign_node = self.add_node(BOX, self.safe_label(f"{target} = {val}"), line, "process")
+            self.add_edge(self.last_node, assign_node)
+            self.last_node = assign_node
 
-            loop_start = self.new_node_id(line)
-            self.graph.append(f'    {loop_start}{{"{self.safe_label(condition)}?"}}:::decision')
-            self.add_edge(self.last_node, loop_start)
-            
-            # Body
-            self.last_node = loop_start
-            do_node = self.new_node_id()
-            self.graph.append(f'    {do_node}["Loop Body"]')
-            self.add_edge(loop_start, do_node, "True")
-            self.last_node = do_node
-            
-            if node.body:
-                if isinstance(node.body, list):
-                    for s in node.body: self.visit(s)
-                else:
-                    self.visit(node.body)
-            
-            # Update step (visualize it?)
-            if update:
-                update_node = self.new_node_id()
-                self.graph.append(f'    {update_node}["{self.safe_label(update)}"]:::process')
-                self.add_edge(self.last_node, update_node)
-                self.last_node = update_node
-
-            self.add_edge(self.last_node, loop_start)
-            
-            # Exit
-            end_loop = self.new_node_id()
-            self.graph.append(f'    {end_loop}["End Loop"]')
-            self.add_edge(loop_start, end_loop, "False")
-            self.last_node = end_loop
+    def visit_if(self, node):
+        line = node.position.line if node.position else None
+        condition = self.get_expression_string(node.condition, LABEL_BUDGET)
+        
+        decision_node = self.add_node(DECISION, f"{self.safe_label(condition)}?", line, "decision")
+        self.add_edge(self.last_node, decision_node)
+        
+        entry_node = decision_node
+        
+        # True Branch
+        self.last_node = entry_node
+        yes_node = self.add_node(BOX, "Yes")
+        self.add_edge(entry_node, yes_node, "True")
+        self.last_node = yes_node
+        
+        if node.then_statement:
+            yield from self.visit_body(node, "then", self.statement_list(node.then_statement))
+        
+        true_end = self.last_node
+        
+        # False Branch
+        self.last_node = entry_node
+        no_node = self.add_node(BOX, "No")
+        self.add_edge(entry_node, no_node, "False")
+        self.last_node = no_node
+        
+        if node.else_statement:
+            yield from self.visit_body(node, "else", self.statement_list(node.else_statement))
+        
+        false_end = self.last_node
+        
+        # Merge
+        merge_node = self.add_node(CIRCLE, None)
+        self.add_edge(true_end, merge_node)
+        self.add_edge(false_end, merge_node)
+        self.last_node = merge_node
 
-        elif isinstance(node, WhileStatement):
-            line = node.position.line if node.position else None
-            condition = self.get_expression_string(node.condition)
-            
-            loop_start = self.new_node_id(line)
-            self.graph.append(f'    {loop_start}{{"{self.safe_label(condition)}?"}}:::decision')
-            self.add_edge(self.last_node, loop_start)
-            
-            # Body
-            self.last_node = loop_start
-            do_node = self.new_node_id()
-            self.graph.append(f'    {do_node}["Loop Body"]')
-            self.add_edge(loop_start, do_node, "True")
-            self.last_node = do_node
-            
-            if node.body:
-                if isinstance(node.body, list):
-                    for s in node.body: self.visit(s)
-                else:
-                    self.visit(node.body)
-            
-            self.add_edge(self.last_node, loop_start)
-            
-            # Exit
-            end_loop = self.new_node_id()
-            self.graph.append(f'    {end_loop}["End Loop"]')
-            self.add_edge(loop_start, end_loop, "False")
-            self.last_node = end_loop
+    def visit_for(self, node):
+        line = node.position.line if node.position else None
+        
+        # Extract condition, update
+        condition = self.get_expression_string(node.control.condition, LABEL_BUDGET) if node.control.condition else "True"
+        update = self.get_expression_string(node.control.update, LABEL_BUDGET, ", ") if node.control.update else ""
 
-        elif isinstance(node, ReturnStatement):
-            line = node.position.line if node.position else None
-            val = self.get_expression_string(node.expression) if node.expression else ""
-            ret_node = self.new_node_id(line)
-            self.graph.append(f'    {ret_node}["Return {self.safe_label(val)}"]:::process')
-            self.add_edge(self.last_node, ret_node)
-            self.last_node = ret_node
+        loop_start = self.add_node(DECISION, f"{self.safe_label(condition)}?", line, "decision")
+        self.add_edge(self.last_node, loop_start)
+        
+        # Body
+        self.last_node = loop_start
+        do_node = self.add_node(BOX, "Loop Body")
+        self.add_edge(loop_start, do_node, "True")
+        self.last_node = do_node
+        
+        if node.body:
+            yield from self.visit_body(node, "body", self.statement_list(node.body))
+        
+        # Update step (visualize it?)
+        if update:
+            update_node = self.add_node(BOX, self.safe_label(update), css_class="process")
+            self.add_edge(self.last_node, update_node)
+            self.last_node = update_node
+
+        self.add_edge(self.last_node, loop_start)
+        
+        # Exit
+        end_loop = self.add_node(BOX, "End Loop")
+        self.add_edge(loop_start, end_loop, "False")
+        self.last_node = end_loop
+
+    def visit_while(self, node):
+        line = node.position.line if node.position else None
+        condition = self.get_expression_string(node.condition, LABEL_BUDGET)
+        
+        loop_start = self.add_node(DECISION, f"{self.safe_label(condition)}?", line, "decision")
+        self.add_edge(self.last_node, loop_start)
+        
+        # Body
+        self.last_node = loop_start
+        do_node = self.add_node(BOX, "Loop Body")
+        self.add_edge(loop_start, do_node, "True")
+        self.last_node = do_node
+        
+        if node.body:
+            yield from self.visit_body(node, "body", self.statement_list(node.body))
+        
+        self.add_edge(self.last_node, loop_start)
+        
+        # Exit
+        end_loop = self.add_node(BOX, "End Loop")
+        self.add_edge(loop_start, end_loop, "False")
+        self.last_node = end_loop
+
+    def visit_return(self, node):
+        line = node.position.line if node.position else None
+        val = self.get_expression_string(node.expression, LABEL_BUDGET) if node.expression else ""
+        ret_node = self.add_node(BOX, f"Return {self.safe_label(val)}", line, "process")
+        self.add_edge(self.last_node, ret_node)
+        self.last_node = ret_node
@@ -0,0 +1,924 @@
+"""JavaScript source text of esprima ASTs, for flowchart labels.
+
+A port of escodegen's generator (default options) for the node types esprima
+produces for scripts, so labels come out exactly as the Node service printed
+them. Like the other label renderers (flowchart_labels) it takes a character
+budget: once a fragment is longer than that, the rest of it is skipped.
+Whatever its parents add after it lands past the budget, so the first `budget`
+characters of the result are exact.
+
+Left-nested binary chains (`a + b + c + ...`) are generated in a loop instead of
+one call per operand.
+"""
+import unicodedata
+from contextlib import contextmanager
+from decimal import Decimal
+
+INDENT = "    "
+
+# escodegen's Precedence table
+SEQUENCE = 0
+YIELD = 1
+ASSIGNMENT = 1
+CONDITIONAL = 2
+ARROW_FUNCTION = 2
+COALESCE = 3
+UNARY = 15
+AWAIT = 15
+POSTFIX = 16
+CALL = 18
+NEW = 19
+TAGGED_TEMPLATE = 20
+MEMBER = 21
+PRIMARY = 22
+
+BINARY_PRECEDENCE = {
+    "??": 3, "||": 4, "&&": 5, "|": 6, "^": 7, "&": 8,
+    "==": 9, "!=": 9, "===": 9, "!==": 9,
+    "<": 10, ">": 10, "<=": 10, ">=": 10, "in": 10, "instanceof": 10,
+    "<<": 11, ">>": 11, ">>>": 11,
+    "+": 12, "-": 12, "*": 13, "%": 13, "/": 13, "**": 14,
+}
+
+# Expression flags
+ALLOW_IN = 1
+ALLOW_CALL = 2
+ALLOW_UNPARENTHESIZED_NEW = 4
+FOUND_COALESCE = 64
+E_FTT = ALLOW_CALL | ALLOW_UNPARENTHESIZED_NEW
+E_TTF = ALLOW_IN | ALLOW_CALL
+E_TTT = ALLOW_IN | ALLOW_CALL | ALLOW_UNPARENTHESIZED_NEW
+E_TFF = ALLOW_IN
+E_TFT = ALLOW_IN | ALLOW_UNPARENTHESIZED_NEW
+
+# Statement flags
+S_ALLOW_IN = 1
+FUNCTION_BODY = 8
+DIRECTIVE_CONTEXT = 16
+SEMICOLON_OPTIONAL = 32
+S_TFFF = S_ALLOW_IN
+S_TFFT = S_ALLOW_IN | SEMICOLON_OPTIONAL
+S_FFFF = 0
+S_TTFF = S_ALLOW_IN | FUNCTION_BODY
+
+LINE_TERMINATORS = "\n\r\u2028\u2029"
+# esutils.code.isWhiteSpace
+WHITESPACE = "\t\v\f \xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u202f\u205f\u3000\ufeff"
+IDENTIFIER_CATEGORIES = {"Lu", "Ll", "Lt", "Lm", "Lo", "Nl", "Mn", "Mc", "Nd", "Pc"}
+
+
+class CodegenError(Exception):
+    pass
+
+
+def is_identifier_part(char):
+    """esutils.code.isIdentifierPartES5 for one UTF-16 code unit."""
+    if char < "\x80":
+        return char.isalnum() or char in "$_"
+    if char in "\u200c\u200d":
+        return True
+    if "\ud800" <= char <= "\udfff":
+        return False
+    return unicodedata.category(char) in IDENTIFIER_CATEGORIES
+
+
+def is_whitespace(char):
+    return char != "" and char in WHITESPACE
+
+
+def is_line_terminator(char):
+    return char != "" and char in LINE_TERMINATORS
+
+
+def utf16_units(text):
+    """The string as JavaScript sees it: astral characters become surrogate pairs."""
+    if all(char <= "\uffff" for char in text):
+        return text
+    units = []
+    for char in text:
+        code = ord(char)
+        if code > 0xFFFF:
+            code -= 0x10000
+            units.append(chr(0xD800 + (code >> 10)))
+            units.append(chr(0xDC00 + (code & 0x3FF)))
+        else:
+            units.append(char)
+    return "".join(units)
+
+
+def number_text(value):
+    """Number.prototype.toString for a non-negative number."""
+    value = float(value)
+    if value != value:
+        raise CodegenError("Numeric literal whose value is NaN")
+    if value < 0:
+        raise CodegenError("Numeric literal whose value is negative")
+    if value == float("inf"):
+        return "1e+400"
+    if value == 0:
+        return "0"
+    # repr gives the shortest round-tripping digits, as JavaScript does
+    _, digits, exponent = Decimal(repr(value)).normalize().as_tuple()
+    digits = "".join(map(str, digits))
+    # value = 0.digits * 10 ** point
+    point = len(digits) + exponent
+    count = len(digits)
+    if count <= point <= 21:
+        return digits + "0" * (point - count)
+    if 0 < point <= 21:
+        return digits[:point] + "." + digits[point:]
+    if -6 < point <= 0:
+        return "0." + "0" * -point + digits
+    exponent = point - 1
+    sign = "+" if exponent >= 0 else "-"
+    if count == 1:
+        return f"{digits}e{sign}{abs(exponent)}"
+    return f"{digits[0]}.{digits[1:]}e{sign}{abs(exponent)}"
+
+
+def escape_allowed(code, following):
+    if code == 0x08:
+        return "\\b"
+    if code == 0x0C:
+        return "\\f"
+    if code == 0x09:
+        return "\\t"
+    if code > 0xFF:
+        return f"\\u{code:04X}"
+    if code == 0 and not ("0" <= following <= "9"):
+        return "\\0"
+    if code == 0x0B:
+        return "\\x0B"
+    return f"\\x{code:02X}"
+
+
+DISALLOWED = {"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\u2028": "\\u2028", "\u2029": "\\u2029"}
+
+
+def string_text(value):
+    """escodegen's escapeString with single quotes."""
+    value = utf16_units(value)
+    out = []
+    single_quotes = 0
+    for index, char in enumerate(value):
+        if char == "'":
+            single_quotes += 1
+        elif char in DISALLOWED:
+            out.append(DISALLOWED[char])
+            continue
+        elif not is_identifier_part(char) and (char < " " or char > "~"):
+            out.append(escape_allowed(ord(char), value[index + 1:index + 2]))
+            continue
+        out.append(char)
+    text = "".join(out)
+    if single_quotes:
+        text = text.replace("'", "\\'")
+    return f"'{text}'"
+
+
+def ends_with_line_terminator(text):
+    return is_line_terminator(text[-1:])
+
+
+def join(left, right):
+    if not left:
+        return right
+    if not right:
+        return left
+    last, first = left[-1], right[0]
+    if (last in "+-" and last == first) or (is_identifier_part(last) and is_identifier_part(first)) or (last == "/" and first == "i"):
+        return left + " " + right
+    if is_whitespace(last) or is_line_terminator(last) or is_whitespace(first) or is_line_terminator(first):
+        return left + right
+    return left + " " + right
+
+
+def parenthesize(text, current, should):
+    return f"({text})" if current < should else text
+
+
+class JavaScriptCodegen:
+    """escodegen.generate, cut short after `budget` characters."""
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.base = ""
+
+    def over(self, parts):
+        return self.budget is not None and sum(map(len, parts)) > self.budget
+
+    # -- helpers --------------------------------------------------------------
+
+    @contextmanager
+    def indented(self):
+        previous = self.base
+        self.base += INDENT
+        try:
+            yield self.base
+        finally:
+            self.base = previous
+
+    def maybe_block(self, stmt, flags):
+        if stmt.type == "BlockStatement":
+            return " " + self.statement(stmt, flags)
+        if stmt.type == "EmptyStatement":
+            return ";"
+        with self.indented():
+            return "\n" + self.base + self.statement(stmt, flags)
+
+    def maybe_block_suffix(self, stmt, result):
+        ends = ends_with_line_terminator(result)
+        if stmt.type == "BlockStatement" and not ends:
+            return result + " "
+        if ends:
+            return result + self.base
+        return result + "\n" + self.base
+
+    def pattern(self, node, precedence=ASSIGNMENT, flags=E_TTT):
+        if node.type == "Identifier":
+            return node.name
+        return self.expression(node, precedence, flags)
+
+    def function_params(self, node):
+        if node.type == "ArrowFunctionExpression" and len(node.params) == 1 and node.params[0].type == "Identifier":
+            return ("async " if node.isAsync else "") + node.params[0].name
+        parts = [("async " if node.isAsync else "")] if node.type == "ArrowFunctionExpression" else []
+        parts.append("(")
+        for index, param in enumerate(node.params):
+            parts.append(self.pattern(param, ASSIGNMENT, E_TTT))
+            if index + 1 < len(node.params):
+                parts.append(", ")
+            if self.over(parts):
+                return "".join(parts)
+        parts.append(")")
+        return "".join(parts)
+
+    def function_body(self, node):
+        result = self.function_params(node)
+        if node.type == "ArrowFunctionExpression":
+            result += " =>"
+        if self.over([result]):
+            return result
+        if node.expression:
+            body = self.expression(node.body, ASSIGNMENT, E_TTT)
+            if body.startswith("{"):
+                body = f"({body})"
+            return result + " " + body
+        return result + self.maybe_block(node.body, S_TTFF)
+
+    def property_key(self, key, computed):
+        text = self.expression(key, ASSIGNMENT, E_TTT)
+        return f"[{text}]" if computed else text
+
+    def assignment(self, left, right, operator, precedence, flags):
+        if ASSIGNMENT < precedence:
+            flags |= ALLOW_IN
+        text = self.expression(left, CALL, flags) + f" {operator} "
+        if not self.over([text]):
+            text += self.expression(right, ASSIGNMENT, flags)
+        return parenthesize(text, ASSIGNMENT, precedence)
+
+    def method_prefix(self, prop):
+        function = prop.value
+        prefix = ""
+        if function.isAsync:
+            prefix += "async "
+        if function.generator:
+            prefix += "*"
+        return prefix
+
+    # -- entry points -----------------------------------------------------------
+
+    def generate(self, node):
+        if node.type in STATEMENTS:
+            return self.statement(node, S_TFFF)
+        if node.type in EXPRESSIONS:
+            return self.expression(node, SEQUENCE, E_TTT)
+        raise CodegenError(f"Unknown node type: {node.type}")
+
+    def statement(self, stmt, flags):
+        method = STATEMENTS.get(stmt.type)
+        if method is None:
+            raise CodegenError(f"Unknown node type: {stmt.type}")
+        return method(self, stmt, flags)
+
+    def expression(self, expr, precedence, flags):
+        method = EXPRESSIONS.get(expr.type)
+        if method is None:
+            raise CodegenError(f"Unknown node type: {expr.type}")
+        return method(self, expr, precedence, flags)
+
+    # -- statements -------------------------------------------------------------
+
+    def statement_list(self, body, flags, last_flags):
+        parts = []
+        with self.indented():
+            for index, stmt in enumerate(body):
+                fragment = self.base + self.statement(stmt, last_flags if index == len(body) - 1 else flags)
+                parts.append(fragment)
+                if not ends_with_line_terminator(fragment):
+                    parts.append("\n")
+                if self.over(parts):
+                    break
+        return "".join(parts)
+
+    def BlockStatement(self, stmt, flags):
+        body_flags = S_TFFF
+        if flags & FUNCTION_BODY:
+            body_flags |= DIRECTIVE_CONTEXT
+        inner = self.statement_list(stmt.body, body_flags, body_flags | SEMICOLON_OPTIONAL)
+        return "{\n" + inner + self.base + "}"
+
+    def BreakStatement(self, stmt, flags):
+        return f"break {stmt.label.name};" if stmt.label else "break;"
+
+    def ContinueStatement(self, stmt, flags):
+        return f"continue {stmt.label.name};" if stmt.label else "continue;"
+
+    def ClassBody(self, stmt, flags):
+        parts = ["{\n"]
+        with self.indented() as indent:
+            for index, item in enumerate(stmt.body):
+                parts.append(indent)
+                parts.append(self.expression(item, SEQUENCE, E_TTT))
+                if index + 1 < len(stmt.body):
+                    parts.append("\n")
+                if self.over(parts):
+                    return "".join(parts)
+        result = "".join(parts)
+        if not ends_with_line_terminator(result):
+            result += "\n"
+        return result + self.base + "}"
+
+    def ClassDeclaration(self, stmt, flags):
+        result = "class"
+        if stmt.id:
+            result = join(result, self.expression(stmt.id, SEQUENCE, E_TTT))
+        if stmt.superClass:
+            result = join(result, join("extends", self.expression(stmt.superClass, UNARY, E_TTT)))
+        return result + " " + self.statement(stmt.body, S_TFFT)
+
+    def DoWhileStatement(self, stmt, flags):
+        result = join("do", self.maybe_block(stmt.body, S_TFFF))
+        result = self.maybe_block_suffix(stmt.body, result)
+        return join(result, "while (" + self.expression(stmt.test, SEQUENCE, E_TTT) + ")" + ";")
+
+    def CatchClause(self, stmt, flags):
+        with self.indented():
+            if stmt.param:
+                result = "catch (" + self.expression(stmt.param, SEQUENCE, E_TTT) + ")"
+            else:
+                result = "catch"
+        return result + self.maybe_block(stmt.body, S_TFFF)
+
+    def DebuggerStatement(self, stmt, flags):
+        return "debugger" + ";"
+
+    def EmptyStatement(self, stmt, flags):
+        return ";"
+
+    def ExpressionStatement(self, stmt, flags):
+        result = self.expression(stmt.expression, SEQUENCE, E_TTT)
+        # An expression statement can't start with "{", "class" or "function"
+        if result.startswith("{") or starts_with_keyword(result, "class", "{") or starts_with_keyword(result, "function", "(*") \
+                or starts_with_async_function(result):
+            return "(" + result + ")" + ";"
+        return result + ";"
+
+    def VariableDeclarator(self, stmt, flags):
+        item_flags = E_TTT if flags & S_ALLOW_IN else E_FTT
+        if stmt.init:
+            text = self.expression(stmt.id, ASSIGNMENT, item_flags) + " = "
+            if self.over([text]):
+                return text
+            return text + self.expression(stmt.init, ASSIGNMENT, item_flags)
+        return self.pattern(stmt.id, ASSIGNMENT, item_flags)
+
+    def VariableDeclaration(self, stmt, flags):
+        body_flags = S_TFFF if flags & S_ALLOW_IN else S_FFFF
+
+        def block():
+            parts = [stmt.kind, " "]
+            for index, declarator in enumerate(stmt.declarations):
+                if index:
+                    parts.append(", ")
+                parts.append(self.statement(declarator, body_flags))
+                if self.over(parts):
+                    break
+            return "".join(parts)
+
+        if len(stmt.declarations) > 1:
+            with self.indented():
+                result = block()
+        else:
+            result = block()
+        return result + ";"
+
+    def ThrowStatement(self, stmt, flags):
+        return join("throw", self.expression(stmt.argument, SEQUENCE, E_TTT)) + ";"
+
+    def TryStatement(self, stmt, flags):
+        result = "try" + self.maybe_block(stmt.block, S_TFFF)
+        result = self.maybe_block_suffix(stmt.block, result)
+        if stmt.handler:
+            result = join(result, self.statement(stmt.handler, S_TFFF))
+            if stmt.finalizer:
+                result = self.maybe_block_suffix(stmt.handler.body, result)
+        if stmt.finalizer:
+            result = join(result, "finally" + self.maybe_block(stmt.finalizer, S_TFFF))
+        return result
+
+    def SwitchStatement(self, stmt, flags):
+        with self.indented():
+            parts = ["switch (" + self.expression(stmt.discriminant, SEQUENCE, E_TTT) + ") {\n"]
+        body_flags = S_TFFF
+        for index, case in enumerate(stmt.cases or ()):
+            if index == len(stmt.cases) - 1:
+                body_flags |= SEMICOLON_OPTIONAL
+            fragment = self.base + self.statement(case, body_flags)
+            parts.append(fragment)
+            if not ends_with_line_terminator(fragment):
+                parts.append("\n")
+            if self.over(parts):
+                return "".join(parts)
+        parts.append(self.base + "}")
+        return "".join(parts)
+
+    def SwitchCase(self, stmt, flags):
+        with self.indented():
+            if stmt.test:
+                parts = [join("case", self.expression(stmt.test, SEQUENCE, E_TTT)) + ":"]
+            else:
+                parts = ["default:"]
+            consequent = stmt.consequent
+            index = 0
+            if consequent and consequent[0].type == "BlockStatement":
+                parts.append(self.maybe_block(consequent[0], S_TFFF))
+                index = 1
+            if index != len(consequent) and not ends_with_line_terminator("".join(parts)):
+                parts.append("\n")
+            body_flags = S_TFFF
+            while index < len(consequent):
+                if index == len(consequent) - 1 and flags & SEMICOLON_OPTIONAL:
+                    body_flags |= SEMICOLON_OPTIONAL
+                fragment = self.base + self.statement(consequent[index], body_flags)
+                parts.append(fragment)
+                if index + 1 != len(consequent) and not ends_with_line_terminator(fragment):
+                    parts.append("\n")
+                if self.over(parts):
+                    break
+                index += 1
+        return "".join(parts)
+
+    def IfStatement(self, stmt, flags):
+        with self.indented():
+            result = "if (" + self.expression(stmt.test, SEQUENCE, E_TTT) + ")"
+        if self.over([result]):
+            return result
+        body_flags = S_TFFF | (flags & SEMICOLON_OPTIONAL)
+        if stmt.alternate:
+            result += self.maybe_block(stmt.consequent, S_TFFF)
+            result = self.maybe_block_suffix(stmt.consequent, result)
+            if self.over([result]):
+                return result
+            if stmt.alternate.type == "IfStatement":
+                return join(result, "else " + self.statement(stmt.alternate, body_flags))
+            return join(result, join("else", self.maybe_block(stmt.alternate, body_flags)))
+        return result + self.maybe_block(stmt.consequent, body_flags)
+
+    def ForStatement(self, stmt, flags):
+        with self.indented():
+            parts = ["for ("]
+            if stmt.init:
+                if stmt.init.type == "VariableDeclaration":
+                    parts.append(self.statement(stmt.init, S_FFFF))
+                else:
+                    parts.append(self.expression(stmt.init, SEQUENCE, E_FTT) + ";")
+            else:
+                parts.append(";")
+            if stmt.test:
+                parts.append(" " + self.expression(stmt.test, SEQUENCE, E_TTT) + ";")
+            else:
+                parts.append(";")
+            if stmt.update:
+                parts.append(" " + self.expression(stmt.update, SEQUENCE, E_TTT) + ")")
+            else:
+                parts.append(")")
+        result = "".join(parts)
+        if self.over([result]):
+            return result
+        return result + self.maybe_block(stmt.body, S_TFFT if flags & SEMICOLON_OPTIONAL else S_TFFF)
+
+    def iteration(self, operator, stmt, flags):
+        result = "for ("
+        with self.indented():
+            if stmt.left.type == "VariableDeclaration":
+                with self.indented():
+                    result += stmt.left.kind + " " + self.statement(stmt.left.declarations[0], S_FFFF)
+            else:
+                result += self.expression(stmt.left, CALL, E_TTT)
+            result = join(result, operator)
+            result = join(result, self.expression(stmt.right, ASSIGNMENT, E_TTT)) + ")"
+        return result + self.maybe_block(stmt.body, flags)
+
+    def ForInStatement(self, stmt, flags):
+        return self.iteration("in", stmt, S_TFFT if flags & SEMICOLON_OPTIONAL else S_TFFF)
+
+    def ForOfStatement(self, stmt, flags):
+        return self.iteration("of", stmt, S_TFFT if flags & SEMICOLON_OPTIONAL else S_TFFF)
+
+    def LabeledStatement(self, stmt, flags):
+        return stmt.label.name + ":" + self.maybe_block(stmt.body, S_TFFT if flags & SEMICOLON_OPTIONAL else S_TFFF)
+
+    def Program(self, stmt, flags):
+        parts = []
+        body = stmt.body
+        for index, item in enumerate(body):
+            fragment = self.base + self.statement(item, S_TFFF | DIRECTIVE_CONTEXT | (SEMICOLON_OPTIONAL if index == len(body) - 1 else 0))
+            parts.append(fragment)
+            if index + 1 < len(body) and not ends_with_line_terminator(fragment):
+                parts.append("\n")
+            if self.over(parts):
+                break
+        return "".join(parts)
+
+    def FunctionDeclaration(self, stmt, flags):
+        prefix = "async " if stmt.isAsync else ""
+        star = "* " if stmt.generator else " "
+        return prefix + "function" + star + (stmt.id.name if stmt.id else "") + self.function_body(stmt)
+
+    def ReturnStatement(self, stmt, flags):
+        if stmt.argument:
+            return join("return", self.expression(stmt.argument, SEQUENCE, E_TTT)) + ";"
+        return "return" + ";"
+
+    def WhileStatement(self, stmt, flags):
+        with self.indented():
+            result = "while (" + self.expression(stmt.test, SEQUENCE, E_TTT) + ")"
+        if self.over([result]):
+            return result
+        return result + self.maybe_block(stmt.body, S_TFFT if flags & SEMICOLON_OPTIONAL else S_TFFF)
+
+    def WithStatement(self, stmt, flags):
+        with self.indented():
+            result = "with (" + self.expression(stmt.object, SEQUENCE, E_TTT) + ")"
+        if self.over([result]):
+            return result
+        return result + self.maybe_block(stmt.body, S_TFFT if flags & SEMICOLON_OPTIONAL else S_TFFF)
+
+    # -- expressions ------------------------------------------------------------
+
+    def SequenceExpression(self, expr, precedence, flags):
+        if SEQUENCE < precedence:
+            flags |= ALLOW_IN
+        parts = []
+        for index, item in enumerate(expr.expressions):
+            if index:
+                parts.append(", ")
+            parts.append(self.expression(item, ASSIGNMENT, flags))
+            if self.over(parts):
+                break
+        return parenthesize("".join(parts), SEQUENCE, precedence)
+
+    def AssignmentExpression(self, expr, precedence, flags):
+        return self.assignment(expr.left, expr.right, expr.operator, precedence, flags)
+
+    def AssignmentPattern(self, expr, precedence, flags):
+        return self.assignment(expr.left, expr.right, "=", precedence, flags)
+
+    def ArrowFunctionExpression(self, expr, precedence, flags):
+        return parenthesize(self.function_body(expr), ARROW_FUNCTION, precedence)
+
+    def ConditionalExpression(self, expr, precedence, flags):
+        if CONDITIONAL < precedence:
+            flags |= ALLOW_IN
+        parts = [self.expression(expr.test, COALESCE, flags), " ? "]
+        if not self.over(parts):
+            parts += [self.expression(expr.consequent, ASSIGNMENT, flags), " : "]
+            if not self.over(parts):
+                parts.append(self.expression(expr.alternate, ASSIGNMENT, flags))
+        return parenthesize("".join(parts), CONDITIONAL, precedence)
+
+    def BinaryExpression(self, expr, precedence, flags):
+        # Walk down the left operands first, then build outwards
+        chain = []
+        node = expr
+        while node.type in ("BinaryExpression", "LogicalExpression"):
+            if node.type == "LogicalExpression" and node.operator == "??":
+                flags |= FOUND_COALESCE
+            current = BINARY_PRECEDENCE[node.operator]
+            if current < precedence:
+                flags |= ALLOW_IN
+            chain.append((node, precedence, flags))
+            precedence = POSTFIX if node.operator == "**" else current
+            node = node.left
+        result = self.expression(node, precedence, flags)
+        for node, precedence, flags in reversed(chain):
+            operator = node.operator
+            current = BINARY_PRECEDENCE[operator]
+            if not self.over([result]):
+                if result.endswith("/") and is_identifier_part(operator[0]):
+                    result = result + " " + operator
+                else:
+                    result = join(result, operator)
+                right = self.expression(node.right, current if operator == "**" else current + 1, flags)
+                if (operator == "/" and right.startswith("/")) or (operator.endswith("<") and right.startswith("!--")):
+                    result = result + " " + right
+                else:
+                    result = join(result, right)
+            if operator == "in" and not flags & ALLOW_IN:
+                result = f"({result})"
+            elif operator in ("||", "&&") and flags & FOUND_COALESCE:
+                result = f"({result})"
+            else:
+                result = parenthesize(result, current, precedence)
+        return result
+
+    LogicalExpression = BinaryExpression
+
+    def arguments(self, args):
+        parts = ["("]
+        for index, argument in enumerate(args):
+            if index:
+                parts.append(", ")
+            parts.append(self.expression(argument, ASSIGNMENT, E_TTT))
+            if self.over(parts):
+                return "".join(parts)
+        parts.append(")")
+        return "".join(parts)
+
+    def CallExpression(self, expr, precedence, flags):
+        result = self.expression(expr.callee, CALL, E_TTF)
+        if expr.optional:
+            result += "?."
+        if not self.over([result]):
+            result += self.arguments(expr.arguments)
+        if not flags & ALLOW_CALL:
+            return f"({result})"
+        return parenthesize(result, CALL, precedence)
+
+    def ChainExpression(self, expr, precedence, flags):
+        if 17 < precedence:
+            flags |= ALLOW_CALL
+        return parenthesize(self.expression(expr.expression, 17, flags), 17, precedence)
+
+    def NewExpression(self, expr, precedence, flags):
+        result = join("new", self.expression(expr.callee, NEW, E_TFF))
+        if not self.over([result]):
+            result += self.arguments(expr.arguments)
+        return parenthesize(result, NEW, precedence)
+
+    def MemberExpression(self, expr, precedence, flags):
+        result = self.expression(expr.object, CALL, E_TTF if flags & ALLOW_CALL else E_TFF)
+        if self.over([result]):
+            return parenthesize(result, MEMBER, precedence)
+        if expr.computed:
+            if expr.optional:
+                result += "?."
+            result += "[" + self.expression(expr.property, SEQUENCE, E_TTT if flags & ALLOW_CALL else E_TFT) + "]"
+        else:
+            if not expr.optional and expr.object.type == "Literal" and is_number(expr.object.value):
+                if "." not in result and not any(char in result for char in "eExX") and result[-1:].isdigit() \
+                        and not (len(result) >= 2 and result[0] == "0"):
+                    result += " "
+            result += ("?." if expr.optional else ".") + expr.property.name
+        return parenthesize(result, MEMBER, precedence)
+
+    def MetaProperty(self, expr, precedence, flags):
+        meta = expr.meta if isinstance(expr.meta, str) else expr.meta.name
+        prop = expr.property if isinstance(expr.property, str) else expr.property.name
+        return parenthesize(f"{meta}.{prop}", MEMBER, precedence)
+
+    def UnaryExpression(self, expr, precedence, flags):
+        fragment = self.expression(expr.argument, UNARY, E_TTT)
+        operator = expr.operator
+        if len(operator) > 2:
+            result = join(operator, fragment)
+        elif fragment and ((operator[-1] in "+-" and operator[-1] == fragment[0]) or (is_identifier_part(operator[-1]) and is_identifier_part(fragment[0]))):
+            result = operator + " " + fragment
+        else:
+            result = operator + fragment
+        return parenthesize(result, UNARY, precedence)
+
+    def YieldExpression(self, expr, precedence, flags):
+        result = "yield*" if expr.delegate else "yield"
+        if expr.argument:
+            result = join(result, self.expression(expr.argument, YIELD, E_TTT))
+        return parenthesize(result, YIELD, precedence)
+
+    def AwaitExpression(self, expr, precedence, flags):
+        return parenthesize(join("await", self.expression(expr.argument, AWAIT, E_TTT)), AWAIT, precedence)
+
+    def UpdateExpression(self, expr, precedence, flags):
+        if expr.prefix:
+            return parenthesize(expr.operator + self.expression(expr.argument, UNARY, E_TTT), UNARY, precedence)
+        return parenthesize(self.expression(expr.argument, POSTFIX, E_TTT) + expr.operator, POSTFIX, precedence)
+
+    def FunctionExpression(self, expr, precedence, flags):
+        result = ("async " if expr.isAsync else "") + "function"
+        if expr.id:
+            result += ("* " if expr.generator else " ") + expr.id.name
+        else:
+            result += "* " if expr.generator else " "
+        return result + self.function_body(expr)
+
+    def ArrayExpression(self, expr, precedence, flags, is_pattern=False):
+        elements = expr.elements
+        if not elements:
+            return "[]"
+        multiline = not is_pattern and len(elements) > 1
+        parts = ["[", "\n" if multiline else ""]
+        with self.indented() as indent:
+            for index, element in enumerate(elements):
+                if element is None:
+                    if multiline:
+                        parts.append(indent)
+                    if index + 1 == len(elements):
+                        parts.append(",")
+                else:
+                    parts.append(indent if multiline else "")
+                    parts.append(self.expression(element, ASSIGNMENT, E_TTT))
+                if index + 1 < len(elements):
+                    parts.append(",\n" if multiline else ", ")
+                if self.over(parts):
+                    return "".join(parts)
+        result = "".join(parts)
+        if multiline and not ends_with_line_terminator(result):
+            result += "\n"
+        return result + (self.base if multiline else "") + "]"
+
+    def ArrayPattern(self, expr, precedence, flags):
+        return self.ArrayExpression(expr, precedence, flags, True)
+
+    def RestElement(self, expr, precedence, flags):
+        return "..." + self.pattern(expr.argument)
+
+    def ClassExpression(self, expr, precedence, flags):
+        return self.ClassDeclaration(expr, 0)
+
+    def MethodDefinition(self, expr, precedence, flags):
+        result = "static " if expr.static else ""
+        if expr.kind in ("get", "set"):
+            fragment = join(expr.kind, self.property_key(expr.key, expr.computed)) + self.function_body(expr.value)
+        else:
+            fragment = self.method_prefix(expr) + self.property_key(expr.key, expr.computed) + self.function_body(expr.value)
+        return join(result, fragment)
+
+    def Property(self, expr, precedence, flags):
+        if expr.kind in ("get", "set"):
+            return expr.kind + " " + self.property_key(expr.key, expr.computed) + self.function_body(expr.value)
+        if expr.shorthand:
+            if expr.value.type == "AssignmentPattern":
+                return self.AssignmentPattern(expr.value, SEQUENCE, E_TTT)
+            return self.property_key(expr.key, expr.computed)
+        if expr.method:
+            return self.method_prefix(expr) + self.property_key(expr.key, expr.computed) + self.function_body(expr.value)
+        key = self.property_key(expr.key, expr.computed) + ": "
+        if self.over([key]):
+            return key
+        return key + self.expression(expr.value, ASSIGNMENT, E_TTT)
+
+    def ObjectExpression(self, expr, precedence, flags):
+        properties = expr.properties
+        if not properties:
+            return "{}"
+        multiline = len(properties) > 1
+        with self.indented():
+            fragment = self.expression(properties[0], SEQUENCE, E_TTT)
+            if not multiline and self.over([fragment]):
+                # Whether it spans lines decides how the object starts, so it can't be cut short
+                budget, self.budget = self.budget, None
+                fragment = self.expression(properties[0], SEQUENCE, E_TTT)
+                self.budget = budget
+        if not multiline and not any(char in fragment for char in "\r\n"):
+            return "{ " + fragment + " }"
+        with self.indented() as indent:
+            parts = ["{\n", indent, fragment]
+            if multiline:
+                parts.append(",\n")
+                for index in range(1, len(properties)):
+                    if self.over(parts):
+                        return "".join(parts)
+                    parts.append(indent)
+                    parts.append(self.expression(properties[index], SEQUENCE, E_TTT))
+                    if index + 1 < len(properties):
+                        parts.append(",\n")
+        result = "".join(parts)
+        if not ends_with_line_terminator(result):
+            result += "\n"
+        return result + self.base + "}"
+
+    def ObjectPattern(self, expr, precedence, flags):
+        properties = expr.properties
+        if not properties:
+            return "{}"
+        if len(properties) == 1:
+            first = properties[0]
+            multiline = first.type == "Property" and first.value.type != "Identifier"
+        else:
+            multiline = any(item.type == "Property" and not item.shorthand for item in properties)
+        parts = ["{", "\n" if multiline else ""]
+        with self.indented() as indent:
+            for index, item in enumerate(properties):
+                parts.append(indent if multiline else "")
+                parts.append(self.expression(item, SEQUENCE, E_TTT))
+                if index + 1 < len(properties):
+                    parts.append(",\n" if multiline else ", ")
+                if self.over(parts):
+                    return "".join(parts)
+        result = "".join(parts)
+        if multiline and not ends_with_line_terminator(result):
+            result += "\n"
+        return result + (self.base if multiline else "") + "}"
+
+    def ThisExpression(self, expr, precedence, flags):
+        return "this"
+
+    def Super(self, expr, precedence, flags):
+        return "super"
+
+    def Identifier(self, expr, precedence, flags):
+        return expr.name
+
+    def Literal(self, expr, precedence, flags):
+        if expr.regex:
+            return f"/{expr.regex.pattern}/{expr.regex.flags}"
+        value = expr.value
+        if value is None:
+            return "null"
+        if isinstance(value, str):
+            return string_text(value)
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return number_text(value)
+
+    def SpreadElement(self, expr, precedence, flags):
+        return "..." + self.expression(expr.argument, ASSIGNMENT, E_TTT)
+
+    def TaggedTemplateExpression(self, expr, precedence, flags):
+        item_flags = E_TTF if flags & ALLOW_CALL else E_TFF
+        result = self.expression(expr.tag, CALL, item_flags) + self.expression(expr.quasi, PRIMARY, 4)
+        return parenthesize(result, TAGGED_TEMPLATE, precedence)
+
+    def TemplateElement(self, expr, precedence, flags):
+        return expr.value.raw
+
+    def TemplateLiteral(self, expr, precedence, flags):
+        parts = ["`"]
+        for index, quasi in enumerate(expr.quasis):
+            parts.append(self.expression(quasi, PRIMARY, E_TTT))
+            if index + 1 < len(expr.quasis):
+                parts.append("${ " + self.expression(expr.expressions[index], SEQUENCE, E_TTT) + " }")
+            if self.over(parts):
+                return "".join(parts)
+        parts.append("`")
+        return "".join(parts)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def starts_with_keyword(text, keyword, following):
+    """Whether text starts with the keyword, then one of `following`, whitespace or a line break."""
+    if not text.startswith(keyword):
+        return False
+    char = text[len(keyword):len(keyword) + 1]
+    return char != "" and char in following or is_whitespace(char) or is_line_terminator(char)
+
+
+def starts_with_async_function(text):
+    if not text.startswith("async") or not is_whitespace(text[5:6]):
+        return False
+    return starts_with_keyword(text[6:].lstrip(WHITESPACE), "function", "(*")
+
+
+STATEMENTS = {
+    name: getattr(JavaScriptCodegen, name)
+    for name in (
+        "BlockStatement", "BreakStatement", "ContinueStatement", "ClassBody", "ClassDeclaration",
+        "DoWhileStatement", "CatchClause", "DebuggerStatement", "EmptyStatement", "ExpressionStatement",
+        "VariableDeclarator", "VariableDeclaration", "ThrowStatement", "TryStatement", "SwitchStatement",
+        "SwitchCase", "IfStatement", "ForStatement", "ForInStatement", "ForOfStatement",
+        "LabeledStatement", "Program", "FunctionDeclaration", "ReturnStatement", "WhileStatement",
+        "WithStatement",
+    )
+}
+
+EXPRESSIONS = {
+    name: getattr(JavaScriptCodegen, name)
+    for name in (
+        "SequenceExpression", "AssignmentExpression", "AssignmentPattern", "ArrowFunctionExpression",
+        "ConditionalExpression", "BinaryExpression", "LogicalExpression", "CallExpression",
+        "ChainExpression", "NewExpression", "MemberExpression", "MetaProperty", "UnaryExpression",
+        "YieldExpression", "AwaitExpression", "UpdateExpression", "FunctionExpression",
+        "ArrayExpression", "ArrayPattern", "RestElement", "ClassExpression", "MethodDefinition",
+        "Property", "ObjectExpression", "ObjectPattern", "ThisExpression", "Super", "Identifier",
+        "Literal", "SpreadElement", "TaggedTemplateExpression", "TemplateElement", "TemplateLiteral",
+    )
+}
+
+
+def javascript_text(node, budget=None):
+    """escodegen.generate(node); with a budget, at least its first `budget` characters."""
+    return JavaScriptCodegen(budget).generate(node)
@@ -0,0 +1,400 @@
+import re
+
+try:
+    import esprima
+    from esprima import nodes
+    from esprima.messages import Messages
+    from esprima.parser import Parser
+except ImportError:
+    # Without esprima JavaScript charts come from the Node service (js_service)
+    esprima = None
+
+from flowchart_ir import BOX, CIRCLE, HEXAGON, IO, RAW_BOX, TERMINAL, FlowchartGraph
+from flowchart_labels import escape
+from flowchart_render import to_mermaid
+from flowchart_walk import walk
+from javascript_codegen import CodegenError, javascript_text, utf16_units
+
+# Bump whenever the generated Mermaid changes, so cached flowcharts are invalidated.
+# The Node service draws the same charts, so flowchart_cache uses this for both.
+GENERATOR_VERSION = "1"
+
+# Labels longer than this are cut to LABEL_LIMIT - 3 characters plus "..."
+LABEL_LIMIT = 50
+
+# Statements that are drawn, by esprima node class (several share a node type)
+HANDLERS = {
+    "Script": "visit_Program",
+    "Module": "visit_Program",
+    "BlockStatement": "visit_Program",
+    "FunctionDeclaration": "visit_FunctionDeclaration",
+    "AsyncFunctionDeclaration": "visit_FunctionDeclaration",
+    "VariableDeclaration": "visit_VariableDeclaration",
+    "ExpressionStatement": "visit_ExpressionStatement",
+    "Directive": "visit_ExpressionStatement",
+    "IfStatement": "visit_IfStatement",
+    "WhileStatement": "visit_WhileStatement",
+    "ReturnStatement": "visit_ReturnStatement",
+}
+
+# -- Regular expressions -----------------------------------------------------
+# esprima rejects regular expression literals its host can't compile: the
+# Python port asks Python's re, the Node service asked V8. This checks V8's
+# syntax instead (non-unicode mode with the Annex B extensions, which is what
+# esprima tests), so both generators accept the same programs.
+
+QUANTIFIER = re.compile(r"\{(\d+)(?:,(\d*))?\}")
+NAME_PART = r"(?:[\w$\u200c\u200d]|\\u[0-9a-fA-F]{4})"
+GROUP_NAME = re.compile(rf"(?:[^\W\d]|\$|\\u[0-9a-fA-F]{{4}}){NAME_PART}*")
+HEX = re.compile(r"x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}")
+UNICODE_ESCAPE = re.compile(r"\\u\{([0-9a-fA-F]+)\}|\\u([0-9a-fA-F]{4})")
+SURROGATE_PAIR = re.compile("[\ud800-\udbff][\udc00-\udfff]")
+CONTROL_ESCAPES = {"t": 9, "n": 10, "v": 11, "f": 12, "r": 13, "b": 8}
+
+
+def class_atom(pattern, index):
+    """(code unit, next index) of one character class atom; the code unit is
+    None for class escapes like \\d, which can't bound a range."""
+    char = pattern[index]
+    if char != "\\" or index + 1 == len(pattern):
+        return ord(char), index + 1
+    escape = pattern[index + 1]
+    if escape in "dDsSwW":
+        return None, index + 2
+    if escape in CONTROL_ESCAPES:
+        return CONTROL_ESCAPES[escape], index + 2
+    if escape == "c":
+        control = pattern[index + 2:index + 3]
+        if control.isascii() and (control.isalnum() or control == "_"):
+            return ord(control) % 32, index + 3
+        # A lone \\c is a backslash
+        return ord("\\"), index + 1
+    match = HEX.match(pattern, index + 1)
+    if match:
+        return int(match.group()[1:], 16), match.end()
+    if escape in "01234567":
+        value = int(escape, 8)
+        index += 2
+        for _ in range(2):
+            if index < len(pattern) and pattern[index] in "01234567" and value * 8 + int(pattern[index]) < 256:
+                value = value * 8 + int(pattern[index])
+                index += 1
+        return value, index
+    return ord(escape), index + 2
+
+
+def class_end(pattern, index):
+    """Index after the character class starting at `index` (past the "["), or
+    None when one of its ranges is out of order or it isn't closed."""
+    if pattern.startswith("^", index):
+        index += 1
+    while index < len(pattern) and pattern[index] != "]":
+        low, index = class_atom(pattern, index)
+        if pattern.startswith("-", index) and index + 1 < len(pattern) and pattern[index + 1] != "]":
+            high, index = class_atom(pattern, index + 1)
+            if low is not None and high is not None and low > high:
+                return None
+    if index >= len(pattern):
+        return None
+    return index + 1
+
+
+def escape_code(match):
+    return int(match.group(1) or match.group(2), 16)
+
+
+def regexp_is_valid(pattern, flags=""):
+    """Whether esprima on Node accepts the regular expression literal /pattern/flags."""
+    pattern = utf16_units(pattern)
+    if "u" in flags:
+        # esprima's approximation of the u flag: astral characters become \\uFFFF
+        if any(escape_code(match) > 0x10FFFF for match in UNICODE_ESCAPE.finditer(pattern)):
+            return False
+        pattern = UNICODE_ESCAPE.sub(lambda match: chr(min(escape_code(match), 0xFFFF)), pattern)
+        pattern = SURROGATE_PAIR.sub("\uffff", pattern)
+
+    names = set()
+    references = []
+    bad_reference = False
+    # Open groups, True for lookbehinds (which can't be repeated)
+    groups = []
+    quantifiable = False
+    index = 0
+    end = len(pattern)
+    while index < end:
+        char = pattern[index]
+        index += 1
+        quantifier = QUANTIFIER.match(pattern, index - 1) if char == "{" else None
+        if char in "*+?" or quantifier:
+            if not quantifiable:
+                return False
+            if quantifier:
+                if quantifier.group(2) and int(quantifier.group(2)) < int(quantifier.group(1)):
+                    return False
+                index = quantifier.end()
+            if pattern.startswith("?", index):
+                index += 1
+            quantifiable = False
+        elif char in "^$|":
+            quantifiable = False
+        elif char == "(":
+            lookbehind = pattern.startswith(("?<=", "?<!"), index)
+            if lookbehind:
+                index += 3
+            elif pattern.startswith(("?:", "?=", "?!"), index):
+                index += 2
+            elif pattern.startswith("?<", index):
+                name = GROUP_NAME.match(pattern, index + 2)
+                if name is None or not pattern.startswith(">", name.end()) or name.group() in names:
+                    return False
+                names.add(name.group())
+                index = name.end() + 1
+            elif pattern.startswith("?", index):
+                return False
+            groups.append(lookbehind)
+            quantifiable = False
+        elif char == ")":
+            if not groups:
+                return False
+            quantifiable = not groups.pop()
+        elif char == "[":
+            index = class_end(pattern, index)
+            if index is None:
+                return False
+            quantifiable = True
+        elif char == "\\":
+            escape = pattern[index:index + 1]
+            index += 1
+            if escape and escape in "bB":
+                quantifiable = False
+                continue
+            if escape == "k":
+                # Only a named reference if the pattern has named groups, checked below
+                name = GROUP_NAME.match(pattern, index + 1) if pattern.startswith("<", index) else None
+                if name is not None and pattern.startswith(">", name.end()):
+                    references.append(name.group())
+                    index = name.end() + 1
+                else:
+                    bad_reference = True
+            quantifiable = True
+        else:
+            quantifiable = True
+    if groups:
+        return False
+    return not names or (not bad_reference and all(name in names for name in references))
+
+
+def test_regexp(scanner, pattern, flags):
+    """Stands in for esprima's Scanner.testRegExp."""
+    if not regexp_is_valid(pattern, flags):
+        scanner.throwUnexpectedToken(Messages.InvalidRegExp)
+    return None
+
+
+class JavaScriptMermaidGenerator:
+    """Draws the same flowcharts as js_service/server.js, without the Node hop:
+    esprima for parsing, javascript_codegen in place of escodegen for labels."""
+
+    def __init__(self):
+        self.reset()
+        self.error = None
+        # No level-of-detail support, the Node service never had it
+        self.lod = None
+        self.handlers = {getattr(nodes, class_name): getattr(self, name) for class_name, name in HANDLERS.items()}
+
+    def reset(self):
+        self.graph = FlowchartGraph()
+        self.graph.add_node("Start", TERMINAL, "Start")
+        self.node_counter = 0
+        self.last_node = "Start"
+
+    def new_node_id(self, lineno=None):
+        self.node_counter += 1
+        suffix = f"_L{lineno}" if lineno else ""
+        return f"N{self.node_counter}{suffix}"
+
+    def safe_label(self, text):
+        text = escape(text)
+        # Lengths are counted in UTF-16 code units, like String.length in Node
+        units = text.encode("utf-16-le", "surrogatepass")
+        if len(units) > 2 * LABEL_LIMIT:
+            return units[:2 * (LABEL_LIMIT - 3)].decode("utf-16-le", "ignore") + "..."
+        return text
+
+    def expression_label(self, node):
+        """Source of an expression, long enough to fill a label (escodegen.generate in server.js)."""
+        return javascript_text(node, LABEL_LIMIT + 1)
+
+    def add_node(self, shape, label, lineno=None, css_class=None):
+        node_id = self.new_node_id(lineno)
+        self.graph.add_node(node_id, shape, label, lineno, css_class)
+        return node_id
+
+    def add_edge(self, from_node, to_node, label=None):
+        self.graph.add_edge(from_node, to_node, label)
+
+    def add_step(self, shape, label, lineno, css_class):
+        node_id = self.add_node(shape, label, lineno, css_class)
+        self.add_edge(self.last_node, node_id)
+        self.last_node = node_id
+
+    def visit(self, node):
+        walk(([node],), self.handlers)
+
+    def visit_Program(self, node):
+        return (node.body,)
+
+    def visit_FunctionDeclaration(self, node):
+        self.add_step(RAW_BOX, f"Def {self.safe_label(node.id.name)}", node.loc.start.line, "process")
+        return ([node.body],)
+
+    def visit_VariableDeclaration(self, node):
+        for decl in node.declarations:
+            init = "undefined"
+            if decl.init:
+                try:
+                    init = self.expression_label(decl.init)
+                except CodegenError:
+                    init = "..."
+            # Destructuring patterns have no name, server.js prints undefined
+            name = decl.id.name or "undefined"
+            self.add_step(BOX, self.safe_label(f"{name} = {init}"), decl.loc.start.line, "process")
+
+    def visit_ExpressionStatement(self, node):
+        expr = node.expression
+        if expr.type == "CallExpression":
+            callee = expr.callee
+            label = f"Call {callee.name or 'func'}"
+            if callee.type == "MemberExpression" and callee.object.name == "console" and callee.property.name == "log":
+                try:
+                    label = f"console.log({', '.join(self.argument_labels(expr.arguments))})"
+                except CodegenError:
+                    label = "console.log(...)"
+                self.add_step(IO, self.safe_label(label), expr.loc.start.line, "io")
+            else:
+                try:
+                    label = self.expression_label(expr)
+                except CodegenError:
+                    pass
+                self.add_step(BOX, self.safe_label(label), expr.loc.start.line, "process")
+        elif expr.type == "AssignmentExpression":
+            try:
+                label = self.expression_label(expr)
+            except CodegenError:
+                label = f"{expr.left.name} = ..."
+            self.add_step(BOX, self.safe_label(label), expr.loc.start.line, "process")
+
+    def argument_labels(self, arguments):
+        labels = []
+        length = 0
+        for argument in arguments:
+            if length > LABEL_LIMIT:
+                # The label is cut before this argument, it only has to be valid
+                javascript_text(argument, 0)
+                labels.append("")
+                continue
+            labels.append(self.expression_label(argument))
+            length += len(labels[-1]) + 2
+        return labels
+
+    def visit_IfStatement(self, node):
+        try:
+            label = self.expression_label(node.test)
+        except CodegenError:
+            label = "If Condition"
+        decision = self.add_node(HEXAGON, f"{self.safe_label(label)}?", node.loc.start.line, "decision")
+        self.add_edge(self.last_node, decision)
+
+        # True branch
+        yes_node = self.add_node(BOX, "Yes")
+        self.add_edge(decision, yes_node, "True")
+        self.last_node = yes_node
+        yield [node.consequent]
+        true_end = self.last_node
+
+        # False branch
+        no_node = self.add_node(BOX, "No")
+        self.add_edge(decision, no_node, "False")
+        self.last_node = no_node
+        if node.alternate:
+            yield [node.alternate]
+        false_end = self.last_node
+
+        merge = self.add_node(CIRCLE, "")
+        self.add_edge(true_end, merge)
+        self.add_edge(false_end, merge)
+        self.last_node = merge
+
+    def visit_WhileStatement(self, node):
+        try:
+            label = self.expression_label(node.test)
+        except CodegenError:
+            label = "While Loop"
+        loop_start = self.add_node(HEXAGON, f"{self.safe_label(label)}?", node.loc.start.line, "decision")
+        self.add_edge(self.last_node, loop_start)
+
+        do_node = self.add_node(BOX, "Do")
+        self.add_edge(loop_start, do_node, "True")
+        self.last_node = do_node
+        yield [node.body]
+        self.add_edge(self.last_node, loop_start)
+
+        end_loop = self.add_node(BOX, "End Loop")
+        self.add_edge(loop_start, end_loop, "False")
+        self.last_node = end_loop
+
+    def visit_ReturnStatement(self, node):
+        value = ""
+        if node.argument:
+            try:
+                value = " " + self.expression_label(node.argument)
+            except CodegenError:
+                pass
+        self.add_step(BOX, f"Return{self.safe_label(value)}", node.loc.start.line, "process")
+
+    def finish(self):
+        self.graph.add_node("End", TERMINAL, "End", css_class="startend")
+        self.add_edge(self.last_node, "End")
+        return self.graph
+
+    def parse(self, code):
+        # Syntax the Python port of esprima added after 4.0.1, which the Node service runs
+        check = self.reject_newer_syntax if "import" in code or "..." in code else None
+        parser = Parser(code, {"loc": True}, check)
+        parser.scanner.testRegExp = lambda pattern, flags: test_regexp(parser.scanner, pattern, flags)
+        self.errors = parser.errorHandler
+        return parser.parseScript()
+
+    def reject_newer_syntax(self, node, metadata):
+        """esprima delegate: fails on dynamic import() and object rest/spread like esprima 4.0.1 does."""
+        if node.type == "Import":
+            start = metadata.start
+            raise self.errors.createError(start.offset, start.line, start.column + 1, Messages.UnexpectedReserved)
+        if node.type in ("ObjectExpression", "ObjectPattern"):
+            for prop in node.properties:
+                if prop.type in ("SpreadElement", "RestElement"):
+                    start = prop.loc.start
+                    raise self.errors.createError(None, start.line, start.column + 1, Messages.UnexpectedToken.replace("%0", "..."))
+        return None
+
+    def generate_graph(self, code):
+        """Builds the flowchart IR, or returns None (with self.error set) on failure."""
+        try:
+            self.visit(self.parse(code))
+            return self.finish()
+        except Exception as e:
+            self.error = str(e)
+            return None
+
+    def error_chart(self):
+        return f'flowchart TD\n    Error["Error parsing JS: {self.safe_label(self.error)}"]'
+
+    def generate(self, code):
+        graph = self.generate_graph(code)
+        if graph is None:
+            return self.error_chart()
+        return to_mermaid(graph)
+
+def parse_javascript_to_mermaid(code):
+    generator = JavaScriptMermaidGenerator()
+    return generator.generate(code)
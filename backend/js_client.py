@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+
+import httpx
+
+JS_SERVICE_URL = os.getenv("JS_SERVICE_URL", "http://localhost:3001")
+CONNECT_TIMEOUT = float(os.getenv("JS_SERVICE_CONNECT_TIMEOUT", "1"))
+READ_TIMEOUT = float(os.getenv("JS_SERVICE_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("JS_SERVICE_RETRIES", "2"))
+MAX_CONNECTIONS = int(os.getenv("JS_SERVICE_MAX_CONNECTIONS", "32"))
+BREAKER_THRESHOLD = int(os.getenv("JS_SERVICE_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("JS_SERVICE_BREAKER_COOLDOWN", "5"))
+
+UNAVAILABLE_MERMAID = "flowchart TD\n    Error[JS Service Unavailable (Is it running on port 3001?)]"
+
+
+class JSServiceUnavailable(Exception):
+    """The Node service could not be reached (or the circuit breaker is open)."""
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and fails fast for `cooldown`
+    seconds. After the cooldown a single trial request is let through."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def abandon_trial(self):
+        # The trial was cancelled or failed unexpectedly without a verdict;
+        # let the next request try instead of staying half-open forever
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class JSServiceClient:
+    """Keep-alive, non-blocking client for the Node.js /parse service."""
+
+    def __init__(self, base_url=JS_SERVICE_URL, retries=MAX_RETRIES):
+        self.base_url = base_url
+        self.retries = retries
+        self.breaker = CircuitBreaker()
+        self.client = None
+
+    def get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                ),
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def parse(self, code):
+        """Returns the httpx.Response from /parse, or raises JSServiceUnavailable."""
+        if not self.breaker.allow():
+            raise JSServiceUnavailable("circuit open")
+
+        # allow() only sets the flag for the one request it lets through half-open
+        trial = self.breaker.trial_in_flight
+        try:
+            return await self.post_with_retries(code)
+        finally:
+            if trial and self.breaker.trial_in_flight:
+                self.breaker.abandon_trial()
+
+    async def post_with_retries(self, code):
+        """5xx responses are retried, but the last one is returned: the service
+        is up, and its error text belongs in the chart. Only transport errors
+        (the service can't be reached) count against the breaker."""
+        client = self.get_client()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.post("/parse", json={"code": code})
+            except httpx.TransportError as e:
+                # Connect/read/write errors, timeouts and resets while Node restarts
+                last_error = e
+                if attempt < self.retries:
+                    await asyncio.sleep(0.05 * (2 ** attempt))
+                continue
+            if response.status_code >= 500 and attempt < self.retries:
+                await asyncio.sleep(0.05 * (2 ** attempt))
+                continue
+            self.breaker.record_success()
+            return response
+
+        self.breaker.record_failure()
+        raise JSServiceUnavailable(str(last_error))
+
+
+js_client = JSServiceClient()
@@ -0,0 +1,95 @@
+import json
+import os
+
+import httpx
+
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "30"))
+MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "64"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class ChatCompletionsClient:
+    """Async client for an OpenAI-compatible /chat/completions endpoint.
+
+    One client (and so one keep-alive/HTTP2 connection pool) is shared by all
+    requests on the worker. Point GROQ_BASE_URL at a local stub to test it.
+    """
+
+    def __init__(self, base_url=GROQ_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+        self.client = None
+
+    def get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                ),
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def complete(self, api_key, payload):
+        """Returns the full assistant message content."""
+        response = await self.get_client().post(
+            "/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        if response.status_code != 200:
+            raise LLMError(response.status_code, response.text)
+        data = response.json()
+        return data['choices'][0]['message']['content']
+
+    async def stream(self, api_key, payload):
+        """Yields content deltas as the upstream produces them."""
+        payload = dict(payload, stream=True)
+        async with self.get_client().stream(
+            "POST",
+            "/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {api_key}"},
+        ) as response:
+            if response.status_code != 200:
+                text = (await response.aread()).decode("utf-8", "replace")
+                raise LLMError(response.status_code, text)
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                for choice in chunk.get("choices", []):
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+
+llm_client = ChatCompletionsClient()
@@ -0,0 +1,335 @@
+"""Open-loop load generator for the backend.
+
+Requests are started on a schedule (Poisson arrivals at --rate per second, or
+evenly spaced with --arrivals uniform) whether or not earlier ones have
+finished, so a slow server builds a queue instead of slowing the test down.
+Latency is measured from the scheduled start, which keeps client-side delays
+in the numbers too. Each request is drawn from a weighted corpus, one JSON
+object per line:
+
+    {"name": "flowchart-python", "method": "POST", "path": "/generate-flowchart",
+     "body": {"language": "python", "code": "x = {unique}"}, "weight": 40}
+
+"{unique}" in body strings becomes a per-request number with --unique (to get
+past the flowchart cache and request coalescing) and "0" otherwise. The default
+corpus is loadtest_corpus.jsonl.
+
+Run the backend against loadtest_stubs.py (see there), with admission control
+off (ADMISSION_CONTROL=0, the default) unless it is what's being tested, then
+e.g.
+
+    python loadtest.py --rate 20 --duration 30
+    python loadtest.py --rates 10,20,40,80,160 --duration 20 --output sweep.json
+
+--rates runs one step per rate and reports where the server saturates: the
+first rate at which completed throughput falls behind the offered rate, the
+error rate passes --max-error-rate, or the p99 latency passes --slo.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import httpx
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_corpus.jsonl")
+PERCENTILES = (50, 90, 99)
+# Completed throughput below this fraction of the offered rate counts as saturated
+KEEP_UP_RATIO = 0.95
+
+
+def load_corpus(path):
+    entries = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "path" not in entry:
+                raise ValueError(f"{path}:{number}: missing path")
+            entry.setdefault("name", entry["path"])
+            entry.setdefault("method", "POST" if "body" in entry else "GET")
+            entry.setdefault("weight", 1)
+            entries.append(entry)
+    if not entries:
+        raise ValueError(f"{path}: no requests")
+    return entries
+
+
+def fill(value, unique):
+    """Replaces "{unique}" in every string of a JSON body."""
+    if isinstance(value, str):
+        return value.replace("{unique}", unique)
+    if isinstance(value, list):
+        return [fill(item, unique) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, unique) for key, item in value.items()}
+    return value
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def body_error(response):
+    """Errors the backend reports with a 200: error charts, chat errors, error frames in streams."""
+    content_type = response.headers.get("content-type", "")
+    if "json" not in content_type:
+        return None
+    try:
+        if "ndjson" in content_type:
+            documents = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        else:
+            documents = [response.json()]
+    except ValueError:
+        return "bad_json"
+    for document in documents:
+        if not isinstance(document, dict):
+            continue
+        if document.get("error"):
+            return "error_in_body"
+        content = document.get("content")
+        if document.get("role") == "assistant" and isinstance(content, str) and content.startswith(("Error", "Backend Error")):
+            return "error_in_body"
+    return None
+
+
+class Stats:
+    """Outcomes of one endpoint (corpus entry name)."""
+
+    def __init__(self):
+        self.latencies = []
+        self.first_bytes = []
+        self.errors = {}
+        self.sent = 0
+        self.in_window = 0 # successes that finished before the step ended
+
+    def record(self, latency, first_byte, error, in_window):
+        if error is None:
+            self.latencies.append(latency)
+            self.first_bytes.append(first_byte)
+            self.in_window += in_window
+        else:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        first_bytes = sorted(self.first_bytes)
+        failed = sum(self.errors.values())
+        completed = len(latencies) + failed
+        result = {
+            "sent": self.sent,
+            "completed": completed,
+            "ok": len(latencies),
+            "errors": dict(sorted(self.errors.items())),
+            "error_rate": failed / completed if completed else 0.0,
+            # Finished within the step: a queue building up behind the server doesn't count
+            "throughput": self.in_window / duration if duration else 0.0,
+            "latency_max": latencies[-1] if latencies else None,
+        }
+        for p in PERCENTILES:
+            result[f"latency_p{p}"] = percentile(latencies, p)
+        result["first_byte_p50"] = percentile(first_bytes, 50)
+        return result
+
+
+async def send(client, entry, unique, timeout):
+    """Returns (seconds to first byte, error kind or None)."""
+    started = time.perf_counter()
+    first_byte = None
+    try:
+        request = client.build_request(
+            entry["method"],
+            entry["path"],
+            json=fill(entry["body"], unique) if "body" in entry else None,
+            headers=entry.get("headers"),
+            timeout=timeout,
+        )
+        response = await client.send(request, stream=True)
+        try:
+            first_byte = time.perf_counter() - started
+            await response.aread()
+        finally:
+            await response.aclose()
+    except httpx.TimeoutException:
+        return first_byte, "timeout"
+    except httpx.TransportError as e:
+        return first_byte, type(e).__name__
+    if response.status_code >= 400:
+        return first_byte, f"http_{response.status_code}"
+    return first_byte, body_error(response)
+
+
+async def run_step(client, corpus, rate, duration, warmup=0.0, arrivals="poisson", unique=False,
+                   timeout=30.0, max_in_flight=10000, seed=None):
+    """Offers `rate` requests per second for warmup + duration seconds and
+    returns per-endpoint summaries of the requests scheduled after the warmup."""
+    chooser = random.Random(seed)
+    weights = [entry["weight"] for entry in corpus]
+    stats = {entry["name"]: Stats() for entry in corpus}
+    tasks = set()
+    dropped = 0
+    in_flight = 0
+    counter = 0
+
+    async def one(entry, scheduled, measured, number):
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            first_byte, error = await send(client, entry, str(number) if unique else "0", timeout)
+        finally:
+            in_flight -= 1
+        if measured:
+            finished = time.perf_counter()
+            # From the scheduled start: time spent waiting on the client counts as well
+            stats[entry["name"]].record(finished - scheduled, first_byte, error, finished <= end)
+
+    start = time.perf_counter()
+    measure_from = start + warmup
+    end = measure_from + duration
+    next_at = start
+    while next_at < end:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        entry = chooser.choices(corpus, weights)[0]
+        measured = next_at >= measure_from
+        counter += 1
+        if in_flight >= max_in_flight:
+            # The client can't keep the schedule; count it rather than wait (that would close the loop)
+            if measured:
+                dropped += 1
+        else:
+            if measured:
+                stats[entry["name"]].sent += 1
+            task = asyncio.create_task(one(entry, next_at, measured, counter))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        next_at += chooser.expovariate(rate) if arrivals == "poisson" else 1 / rate
+
+    if tasks:
+        await asyncio.wait(tasks)
+
+    endpoints = {name: endpoint.summary(duration) for name, endpoint in stats.items() if endpoint.sent}
+    total = Stats()
+    for endpoint in stats.values():
+        total.sent += endpoint.sent
+        total.in_window += endpoint.in_window
+        total.latencies += endpoint.latencies
+        total.first_bytes += endpoint.first_bytes
+        for error, count in endpoint.errors.items():
+            total.errors[error] = total.errors.get(error, 0) + count
+    return {
+        "offered_rate": rate,
+        "duration": duration,
+        "dropped": dropped,
+        "total": total.summary(duration),
+        "endpoints": endpoints,
+    }
+
+
+def saturated(step, max_error_rate, slo):
+    """Why a step counts as past saturation, or None."""
+    total = step["total"]
+    if total["throughput"] < step["offered_rate"] * KEEP_UP_RATIO * (1 - total["error_rate"]):
+        return "throughput below offered rate"
+    if total["error_rate"] > max_error_rate:
+        return f"error rate {total['error_rate']:.1%}"
+    if slo is not None and total["latency_p99"] is not None and total["latency_p99"] > slo:
+        return f"p99 {total['latency_p99'] * 1000:.0f} ms over SLO"
+    if step["dropped"]:
+        return "client could not keep up"
+    return None
+
+
+def ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def print_step(step, log=print):
+    log(f"\nOffered {step['offered_rate']:g} req/s for {step['duration']:g}s"
+        + (f" ({step['dropped']} dropped by the client)" if step["dropped"] else ""))
+    log(f"  {'endpoint':24} {'sent':>6} {'ok':>6} {'err%':>6} {'req/s':>7} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7} {'ttfb50':>7}  errors")
+    rows = list(step["endpoints"].items()) + [("TOTAL", step["total"])]
+    for name, s in rows:
+        errors = ", ".join(f"{kind}={count}" for kind, count in s["errors"].items())
+        log(f"  {name:24} {s['sent']:>6} {s['ok']:>6} {s['error_rate'] * 100:>6.1f} {s['throughput']:>7.1f} "
+            f"{ms(s['latency_p50']):>7} {ms(s['latency_p90']):>7} {ms(s['latency_p99']):>7} {ms(s['latency_max']):>7} "
+            f"{ms(s['first_byte_p50']):>7}  {errors}")
+
+
+async def run(args, corpus):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    steps = []
+    async with httpx.AsyncClient(base_url=args.url, limits=limits) as client:
+        for rate in args.rates:
+            step = await run_step(
+                client, corpus, rate, args.duration, args.warmup, args.arrivals, args.unique,
+                args.timeout, args.max_in_flight, args.seed,
+            )
+            step["saturated"] = saturated(step, args.max_error_rate, args.slo)
+            steps.append(step)
+            print_step(step)
+            if step["saturated"] and len(args.rates) > 1:
+                print(f"  saturated: {step['saturated']}")
+                if not args.keep_going:
+                    break
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load test for the backend")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="backend base URL (default: %(default)s)")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="request mix, JSON lines (default: loadtest_corpus.jsonl)")
+    parser.add_argument("--rate", type=float, default=10, help="requests per second")
+    parser.add_argument("--rates", help="comma separated rates: one step each, to find the saturation point")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per step")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before each step")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--unique", action="store_true", help='make every request distinct via "{unique}"')
+    parser.add_argument("--timeout", type=float, default=30, help="per request, seconds")
+    parser.add_argument("--connections", type=int, default=512, help="client connection pool size")
+    parser.add_argument("--max-in-flight", type=int, default=10000, help="requests past this are dropped and reported")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="saturation threshold for --rates")
+    parser.add_argument("--slo", type=float, help="p99 latency limit in seconds for --rates")
+    parser.add_argument("--keep-going", action="store_true", help="run every rate even past saturation")
+    parser.add_argument("--seed", type=int, help="for a repeatable request sequence")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args(argv)
+
+    args.rates = [float(rate) for rate in args.rates.split(",") if rate.strip()] if args.rates else [args.rate]
+    if any(rate <= 0 for rate in args.rates):
+        parser.error("rates must be positive")
+    try:
+        corpus = load_corpus(args.corpus)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    steps = asyncio.run(run(args, corpus))
+
+    if len(steps) > 1:
+        healthy = [step["offered_rate"] for step in steps if not step["saturated"]]
+        first_saturated = next((step for step in steps if step["saturated"]), None)
+        if first_saturated is None:
+            print(f"\nNot saturated up to {steps[-1]['offered_rate']:g} req/s")
+        elif healthy:
+            print(f"\nSaturates between {max(healthy):g} and {first_saturated['offered_rate']:g} req/s ({first_saturated['saturated']})")
+        else:
+            print(f"\nAlready saturated at {first_saturated['offered_rate']:g} req/s ({first_saturated['saturated']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": args.url, "corpus": args.corpus, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "steps": steps}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
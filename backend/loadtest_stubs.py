@@ -0,0 +1,200 @@
+"""Local stand-ins for the backend's upstreams, for load tests.
+
+One server answers both
+  POST /parse              like the Node service (js_service/server.js)
+  POST /chat/completions   like an OpenAI-compatible chat API, streaming or not
+with configurable latency and failure distributions, so the backend can be
+loaded without Node or a real LLM behind it:
+
+    python loadtest_stubs.py --port 9100 --parse-latency lognormal:15:0.5 \\
+        --chat-latency lognormal:400:0.6 --chat-errors 429=0.02,500=0.01,timeout=0.005
+
+    JS_SERVICE_URL=http://127.0.0.1:9100 GROQ_BASE_URL=http://127.0.0.1:9100 \\
+        GROQ_API_KEY=stub uvicorn main:app --port 8000
+
+Latencies are "fixed:MS", "uniform:LO:HI", "exponential:MEAN" or
+"lognormal:MEDIAN:SIGMA" (milliseconds). Errors are "KIND=PROBABILITY" pairs
+where KIND is an HTTP status or "timeout" (the response never comes; the
+backend's read timeout has to fire).
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+# How long a "timeout" failure holds the request open
+HANG_SECONDS = 3600
+
+
+class Latency:
+    """Samples a delay in seconds from a distribution spec."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        params = [float(param) for param in params]
+        expected = {"fixed": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"bad latency spec {spec!r}")
+        self.kind = kind
+        self.params = params
+
+    def sample(self):
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(*self.params)
+        elif self.kind == "exponential":
+            ms = random.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+        else:
+            median, sigma = self.params
+            ms = random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return ms / 1000
+
+
+class Failures:
+    """Picks at most one failure per request from "500=0.01,timeout=0.005"."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.choices = []
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            kind, _, probability = item.partition("=")
+            kind = kind.strip()
+            if kind != "timeout" and not kind.isdigit():
+                raise ValueError(f"bad failure kind {kind!r}")
+            self.choices.append((kind, float(probability)))
+        if sum(probability for _, probability in self.choices) > 1:
+            raise ValueError(f"failure probabilities in {spec!r} add up to more than 1")
+
+    def sample(self):
+        roll = random.random()
+        for kind, probability in self.choices:
+            if roll < probability:
+                return kind
+            roll -= probability
+        return None
+
+
+class Upstream:
+    """Latency, failures and counters of one stubbed endpoint."""
+
+    def __init__(self, latency, failures):
+        self.latency = Latency(latency)
+        self.failures = Failures(failures)
+        self.requests = 0
+        self.failed = 0
+
+    async def delay_or_fail(self):
+        """Sleeps for the sampled latency. Returns an error response, or None to answer normally."""
+        self.requests += 1
+        failure = self.failures.sample()
+        if failure == "timeout":
+            self.failed += 1
+            await asyncio.sleep(HANG_SECONDS)
+        await asyncio.sleep(self.latency.sample())
+        if failure is not None:
+            self.failed += 1
+            return JSONResponse(status_code=int(failure), content={"error": {"message": f"stub failure {failure}"}})
+        return None
+
+    def stats(self):
+        return {"latency": self.latency.spec, "failures": self.failures.spec, "requests": self.requests, "failed": self.failed}
+
+
+def stub_mermaid(code):
+    """A chart shaped like the Node service's, one node per non-blank line (capped)."""
+    lines = [line.strip() for line in code.splitlines() if line.strip()][:200]
+    out = ["flowchart TD", "    Start([Start])"]
+    previous = "Start"
+    for number, line in enumerate(lines, 1):
+        node = f"N{number}_L{number}"
+        label = line.replace('"', "'")[:40]
+        out.append(f'    {node}["{label}"]')
+        out.append(f"    {previous} --> {node}")
+        previous = node
+    out.append("    End([End])")
+    out.append(f"    {previous} --> End")
+    return "\n".join(out)
+
+
+def create_app(parse, chat, tokens=60, token_interval=Latency("fixed:0")):
+    app = FastAPI(title="Load test stubs")
+
+    @app.post("/parse")
+    async def stub_parse(request: Request):
+        body = await request.json()
+        code = body.get("code")
+        if not code:
+            return PlainTextResponse("No code provided", status_code=400)
+        error = await parse.delay_or_fail()
+        if error is not None:
+            return error
+        return {"mermaid": stub_mermaid(code)}
+
+    @app.post("/chat/completions")
+    async def stub_chat(request: Request):
+        payload = await request.json()
+        error = await chat.delay_or_fail()
+        if error is not None:
+            return error
+        words = [f"word{index}" for index in range(tokens)]
+        model = payload.get("model", "stub")
+        if not payload.get("stream"):
+            return {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+            }
+
+        async def events():
+            for index, word in enumerate(words):
+                chunk = {"choices": [{"index": 0, "delta": {"content": word if index == 0 else " " + word}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_interval.sample())
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stub_stats():
+        return {"parse": parse.stats(), "chat": chat.stats()}
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stub Node /parse and chat-completions servers for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--parse-latency", default="lognormal:15:0.5", help="latency of /parse (default: %(default)s)")
+    parser.add_argument("--parse-errors", default="", help='e.g. "500=0.01,timeout=0.001"')
+    parser.add_argument("--chat-latency", default="lognormal:400:0.6", help="time to the first token (default: %(default)s)")
+    parser.add_argument("--chat-errors", default="", help='e.g. "429=0.02,500=0.01,timeout=0.005"')
+    parser.add_argument("--chat-tokens", type=int, default=60, help="words per completion")
+    parser.add_argument("--token-interval", default="fixed:20", help="delay between streamed tokens (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        app = create_app(
+            Upstream(args.parse_latency, args.parse_errors),
+            Upstream(args.chat_latency, args.chat_errors),
+            args.chat_tokens,
+            Latency(args.token_interval),
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
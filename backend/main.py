@@ -1,15 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-import requests
 import uvicorn
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import json
+import math
 import os
+import time
+from typing import List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from python_parser import MermaidGenerator
-from java_parser import JavaMermaidGenerator
+from admission import SingleFlight, admission
+from chat_context import full_context
+from chat_images import UploadError, prepare_image, receive_upload
+from flowchart_engine import LANGUAGE_PRIORITY, PRIORITY_NORMAL, EngineBusy, EngineTimeout, flowchart_engine, run_expand, run_incremental, run_outline, run_select_context, run_trace, trace_engine
+from flowchart_cache import ENTRY_OVERHEAD, FlowchartCache, cache_key, flowchart_cache, source_key, variant_key
+from flowchart_store import flowchart_store
+from js_client import MAX_CONNECTIONS as JS_MAX_CONNECTIONS, UNAVAILABLE_MERMAID, JSServiceUnavailable, js_client
+import javascript_parser
+from llm_client import LLMError, llm_client
+from incremental import diff_graphs, version_store
+from sql_sandbox import SQL_MAX_ROWS, SQL_PAGE_SIZE, SessionBusy, SqlError, SqlTimeout, sql_sandbox
+import metrics
+import profiling
 
 app = FastAPI()
 
@@ -22,48 +40,533 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Rate-limited paths and the admission limit (see admission.py) they count against
+ADMISSION_ENDPOINTS = {
+    "/generate-flowchart": "flowchart",
+    "/generate-flowchart/expand": "flowchart",
+    "/generate-flowchart/batch": "batch",
+    "/api/visualize": "visualize",
+    "/api/sql": "sql",
+    "/api/chat": "chat",
+    "/api/chat/upload": "chat",
+}
+
+# Registered before the metrics middleware, so refused requests are still counted there
+@app.middleware("http")
+async def admit_request(request: Request, call_next):
+    endpoint = ADMISSION_ENDPOINTS.get(request.url.path)
+    if endpoint is not None and request.method == "POST":
+        wait = admission.admit(endpoint, request)
+        if wait:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests, slow down"},
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+    return await call_next(request)
+
+# Identical requests in flight at the same time share one computation
+flowchart_flights = SingleFlight("flowchart")
+trace_flights = SingleFlight("visualize")
+chat_flights = SingleFlight("chat")
+
+# Paths outside the known routes share one label to keep cardinality bounded
+METRIC_ENDPOINTS = None
+
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    global METRIC_ENDPOINTS
+    if METRIC_ENDPOINTS is None:
+        METRIC_ENDPOINTS = {route.path for route in app.routes}
+    endpoint = request.url.path if request.url.path in METRIC_ENDPOINTS else "other"
+    in_flight = metrics.HTTP_IN_FLIGHT.labels(endpoint)
+    in_flight.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.HTTP_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+        metrics.HTTP_REQUESTS.labels(endpoint, request.method, str(status)).inc()
+        in_flight.dec()
+
+# "python" draws JavaScript flowcharts in the flowchart workers (javascript_parser),
+# "node" sends them to js_service. Without esprima they always go to the Node service.
+JS_GENERATOR = os.getenv("JS_GENERATOR", "python")
+JS_IN_PROCESS = JS_GENERATOR != "node" and javascript_parser.esprima is not None
+
 class CodeRequest(BaseModel):
     language: str
     code: str
+    format: str = "mermaid" # or "json" for the structured graph
+    incremental: bool = False
+    outline: bool = False # class/function skeleton only, expand with /generate-flowchart/expand
+    previousVersion: Optional[str] = None # version returned by the last incremental response
+    max_nodes: Optional[int] = None # collapse blocks into summary nodes until the graph fits
+    detail: Optional[int] = None # collapse blocks nested deeper than this many levels
+    simplify: bool = True # merge straight-line runs and drop placeholder nodes (Python/Java)
 
-@app.post("/generate-flowchart")
-async def generate_flowchart(request: CodeRequest):
-    if request.language == "python":
-        generator = MermaidGenerator()
-        mermaid_code = generator.generate(request.code)
-        return {"mermaid": mermaid_code}
-    
-    elif request.language == "javascript":
+@app.on_event("startup")
+async def start_flowchart_engine():
+    await flowchart_engine.start()
+    await trace_engine.start()
+
+@app.on_event("shutdown")
+async def stop_flowchart_engine():
+    flowchart_engine.shutdown()
+    trace_engine.shutdown()
+    metrics.mark_process_dead()
+    await js_client.close()
+    await llm_client.close()
+
+async def generate_uncached(language, code, output_format="mermaid", profile=None, max_nodes=None, detail=None, simplify=False):
+    """Returns (result, cacheable). JS service errors are transient and must not be cached."""
+    if language in ("python", "java") or (language == "javascript" and JS_IN_PROCESS):
+        if profile is None and profiling.should_sample():
+            profile = profiling.SAMPLE
+        # Parsing is CPU bound, keep it off the event loop
+        try:
+            result, stats = await flowchart_engine.generate(
+                language, code, output_format, profile, max_nodes, detail, simplify
+            )
+        except EngineBusy:
+            raise HTTPException(status_code=503, detail="Flowchart generator is busy, try again shortly")
+        except EngineTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except BrokenProcessPool:
+            # The engine has already replaced the worker
+            raise HTTPException(status_code=503, detail="A flowchart worker crashed and was restarted, try again")
+        metrics.observe_generation(language, stats)
+        if "profile" in stats:
+            # Profiled responses carry per-request timings, keep them out of the cache
+            return {**result, "profile": stats["profile"]}, False
+        return result, True
+
+    elif language == "javascript":
+        if output_format != "mermaid":
+            raise HTTPException(status_code=400, detail="The JS service only produces Mermaid output")
         try:
             # Call Node.js microservice
-            response = requests.post("http://localhost:3001/parse", json={"code": request.code})
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"mermaid": f"flowchart TD\n    Error[JS Service Error: {response.text}]"}
-        except requests.exceptions.ConnectionError:
-            return {"mermaid": "flowchart TD\n    Error[JS Service Unavailable (Is it running on port 3001?)]"}
-
-    elif request.language == "java":
-        generator = JavaMermaidGenerator()
-        mermaid_code = generator.generate(request.code)
-        return {"mermaid": mermaid_code}
+            with metrics.upstream_call("node"):
+                response = await js_client.parse(code)
+        except JSServiceUnavailable:
+            return {"mermaid": UNAVAILABLE_MERMAID, "error": "JS Service Unavailable"}, False
+        if response.status_code == 200:
+            return response.json(), True
+        else:
+            metrics.upstream_error("node", f"http_{response.status_code}")
+            return {"mermaid": f"flowchart TD\n    Error[JS Service Error: {response.text}]", "error": response.text}, False
 
     else:
         raise HTTPException(status_code=400, detail="Unsupported language")
 
-from typing import Optional
+async def render_flowchart(language, code, output_format="mermaid", profile=None, max_nodes=None, detail=None, simplify=False):
+    if output_format not in ("mermaid", "json"):
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    if max_nodes is not None and max_nodes < 3:
+        raise HTTPException(status_code=400, detail="max_nodes must be at least 3")
+    if detail is not None and detail < 0:
+        raise HTTPException(status_code=400, detail="detail must not be negative")
+    if profile is not None:
+        # A profile request has to run the generator, so it skips the cache
+        result, _ = await generate_uncached(language, code, output_format, profile, max_nodes, detail, simplify)
+        return result
+
+    # Exact source first, without parsing. This is the request's one counted
+    # cache lookup; results are only ever cached under this key.
+    stored_key = variant_key(source_key(language, code), language, output_format, max_nodes, detail, simplify)
+    cached = flowchart_cache.get(stored_key)
+    if cached is not None:
+        return cached
+
+    async def generate():
+        if flowchart_store.enabled:
+            cached = await asyncio.to_thread(flowchart_store.get, stored_key)
+            if cached is not None:
+                flowchart_cache.put(stored_key, cached)
+                return cached
+        # The same program formatted differently may have been rendered: the
+        # normalised key maps to the exact key that result is cached under
+        cached = None
+        key = normalized_key(language, code)
+        if key is not None:
+            key = variant_key(key, language, output_format, max_nodes, detail, simplify)
+            alias = flowchart_cache.get(key, count=False)
+            if alias is not None:
+                cached = flowchart_cache.get(alias, count=False)
+        if cached is not None:
+            cacheable = True
+        else:
+            cached, cacheable = await generate_uncached(language, code, output_format, profile, max_nodes, detail, simplify)
+        if cacheable:
+            flowchart_cache.put(stored_key, cached)
+            if key is not None:
+                flowchart_cache.put(key, stored_key, size=len(key) + len(stored_key) + ENTRY_OVERHEAD)
+            await asyncio.to_thread(flowchart_store.put, stored_key, cached)
+        return cached
+
+    return await flowchart_flights.run(stored_key, generate)
+
+# Normalising Python source parses it on the event loop (about 0.5 ms per KB);
+# larger sources are only looked up by their exact text
+NORMALIZE_MAX_PYTHON_BYTES = int(os.getenv("FLOWCHART_NORMALIZE_MAX_PYTHON_BYTES", "4096"))
+
+def normalized_key(language, code):
+    """cache_key() of the source, or None for Python too large to parse here."""
+    if language == "python" and len(code) > NORMALIZE_MAX_PYTHON_BYTES:
+        return None
+    return cache_key(language, code)
+
+async def render_incremental(language, code, previous_version):
+    key = "incremental:" + source_key(language, code)
+    result = flowchart_cache.get(key)
+    if result is None:
+        result = await run_on_engine(run_incremental, language, code)
+        # nodes/edges repeat most of the Mermaid text
+        flowchart_cache.put(key, result, size=len(result["mermaid"]) * 3)
+
+    response = {"mermaid": result["mermaid"], "version": result["version"], "lines": result["lines"], "diff": None}
+    if "error" in result:
+        response["error"] = result["error"]
+        return response
+
+    version_store.put(result["version"], result["nodes"], result["edges"], result["lines"])
+    previous = version_store.get(previous_version) if previous_version else None
+    if previous is not None:
+        response["diff"] = diff_graphs(*previous, result["nodes"], result["edges"], result["lines"])
+    return response
+
+# Source text of recently outlined files, so expand requests only need the source id
+outline_sources = FlowchartCache(int(os.getenv("FLOWCHART_OUTLINE_SOURCE_BYTES", str(32 * 1024 * 1024))))
+
+async def run_on_engine(fn, language, *args):
+    try:
+        return await flowchart_engine.submit(fn, language, *args, priority=LANGUAGE_PRIORITY.get(language, PRIORITY_NORMAL))
+    except EngineBusy:
+        raise HTTPException(status_code=503, detail="Flowchart generator is busy, try again shortly")
+    except EngineTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except BrokenProcessPool:
+        # The engine has already replaced the worker
+        raise HTTPException(status_code=503, detail="A flowchart worker crashed and was restarted, try again")
+
+async def render_outline(language, code):
+    # The source id (cache_key) is computed on the worker, along with the outline
+    key = "outline:" + source_key(language, code)
+    result = flowchart_cache.get(key)
+    if result is None:
+        result = await run_on_engine(run_outline, language, code)
+        flowchart_cache.put(key, result, size=len(result["mermaid"]) * 2)
+    outline_sources.put(result["sourceId"], {"code": code})
+    return result
+
+class ExpandRequest(BaseModel):
+    language: str
+    sourceId: str
+    id: str # definition id from the outline, e.g. "Main.factorial(int)"
+    code: Optional[str] = None # only needed if the server has forgotten the source
+
+@app.post("/generate-flowchart/expand")
+async def expand_flowchart(request: ExpandRequest):
+    if request.language not in ("python", "java"):
+        raise HTTPException(status_code=400, detail="Unsupported language")
+    # Source ids are cache keys, which start with their language
+    if not request.sourceId.startswith(request.language + ":"):
+        raise HTTPException(status_code=400, detail="sourceId is not a source in this language")
+
+    key = f"expand:{request.sourceId}:{request.id}"
+    result = flowchart_cache.get(key)
+    if result is not None:
+        return result
+
+    # Code sent by the client is only trusted once it hashes to the sourceId,
+    # or anyone could plant a chart under somebody else's source
+    source = outline_sources.get(request.sourceId)
+    code = source["code"] if source is not None else request.code
+    if code is None:
+        raise HTTPException(status_code=404, detail="Unknown sourceId, resend the code")
+
+    result = await run_on_engine(run_expand, request.language, request.sourceId, code, request.id, source is None)
+    if "mermaid" not in result:
+        raise HTTPException(status_code=result["status"], detail=result["error"])
+    if source is None:
+        outline_sources.put(request.sourceId, {"code": code})
+    flowchart_cache.put(key, result)
+    return result
+
+@app.post("/generate-flowchart")
+async def generate_flowchart(request: CodeRequest, http_request: Request):
+    language = request.language if request.language in ("python", "java", "javascript") else "other"
+    started = time.perf_counter()
+    if request.outline and request.language in ("python", "java"):
+        mode = "outline"
+        result = await render_outline(request.language, request.code)
+    elif request.incremental and request.language in ("python", "java"):
+        mode = "incremental"
+        result = await render_incremental(request.language, request.code, request.previousVersion)
+    else:
+        mode = request.format if request.format in ("mermaid", "json") else "other"
+        # X-Profile: 1|cprofile (or ?profile=), honoured only when FLOWCHART_PROFILING=1
+        profile = profiling.requested_mode(
+            http_request.headers.get("x-profile") or http_request.query_params.get("profile")
+        )
+        result = await render_flowchart(
+            request.language, request.code, request.format, profile,
+            request.max_nodes, request.detail, request.simplify,
+        )
+    metrics.FLOWCHART_REQUESTS.labels(language, mode).inc()
+    metrics.FLOWCHART_LATENCY.labels(language, mode).observe(time.perf_counter() - started)
+    return result
+
+class BatchItem(BaseModel):
+    id: str
+    language: str
+    code: str
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    stream: bool = False # NDJSON, one line per item as it finishes
+
+BATCH_MAX_ITEMS = int(os.getenv("FLOWCHART_BATCH_MAX_ITEMS", "5000"))
+
+async def run_batch(items):
+    """Yields (index, result) per item, in completion order. Failures are
+    reported per item and never abort the batch."""
+    # Keep the process pool saturated without tripping its queue limit, and
+    # pipeline JS items to the Node service (if used) over the shared connection pool.
+    engine_slots = asyncio.Semaphore(flowchart_engine.pool_size * 2)
+    js_slots = asyncio.Semaphore(JS_MAX_CONNECTIONS)
+
+    async def run_item(index, item):
+        slots = js_slots if item.language == "javascript" and not JS_IN_PROCESS else engine_slots
+        async with slots:
+            try:
+                result = await render_flowchart(item.language, item.code, simplify=True)
+            except HTTPException as e:
+                return index, {"id": item.id, "ok": False, "error": e.detail}
+            except Exception as e:
+                return index, {"id": item.id, "ok": False, "error": str(e) or type(e).__name__}
+        return index, {"id": item.id, "ok": "error" not in result, **result}
+
+    for finished in asyncio.as_completed([run_item(index, item) for index, item in enumerate(items)]):
+        yield await finished
+
+@app.post("/generate-flowchart/batch")
+async def generate_flowchart_batch(request: BatchRequest):
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items")
+
+    if request.stream:
+        async def ndjson():
+            async for _, result in run_batch(request.items):
+                yield json.dumps(result) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    results = [None] * len(request.items)
+    async for index, result in run_batch(request.items):
+        results[index] = result
+    return {"results": results}
+
+@app.get("/generate-flowchart/cache-stats")
+async def flowchart_cache_stats():
+    return {**flowchart_cache.stats(), "store": flowchart_store.stats()}
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the event loop is responding
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: the warmed worker pools are up
+    if not (flowchart_engine.ready and trace_engine.ready):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready", "engine": flowchart_engine.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/generate-flowchart/engine-stats")
+async def flowchart_engine_stats():
+    return flowchart_engine.stats()
+
+class VisualizeRequest(BaseModel):
+    code: str
+    language: str = "python"
+    encoding: str = "full" # "delta": sparse steps with a full keyframe every keyframe_interval steps
+
+@app.post("/api/visualize")
+async def visualize(request: VisualizeRequest):
+    if request.language != "python":
+        raise HTTPException(status_code=400, detail="Execution tracing is only supported for Python")
+    if request.encoding not in ("full", "delta"):
+        raise HTTPException(status_code=400, detail="Unsupported encoding")
+
+    key = f"{request.encoding}:" + hashlib.sha256(request.code.encode("utf-8", "surrogatepass")).hexdigest()
+    try:
+        result = await trace_flights.run(key, lambda: trace_engine.submit(run_trace, request.code, request.encoding))
+    except EngineBusy:
+        raise HTTPException(status_code=503, detail="Visualizer is busy, try again shortly")
+    except EngineTimeout as e:
+        return JSONResponse(status_code=408, content={"detail": str(e), "partial": {"steps": []}})
+    except BrokenProcessPool:
+        # The worker was killed by its CPU limit (tracer.lock_down) while stuck in C code
+        return JSONResponse(status_code=408, content={"detail": "Execution exceeded its CPU limit", "partial": {"steps": []}})
+
+    if result["status"] == "error" and not result["steps"]:
+        # Nothing ran (e.g. a syntax error)
+        raise HTTPException(status_code=400, detail=result["error"])
+
+    trace = {"steps": result["steps"]}
+    if request.encoding == "delta":
+        trace = {"encoding": "delta", "keyframe_interval": result["keyframe_interval"], **trace}
+
+    if result["status"] in ("timeout", "step_limit"):
+        detail = "Execution timed out" if result["status"] == "timeout" else "Execution exceeded the step limit"
+        return JSONResponse(status_code=408, content={"detail": detail, "partial": trace})
+    # The frontend reads the full encoding as a bare list of steps
+    return trace["steps"] if request.encoding == "full" else trace
+
+class SqlRequest(BaseModel):
+    sql: str
+    session_id: Optional[str] = None # from the first line of an earlier response; omit to start fresh
+    page_size: Optional[int] = None
+
+@app.post("/api/sql")
+async def run_sql(request: SqlRequest):
+    """Runs one statement against the session's copy of the practice database.
+    The response is NDJSON: a header line (session_id, columns, changes), one
+    line per page of rows, and a closing line with the row count."""
+    if not request.sql.strip():
+        raise HTTPException(status_code=400, detail="No SQL provided")
+    if request.session_id is not None and not 0 < len(request.session_id) <= 64:
+        raise HTTPException(status_code=400, detail="Invalid session_id")
+    page_size = request.page_size or SQL_PAGE_SIZE
+    if not 0 < page_size <= SQL_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"page_size must be between 1 and {SQL_MAX_ROWS}")
+
+    # sqlite3 releases the GIL while it runs, a thread is enough
+    try:
+        result = await asyncio.to_thread(sql_sandbox.execute, request.sql, request.session_id)
+    except SqlTimeout as e:
+        raise HTTPException(status_code=408, detail=str(e))
+    except SessionBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except SqlError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def pages():
+        rows = result["rows"]
+        yield json.dumps({"session_id": result["session_id"], "columns": result["columns"], "changes": result["changes"]}) + "\n"
+        for start in range(0, len(rows), page_size):
+            yield json.dumps({"page": start // page_size, "rows": rows[start:start + page_size]}) + "\n"
+        yield json.dumps({"done": True, "row_count": len(rows), "truncated": result["truncated"]}) + "\n"
+    return StreamingResponse(pages(), media_type="application/x-ndjson")
+
+@app.delete("/api/sql/sessions/{session_id}")
+async def reset_sql_session(session_id: str):
+    # Waits for a query still running in the session
+    try:
+        return {"reset": await asyncio.to_thread(sql_sandbox.reset, session_id)}
+    except SessionBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/sql/stats")
+async def sql_stats():
+    return sql_sandbox.stats()
 
 class ChatRequest(BaseModel):
     message: Optional[str] = ""
     model: str = "llama"
     apiKey: Optional[str] = None
     currentCode: Optional[str] = None
+    language: Optional[str] = None # of currentCode; detected when missing
     image: Optional[str] = None # Base64 string
     fileName: Optional[str] = None
+    stream: bool = False # NDJSON, or SSE when the client accepts text/event-stream
+
+async def build_chat_payload(request):
+    """Returns (payload, context report); the report is None without code."""
+    # Determine model
+    model = "llama-3.3-70b-versatile" # Updated from decommissioned llama3-70b-8192
+    if request.image:
+        model = "meta-llama/llama-4-scout-17b-16e-instruct" # Updated to Llama 4 Scout (Multimodal)
+
+    # Construct messages
+    messages = []
+    
+    # System prompt with context
+    system_content = "You are a helpful AI coding assistant."
+    context_report = None
+    if request.currentCode:
+        # Large files are cut down to the code the message is about, which parses them
+        try:
+            context, context_report = await flowchart_engine.submit(
+                run_select_context, request.language, request.currentCode, request.message,
+                priority=LANGUAGE_PRIORITY.get(request.language, PRIORITY_NORMAL),
+            )
+        except (EngineBusy, EngineTimeout, BrokenProcessPool):
+            # No worker to spare: send the whole file rather than fail the chat
+            context, context_report = full_context(request.currentCode, request.language)
+        metrics.CHAT_CONTEXT_CHARS.labels("original").inc(context_report["original_chars"])
+        metrics.CHAT_CONTEXT_CHARS.labels("sent").inc(context_report["sent_chars"])
+        system_content += f"\n\nCurrent Code Context ({context_report['language'] or 'unknown'}):\n```\n{context}\n```"
+    
+    messages.append({"role": "system", "content": system_content})
+
+    # User message
+    user_content = []
+    if request.message:
+        user_content.append({"type": "text", "text": request.message})
+    
+    if request.image:
+        # Groq expects image_url with base64 data
+        image_data = request.image
+        # Ensure it has the prefix if missing (frontend usually sends it, but good to be safe)
+        if not image_data.startswith("data:"):
+            # Assume jpeg if unknown, but frontend should send full data URI
+            image_data = f"data:image/jpeg;base64,{image_data}"
+            
+        user_content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": image_data
+            }
+        })
+        
+    messages.append({"role": "user", "content": user_content if request.image else request.message})
+
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1024
+    }, context_report
+
+async def stream_chat(api_key, payload, sse, context_report=None):
+    """Forwards tokens as they arrive, as SSE events or NDJSON lines."""
+    def frame(obj):
+        line = json.dumps(obj)
+        return f"data: {line}\n\n" if sse else f"{line}\n"
+
+    try:
+        with metrics.upstream_call("llm"):
+            async for delta in llm_client.stream(api_key, payload):
+                yield frame({"role": "assistant", "delta": delta})
+    except LLMError as e:
+        print(f"Groq API Error: {e.status_code} - {e.text}") # Log error to console
+        yield frame({"role": "assistant", "error": f"Error from Groq API: {e.status_code} - {e.text}"})
+    except Exception as e:
+        print(f"Backend Exception: {str(e)}") # Log exception
+        yield frame({"role": "assistant", "error": f"Backend Error: {str(e)}"})
+    yield frame({"role": "assistant", "done": True, "context": context_report})
 
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     if request.model == "notion":
          return {"role": "assistant", "content": "Notion integration is handled on the frontend for now."}
 
@@ -72,70 +575,61 @@ async def chat(request: ChatRequest):
         GROQ_API_KEY = os.getenv("GROQ_API_KEY")
         if not GROQ_API_KEY:
              return {"role": "assistant", "content": "Error: GROQ_API_KEY not found in environment variables."}
-        
-        # Determine model
-        model = "llama-3.3-70b-versatile" # Updated from decommissioned llama3-70b-8192
-        if request.image:
-            model = "meta-llama/llama-4-scout-17b-16e-instruct" # Updated to Llama 4 Scout (Multimodal)
 
-        # Construct messages
-        messages = []
-        
-        # System prompt with context
-        system_content = "You are a helpful AI coding assistant."
-        if request.currentCode:
-            system_content += f"\n\nCurrent Code Context ({request.language if hasattr(request, 'language') else 'unknown'}):\n```\n{request.currentCode}\n```"
-        
-        messages.append({"role": "system", "content": system_content})
+        payload, context_report = await build_chat_payload(request)
 
-        # User message
-        user_content = []
-        if request.message:
-            user_content.append({"type": "text", "text": request.message})
-        
-        if request.image:
-            # Groq expects image_url with base64 data
-            image_data = request.image
-            # Ensure it has the prefix if missing (frontend usually sends it, but good to be safe)
-            if not image_data.startswith("data:"):
-                # Assume jpeg if unknown, but frontend should send full data URI
-                image_data = f"data:image/jpeg;base64,{image_data}"
-                
-            user_content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": image_data
-                }
-            })
-            
-        messages.append({"role": "user", "content": user_content if request.image else request.message})
-
-        # Call Groq API
-        url = "https://api.groq.com/openai/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1024
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        
-        if response.status_code == 200:
-            data = response.json()
-            content = data['choices'][0]['message']['content']
-            return {"role": "assistant", "content": content}
-        else:
-            print(f"Groq API Error: {response.status_code} - {response.text}") # Log error to console
-            return {"role": "assistant", "content": f"Error from Groq API: {response.status_code} - {response.text}"}
+        if request.stream:
+            sse = "text/event-stream" in http_request.headers.get("accept", "")
+            return StreamingResponse(
+                stream_chat(GROQ_API_KEY, payload, sse, context_report),
+                media_type="text/event-stream" if sse else "application/x-ndjson",
+            )
+
+        async def complete():
+            with metrics.upstream_call("llm"):
+                return await llm_client.complete(GROQ_API_KEY, payload)
+
+        # Call Groq API, once for identical questions asked at the same time
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8", "surrogatepass")).hexdigest()
+        content = await chat_flights.run(key, complete)
+        return {"role": "assistant", "content": content, "context": context_report}
+
+    except LLMError as e:
+        print(f"Groq API Error: {e.status_code} - {e.text}") # Log error to console
+        return {"role": "assistant", "content": f"Error from Groq API: {e.status_code} - {e.text}"}
 
     except Exception as e:
         print(f"Backend Exception: {str(e)}") # Log exception
         return {"role": "assistant", "content": f"Backend Error: {str(e)}"}
 
+@app.post("/api/chat/upload")
+async def chat_upload(http_request: Request):
+    """Chat with an attached image, as multipart/form-data: the ChatRequest
+    fields plus an `image` file. The image is downscaled here before it is
+    forwarded, instead of travelling as a full-size base64 string."""
+    try:
+        upload = await receive_upload(http_request)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        fields = upload.fields
+        request = ChatRequest(
+            message=fields.get("message", ""),
+            model=fields.get("model") or "llama",
+            apiKey=fields.get("apiKey"),
+            currentCode=fields.get("currentCode"),
+            language=fields.get("language"),
+            fileName=fields.get("fileName"),
+            stream=fields.get("stream", "").lower() in ("1", "true"),
+        )
+        if upload.file is not None:
+            request.image = await asyncio.to_thread(prepare_image, upload)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        upload.close()
+    return await chat(request, http_request)
+
 if __name__ == "__main__":
+    # Single process for development; start_services.py runs the multi-worker setup
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,124 @@
+"""Prometheus metrics, served by /metrics.
+
+With several uvicorn workers, point PROMETHEUS_MULTIPROC_DIR at an empty
+directory shared by all of them (clear it before the workers start); every
+worker then writes its samples there and /metrics aggregates them. The
+variable must be set before this module is imported.
+
+Recording is a dict lookup plus an add under a lock (an mmap write in
+multiprocess mode), i.e. a few microseconds per observation.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000)
+
+HTTP_REQUESTS = Counter(
+    "codelearn_http_requests_total", "HTTP requests by endpoint and status",
+    ["endpoint", "method", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "codelearn_http_request_duration_seconds", "Time until the response headers are sent",
+    ["endpoint"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "codelearn_http_requests_in_flight", "Requests currently being handled",
+    ["endpoint"], multiprocess_mode="livesum",
+)
+
+FLOWCHART_REQUESTS = Counter(
+    "codelearn_flowchart_requests_total", "Flowchart requests by language and mode",
+    ["language", "mode"],
+)
+FLOWCHART_LATENCY = Histogram(
+    "codelearn_flowchart_duration_seconds", "Flowchart request latency by language and mode",
+    ["language", "mode"], buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "codelearn_flowchart_stage_seconds", "Generator time per stage (parse includes AST traversal)",
+    ["language", "stage"], buckets=STAGE_BUCKETS,
+)
+GRAPH_NODES = Histogram(
+    "codelearn_flowchart_nodes", "Nodes per generated flowchart",
+    ["language"], buckets=SIZE_BUCKETS,
+)
+GRAPH_EDGES = Histogram(
+    "codelearn_flowchart_edges", "Edges per generated flowchart",
+    ["language"], buckets=SIZE_BUCKETS,
+)
+
+UPSTREAM_LATENCY = Histogram(
+    "codelearn_upstream_duration_seconds", "Calls to the Node.js parser and the LLM API",
+    ["service"], buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "codelearn_upstream_errors_total", "Failed upstream calls by reason",
+    ["service", "reason"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "codelearn_upstream_in_flight", "Upstream calls currently waiting for a response",
+    ["service"], multiprocess_mode="livesum",
+)
+
+ADMISSION_REJECTED = Counter(
+    "codelearn_admission_rejected_total", "Requests refused by the per-client rate limit",
+    ["endpoint"],
+)
+COALESCED_REQUESTS = Counter(
+    "codelearn_coalesced_requests_total", "Requests that shared an identical in-flight computation",
+    ["endpoint"],
+)
+
+CHAT_CONTEXT_CHARS = Counter(
+    "codelearn_chat_context_chars_total", "Editor code in chat prompts, before (original) and after (sent) trimming",
+    ["kind"],
+)
+
+def observe_generation(language, stats):
+    """Records the timings and graph size reported by a flowchart worker."""
+    STAGE_SECONDS.labels(language, "parse").observe(stats["parse"])
+    STAGE_SECONDS.labels(language, "render").observe(stats["render"])
+    if stats.get("nodes") is not None:
+        GRAPH_NODES.labels(language).observe(stats["nodes"])
+        GRAPH_EDGES.labels(language).observe(stats["edges"])
+
+
+@contextmanager
+def upstream_call(service):
+    UPSTREAM_IN_FLIGHT.labels(service).inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        status_code = getattr(e, "status_code", None)
+        UPSTREAM_ERRORS.labels(service, f"http_{status_code}" if status_code else type(e).__name__).inc()
+        raise
+    finally:
+        UPSTREAM_LATENCY.labels(service).observe(time.perf_counter() - started)
+        UPSTREAM_IN_FLIGHT.labels(service).dec()
+
+
+def upstream_error(service, reason):
+    UPSTREAM_ERRORS.labels(service, reason).inc()
+
+
+def render_metrics():
+    """Returns (body, content_type) in the Prometheus text format."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    # Drops this worker's live gauges from the shared directory
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,193 @@
+"""Outline-first flowcharts for large files.
+
+The outline is only the class/function/method skeleton, keyed by stable
+qualified names ("Main.factorial", "Main.add(int,int)"). The detailed flowchart
+of a single definition is produced on demand by expand(), from a parse that is
+cached per source so repeated expansions don't re-parse the file.
+"""
+import ast
+import hashlib
+import os
+
+from javalang.tree import ClassDeclaration, ConstructorDeclaration, EnumDeclaration, InterfaceDeclaration, MethodDeclaration, Statement
+
+from flowchart_cache import FlowchartCache
+from flowchart_ir import BOX, RAW_BOX
+from flowchart_render import to_mermaid
+from python_parser import MermaidGenerator
+from java_parser import JavaMermaidGenerator, java_nodes
+
+PARSE_CACHE_BYTES = int(os.getenv("FLOWCHART_PARSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Parsed trees and their definition index, keyed by source id
+parse_cache = FlowchartCache(PARSE_CACHE_BYTES)
+
+JAVA_TYPES = (ClassDeclaration, InterfaceDeclaration, EnumDeclaration)
+
+
+class UnknownDefinition(Exception):
+    pass
+
+
+def outline_node_id(def_id, line):
+    digest = hashlib.sha1(def_id.encode("utf-8")).hexdigest()[:8]
+    return f"D{digest}" + (f"_L{line}" if line else "")
+
+
+def unique(def_id, seen):
+    # Redefinitions / overloads with identical signatures still need distinct IDs
+    count = seen.get(def_id, 0)
+    seen[def_id] = count + 1
+    return def_id if count == 0 else f"{def_id}#{count + 1}"
+
+
+def index_python(tree):
+    """Returns [(entry, node)] for every class and function, in source order."""
+    definitions = []
+    seen = {}
+
+    def walk(body, parent):
+        for stmt in body:
+            if isinstance(stmt, ast.ClassDef):
+                kind = "class"
+            elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kind = "method" if parent and parent["kind"] == "class" else "function"
+            else:
+                continue
+            def_id = unique(f"{parent['id']}.{stmt.name}" if parent else stmt.name, seen)
+            entry = {
+                "id": def_id,
+                "kind": kind,
+                "name": stmt.name,
+                "line": stmt.lineno,
+                "end_line": stmt.end_lineno,
+                "parent": parent["id"] if parent else None,
+                "statements": sum(1 for node in ast.walk(stmt) if isinstance(node, ast.stmt)) - 1,
+            }
+            definitions.append((entry, stmt))
+            walk(stmt.body, entry)
+
+    walk(tree.body, None)
+    return definitions
+
+
+def java_signature(method):
+    params = []
+    for param in method.parameters:
+        type_name = param.type.name + "[]" * len(param.type.dimensions or [])
+        params.append(type_name + ("..." if param.varargs else ""))
+    return f"{method.name}({','.join(params)})"
+
+
+def index_java(tree):
+    definitions = []
+    seen = {}
+
+    def walk(type_decl, parent):
+        def_id = unique(f"{parent['id']}.{type_decl.name}" if parent else type_decl.name, seen)
+        entry = {
+            "id": def_id,
+            "kind": "class",
+            "name": type_decl.name,
+            "line": type_decl.position.line if type_decl.position else None,
+            "end_line": None,
+            "parent": parent["id"] if parent else None,
+            "statements": 0,
+        }
+        definitions.append((entry, type_decl))
+        for member in type_decl.body or []:
+            if isinstance(member, JAVA_TYPES):
+                walk(member, entry)
+            elif isinstance(member, (MethodDeclaration, ConstructorDeclaration)):
+                method_entry = {
+                    "id": unique(f"{def_id}.{java_signature(member)}", seen),
+                    "kind": "method",
+                    "name": member.name,
+                    "line": member.position.line if member.position else None,
+                    "end_line": None,
+                    "parent": def_id,
+                    "statements": sum(1 for _ in java_nodes(member, Statement)),
+                }
+                definitions.append((method_entry, member))
+
+    for type_decl in tree.types:
+        walk(type_decl, None)
+    return definitions
+
+
+def parse_source(language, source_id, code):
+    """Parses and indexes the source once per source id."""
+    cached = parse_cache.get(source_id) if source_id else None
+    if cached is not None:
+        return cached
+
+    if language == "python":
+        definitions = index_python(ast.parse(code))
+    elif language == "java":
+        definitions = index_java(JavaMermaidGenerator().parse(code))
+    else:
+        raise ValueError(f"No outline support for {language}")
+
+    parsed = {"definitions": definitions, "by_id": {entry["id"]: node for entry, node in definitions}}
+    if source_id:
+        # A parse tree is roughly ten times the size of its source text
+        parse_cache.put(source_id, parsed, size=len(code) * 10 + 1024)
+    return parsed
+
+
+def generate_outline(language, source_id, code):
+    """Returns {"mermaid", "definitions"} with one node per class/function."""
+    generator = MermaidGenerator() if language == "python" else JavaMermaidGenerator()
+    try:
+        parsed = parse_source(language, source_id, code)
+    except Exception:
+        # Same error chart (and error field) as the full generator
+        return {"mermaid": generator.generate(code), "definitions": [], "error": generator.error or "parse error"}
+
+    graph = generator.graph
+    entries = [dict(entry) for entry, _ in parsed["definitions"]]
+    node_ids = {}
+    for entry in entries:
+        node_id = outline_node_id(entry["id"], entry["line"])
+        node_ids[entry["id"]] = node_id
+        entry["node"] = node_id
+        if entry["kind"] == "class":
+            graph.add_node(node_id, RAW_BOX, f"Class {generator.safe_label(entry['name'])}", entry["line"], "startend")
+        else:
+            label = f"Def {generator.safe_label(entry['name'])} ({entry['statements']} statements)"
+            graph.add_node(node_id, BOX, label, entry["line"], "process")
+
+    # Top-level definitions form the main flow, members hang off their class
+    for entry in entries:
+        if entry["parent"] is None:
+            graph.add_edge(generator.last_node, entry["node"])
+            generator.last_node = entry["node"]
+        else:
+            graph.add_edge(node_ids[entry["parent"]], entry["node"])
+
+    return {"mermaid": to_mermaid(generator.finish()), "definitions": entries}
+
+
+def expand(language, source_id, code, def_id):
+    """Returns {"mermaid"} for the detailed flowchart of one definition."""
+    parsed = parse_source(language, source_id, code)
+    node = parsed["by_id"].get(def_id)
+    if node is None:
+        raise UnknownDefinition(def_id)
+
+    if language == "python":
+        generator = MermaidGenerator()
+        if isinstance(node, ast.ClassDef):
+            for stmt in node.body:
+                generator.visit(stmt)
+        else:
+            generator.visit(node)
+    else:
+        generator = JavaMermaidGenerator()
+        if isinstance(node, JAVA_TYPES):
+            for member in node.body or []:
+                if isinstance(member, MethodDeclaration):
+                    generator.visit_method(member)
+        else:
+            generator.visit_method(node)
+    return {"mermaid": to_mermaid(generator.finish())}
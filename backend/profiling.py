@@ -0,0 +1,164 @@
+"""Opt-in profiling of a single flowchart generation.
+
+Disabled unless FLOWCHART_PROFILING=1. A request then asks for a stage
+breakdown with `X-Profile: 1` (or `?profile=1`), and for a cProfile dump as
+well with `X-Profile: cprofile`. FLOWCHART_PROFILE_SAMPLE_RATE additionally
+profiles that fraction of generator runs into FLOWCHART_PROFILE_DIR, keeping
+the newest FLOWCHART_PROFILE_MAX_FILES dumps.
+
+Stages are measured by wrapping the parse and label functions for the
+duration of one run; the wrappers add a little overhead to each label, so
+compare profiled runs with each other rather than with unprofiled timings.
+Everything here runs inside a pool worker.
+"""
+import ast
+import base64
+import cProfile
+import hashlib
+import marshal
+import os
+import random
+import time
+import zlib
+
+PROFILING_ENABLED = os.getenv("FLOWCHART_PROFILING", "0") == "1"
+SAMPLE_RATE = float(os.getenv("FLOWCHART_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("FLOWCHART_PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("FLOWCHART_PROFILE_MAX_FILES", "200"))
+
+# Values of the X-Profile header / profile query parameter
+STAGES = "stages"
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+
+
+def requested_mode(value):
+    """Maps the header/query value to a profile mode, or None if profiling is off."""
+    if not PROFILING_ENABLED or not value:
+        return None
+    value = value.strip().lower()
+    if value == CPROFILE:
+        return CPROFILE
+    if value in ("1", "true", "yes", STAGES):
+        return STAGES
+    return None
+
+
+def should_sample():
+    return PROFILING_ENABLED and SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+class StageTimer:
+    """Accumulates time per stage; nested calls into the same stage (safe_label
+    of a rendered expression) count once."""
+
+    def __init__(self):
+        self.totals = {}
+        self.depth = {}
+
+    def wrap(self, stage, fn):
+        self.totals.setdefault(stage, 0.0)
+        self.depth.setdefault(stage, 0)
+
+        def timed(*args, **kwargs):
+            if self.depth[stage]:
+                return fn(*args, **kwargs)
+            self.depth[stage] += 1
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.totals[stage] += time.perf_counter() - started
+                self.depth[stage] -= 1
+
+        return timed
+
+
+class ProfileSession:
+    def __init__(self, generator, language, with_cprofile=False):
+        self.generator = generator
+        self.language = language
+        self.timer = StageTimer()
+        self.profiler = cProfile.Profile() if with_cprofile else None
+        self.restore = []
+
+    def patch(self, owner, name, stage):
+        original = getattr(owner, name)
+        self.restore.append((owner, name, original, name in vars(owner)))
+        setattr(owner, name, self.timer.wrap(stage, original))
+
+    def start(self):
+        generator = self.generator
+        if self.language == "python":
+            self.patch(ast, "parse", "parse")
+            self.patch(generator, "expression_label", "labels")
+            self.patch(generator, "safe_label", "labels")
+        elif self.language == "javascript":
+            self.patch(generator, "parse", "parse")
+            self.patch(generator, "expression_label", "labels")
+            self.patch(generator, "safe_label", "labels")
+        else:
+            self.patch(generator, "parse", "parse")
+            self.patch(generator, "get_expression_string", "labels")
+            self.patch(generator, "safe_label", "labels")
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        for owner, name, original, own_attribute in reversed(self.restore):
+            if own_attribute:
+                setattr(owner, name, original)
+            else:
+                # Instance patch over a class method: drop it again
+                delattr(owner, name)
+        self.restore = []
+
+    def report(self, generate_seconds, serialize_seconds):
+        parse = self.timer.totals.get("parse", 0.0)
+        labels = self.timer.totals.get("labels", 0.0)
+        report = {
+            "stages": {
+                "parse": parse,
+                "traversal": max(0.0, generate_seconds - parse - labels),
+                "labels": labels,
+                "serialization": serialize_seconds,
+                "total": generate_seconds + serialize_seconds,
+            },
+        }
+        if self.profiler is not None:
+            report["cprofile"] = encode_stats(self.profiler)
+        return report
+
+
+def pstats_bytes(profiler):
+    # Same layout as pstats.Stats.dump_stats, so the file loads with pstats
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+def encode_stats(profiler):
+    """zlib-compressed, base64 pstats dump. Decode with
+    pstats.Stats(path) after writing zlib.decompress(b64decode(blob)) to path."""
+    return base64.b64encode(zlib.compress(pstats_bytes(profiler))).decode("ascii")
+
+
+def store_profile(language, code, profiler, directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+    """Writes a pstats dump to the rotating store and prunes the oldest dumps."""
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()[:12]
+    # Nanosecond prefix: names sort oldest first
+    name = f"{time.time_ns()}-{os.getpid()}-{language}-{digest}.prof"
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(pstats_bytes(profiler))
+    os.replace(path + ".tmp", path)
+
+    dumps = sorted(entry for entry in os.listdir(directory) if entry.endswith(".prof"))
+    for stale in dumps[:max(0, len(dumps) - max_files)]:
+        try:
+            os.remove(os.path.join(directory, stale))
+        except FileNotFoundError:
+            pass # another worker pruned it first
+    return path
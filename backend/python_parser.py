@@ -1,8 +1,47 @@
 import ast
 
-class MermaidGenerator(ast.NodeVisitor):
-    def __init__(self):
-        self.graph = ["flowchart TD", "    Start([Start])"]
+from flowchart_ir import BOX, CIRCLE, DECISION, IO, TERMINAL, FlowchartGraph
+from flowchart_labels import SourceSegments, python_expression_text, safe_label
+from flowchart_lod import LevelOfDetail
+from flowchart_render import to_mermaid
+from flowchart_walk import walk
+
+# Bump whenever the generated Mermaid changes, so cached flowcharts are invalidated
+GENERATOR_VERSION = "1"
+
+# Labels longer than this are cut to LABEL_LIMIT - 3 characters plus "..."
+LABEL_LIMIT = 50
+
+# Statements that are drawn, by type
+HANDLERS = {
+    ast.Module: "visit_Module",
+    ast.FunctionDef: "visit_FunctionDef",
+    ast.Assign: "visit_Assign",
+    ast.If: "visit_If",
+    ast.While: "visit_While",
+    ast.For: "visit_For",
+    ast.Expr: "visit_Expr",
+    ast.Return: "visit_Return",
+}
+
+# Nodes that can hold statements; expressions, arguments and the like can't
+NESTING = (ast.stmt, ast.excepthandler, ast.match_case)
+
+class MermaidGenerator:
+    def __init__(self, max_nodes=None, detail=None):
+        self.reset()
+        self.error = None
+        self.handlers = {node_type: getattr(self, name) for node_type, name in HANDLERS.items()}
+        # Rendered expression labels by source text (by node without the
+        # source), shared by repeated expressions and both level-of-detail passes
+        self.labels = {}
+        self.segments = None
+        # Only set when the caller asked for a node budget / detail level
+        self.lod = LevelOfDetail(max_nodes, detail) if max_nodes or detail is not None else None
+
+    def reset(self):
+        self.graph = FlowchartGraph()
+        self.graph.add_node("Start", TERMINAL, "Start")
         self.node_counter = 0
         self.last_node = "Start"
 
@@ -12,27 +51,55 @@ class MermaidGenerator(ast.NodeVisitor):
         return f"N{self.node_counter}{suffix}"
 
     def safe_label(self, text):
-        # Escape double quotes, newlines, and other special characters
-        text = text.replace('"', "'").replace('\n', ' ').replace('{', '&#123;').replace('}', '&#125;').replace('[', '&#91;').replace(']', '&#93;')
-        # Truncate long labels
-        if len(text) > 50:
-            return text[:47] + "..."
-        return text
+        return safe_label(text, LABEL_LIMIT)
+
+    def expression_label(self, node):
+        """Escaped, truncated source of an expression; only the part of it
+        that fits in the label is rendered."""
+        key = self.segments.text(node) if self.segments is not None else node
+        label = self.labels.get(key)
+        if label is None:
+            label = self.labels[key] = self.safe_label(python_expression_text(node, LABEL_LIMIT + 1))
+        return label
+
+    def add_node(self, shape, label, lineno=None, css_class=None):
+        node_id = self.new_node_id(lineno)
+        self.graph.add_node(node_id, shape, label, lineno, css_class)
+        return node_id
 
     def add_edge(self, from_node, to_node, label=None):
-        if label:
-            self.graph.append(f"    {from_node} -->|{label}| {to_node}")
-        else:
-            self.graph.append(f"    {from_node} --> {to_node}")
+        self.graph.add_edge(from_node, to_node, label)
+
+    def visit(self, node):
+        walk(([node],), self.handlers, self.visit_children)
+
+    def visit_children(self, node):
+        """Other statements aren't drawn, but the ones nested in them are."""
+        children = [child for child in ast.iter_child_nodes(node) if isinstance(child, NESTING)]
+        return (children,) if children else None
+
+    def visit_body(self, body):
+        if self.lod is None:
+            return (body,)
+        # The tree outlives both passes, so the list's id is a stable key
+        return self.lod.visit_block(self, id(body), body)
+
+    def summarize_block(self, body):
+        """(statement count, first line, last line) of a collapsed block."""
+        if not body:
+            return 0, None, None
+        statements = sum(1 for stmt in body for node in ast.walk(stmt) if isinstance(node, ast.stmt))
+        return statements, body[0].lineno, max(stmt.end_lineno or stmt.lineno for stmt in body)
+
+    def visit_Module(self, node):
+        return self.visit_body(node.body)
 
     def visit_FunctionDef(self, node):
-        func_node = self.new_node_id(node.lineno)
-        self.graph.append(f'    {func_node}["Def {node.name}"]:::process')
+        func_node = self.add_node(BOX, f"Def {node.name}", node.lineno, "process")
         self.add_edge(self.last_node, func_node)
         self.last_node = func_node
         
-        for stmt in node.body:
-            self.visit(stmt)
+        return self.visit_body(node.body)
 
     def visit_Assign(self, node):
         target = node.targets[0]
@@ -41,134 +108,128 @@ class MermaidGenerator(ast.NodeVisitor):
         else:
             var_name = "var"
             
-        value = self.safe_label(ast.unparse(node.value))
-        assign_node = self.new_node_id(node.lineno)
-        self.graph.append(f'    {assign_node}["{var_name} = {value}"]:::process')
+        value = self.expression_label(node.value)
+        assign_node = self.add_node(BOX, f"{var_name} = {value}", node.lineno, "process")
         self.add_edge(self.last_node, assign_node)
         self.last_node = assign_node
 
     def visit_If(self, node):
-        condition = self.safe_label(ast.unparse(node.test))
-        decision_node = self.new_node_id(node.lineno)
-        self.graph.append(f'    {decision_node}{{"{condition}?"}}:::decision')
+        condition = self.expression_label(node.test)
+        decision_node = self.add_node(DECISION, f"{condition}?", node.lineno, "decision")
         self.add_edge(self.last_node, decision_node)
         
         entry_node = decision_node
         
         # True branch
         self.last_node = entry_node
-        yes_node = self.new_node_id()
-        self.graph.append(f'    {yes_node}["Yes"]')
+        yes_node = self.add_node(BOX, "Yes")
         self.add_edge(entry_node, yes_node, "True")
         self.last_node = yes_node
         
-        for stmt in node.body:
-            self.visit(stmt)
+        yield from self.visit_body(node.body)
         true_branch_end = self.last_node
 
         # False branch
         self.last_node = entry_node
-        no_node = self.new_node_id()
-        self.graph.append(f'    {no_node}["No"]')
+        no_node = self.add_node(BOX, "No")
         self.add_edge(entry_node, no_node, "False")
         self.last_node = no_node
         
-        for stmt in node.orelse:
-            self.visit(stmt)
+        yield from self.visit_body(node.orelse)
         false_branch_end = self.last_node
 
         # Merge point
-        merge_node = self.new_node_id()
-        self.graph.append(f"    {merge_node}(( ))")
+        merge_node = self.add_node(CIRCLE, None)
         self.add_edge(true_branch_end, merge_node)
         self.add_edge(false_branch_end, merge_node)
         self.last_node = merge_node
 
     def visit_While(self, node):
-        condition = self.safe_label(ast.unparse(node.test))
-        loop_start = self.new_node_id(node.lineno)
-        self.graph.append(f'    {loop_start}{{"{condition}?"}}:::decision')
+        condition = self.expression_label(node.test)
+        loop_start = self.add_node(DECISION, f"{condition}?", node.lineno, "decision")
         self.add_edge(self.last_node, loop_start)
         
         # Body (True)
         self.last_node = loop_start
-        do_node = self.new_node_id()
-        self.graph.append(f'    {do_node}["Loop Body"]')
+        do_node = self.add_node(BOX, "Loop Body")
         self.add_edge(loop_start, do_node, "True")
         self.last_node = do_node
         
-        for stmt in node.body:
-            self.visit(stmt)
+        yield from self.visit_body(node.body)
             
         # Loop back
         self.add_edge(self.last_node, loop_start)
         
         # Exit (False)
-        end_node = self.new_node_id()
-        self.graph.append(f'    {end_node}["End Loop"]')
+        end_node = self.add_node(BOX, "End Loop")
         self.add_edge(loop_start, end_node, "False")
         self.last_node = end_node
 
     def visit_For(self, node):
-        target = self.safe_label(ast.unparse(node.target))
-        iter_ = self.safe_label(ast.unparse(node.iter))
-        loop_check = self.new_node_id(node.lineno)
-        self.graph.append(f'    {loop_check}{{"For {target} in {iter_}?"}}:::decision')
+        target = self.expression_label(node.target)
+        iter_ = self.expression_label(node.iter)
+        loop_check = self.add_node(DECISION, f"For {target} in {iter_}?", node.lineno, "decision")
         self.add_edge(self.last_node, loop_check)
         
         # Body
-        next_item = self.new_node_id()
-        self.graph.append(f'    {next_item}["Next Item"]')
+        next_item = self.add_node(BOX, "Next Item")
         self.add_edge(loop_check, next_item, "Has Next")
         self.last_node = next_item
         
-        for stmt in node.body:
-            self.visit(stmt)
+        yield from self.visit_body(node.body)
             
         # Loop back
         self.add_edge(self.last_node, loop_check)
         
         # Exit
-        end_node = self.new_node_id()
-        self.graph.append(f'    {end_node}["End Loop"]')
+        end_node = self.add_node(BOX, "End Loop")
         self.add_edge(loop_check, end_node, "Done")
         self.last_node = end_node
 
     def visit_Expr(self, node):
         if isinstance(node.value, ast.Call):
-            call = self.safe_label(ast.unparse(node.value))
-            call_node = self.new_node_id(node.lineno)
+            call = self.expression_label(node.value)
             if call.startswith("print("):
-                self.graph.append(f'    {call_node}[/"{call}"/]:::io')
+                call_node = self.add_node(IO, call, node.lineno, "io")
             else:
-                self.graph.append(f'    {call_node}["{call}"]:::process')
+                call_node = self.add_node(BOX, call, node.lineno, "process")
             self.add_edge(self.last_node, call_node)
             self.last_node = call_node
 
     def visit_Return(self, node):
-        val = self.safe_label(ast.unparse(node.value)) if node.value else "None"
-        ret_node = self.new_node_id(node.lineno)
-        self.graph.append(f'    {ret_node}["Return {val}"]:::process')
+        val = self.expression_label(node.value) if node.value else "None"
+        ret_node = self.add_node(BOX, f"Return {val}", node.lineno, "process")
         self.add_edge(self.last_node, ret_node)
         self.last_node = ret_node
 
-    def generate(self, code):
+    def finish(self):
+        self.graph.add_node("End", TERMINAL, "End", css_class="startend")
+        self.add_edge(self.last_node, "End")
+        return self.graph
+
+    def generate_graph(self, code):
+        """Builds the flowchart IR, or returns None (with self.error set) on failure."""
         try:
             tree = ast.parse(code)
+            self.segments = SourceSegments(code)
             self.visit(tree)
-            self.graph.append(f"    End([End]):::startend")
-            self.add_edge(self.last_node, "End")
-            
-            # Add Styling Definitions
-            self.graph.append("    classDef startend fill:#003366,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    classDef process fill:#0070C0,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    classDef decision fill:#4CAF50,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    classDef io fill:#0070C0,stroke:#333,stroke-width:2px,color:white")
-            self.graph.append("    style Start fill:#003366,stroke:#333,stroke-width:2px,color:white")
-            
-            return "\n".join(self.graph)
+            if self.lod is not None and self.lod.plan(self.node_counter + 2):
+                # Over budget: draw again with the chosen blocks collapsed
+                self.reset()
+                self.visit(tree)
+            return self.finish()
         except Exception as e:
-            return f'flowchart TD\n    Error["Error parsing Python code: {str(e)}"]'
+            self.error = str(e)
+            return None
+
+    def error_chart(self):
+        return f'flowchart TD\n    Error["Error parsing Python code: {self.error}"]'
+
+    def generate(self, code):
+        graph = self.generate_graph(code)
+        if graph is None:
+            return self.error_chart()
+        return to_mermaid(graph)
 
 def parse_python_to_mermaid(code):
     generator = MermaidGenerator()
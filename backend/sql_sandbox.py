@@ -0,0 +1,395 @@
+"""Sandboxed SQLite for the SQL builder.
+
+Every session sees its own copy of the seeded practice database, so one
+student's DELETE or DROP never reaches anyone else. Copies are made lazily:
+read-only statements run on pristine connections from a shared pool (clones of
+the template, made with the backup API), and only a session's first write
+saves a copy of the database to a file in SQL_SESSION_DIR. That file then is
+the session's database until the session is reset, idles out or is evicted.
+
+The uvicorn workers share one listening socket, so consecutive requests of a
+session can land on different workers: the session files (and the locks that
+let one query at a time run in a session) are shared by every worker on the
+host through that directory. For the same reason a transaction can't outlive
+the request that opened it; it is rolled back when the statement returns.
+
+Each statement runs under a budget: the progress handler interrupts it after
+SQL_TIME_BUDGET seconds or SQL_MAX_INSTRUCTIONS virtual machine instructions,
+and at most SQL_MAX_ROWS rows are fetched. ATTACH, DETACH and most PRAGMAs
+are refused, and the database size and string/blob length are capped.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are only locked within the process
+    fcntl = None
+
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "4"))
+# Shared by all uvicorn workers on the host
+SQL_SESSION_DIR = os.getenv("SQL_SESSION_DIR", os.path.join(tempfile.gettempdir(), "sql_sessions"))
+# Session databases kept on disk
+SQL_MAX_SESSIONS = int(os.getenv("SQL_MAX_SESSIONS", "256"))
+SQL_SESSION_TTL = float(os.getenv("SQL_SESSION_TTL", "1800"))
+SQL_TIME_BUDGET = float(os.getenv("SQL_TIME_BUDGET", "2"))
+SQL_MAX_INSTRUCTIONS = int(os.getenv("SQL_MAX_INSTRUCTIONS", "50000000"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "10000"))
+SQL_PAGE_SIZE = int(os.getenv("SQL_PAGE_SIZE", "100"))
+# Per-database size cap, in 4 KB pages (10 MB)
+SQL_MAX_PAGES = int(os.getenv("SQL_MAX_PAGES", "2560"))
+SQL_MAX_LENGTH = int(os.getenv("SQL_MAX_LENGTH", str(1024 * 1024)))
+
+# The progress handler runs every this many VM instructions
+PROGRESS_INTERVAL = 1000
+# How often a request polls for a session locked by another worker
+LOCK_POLL = 0.01
+
+# Same tables and rows the Node service used to serve
+SEED_SQL = """
+CREATE TABLE employees (id INT, name TEXT, salary INT, department TEXT);
+INSERT INTO employees VALUES (1, 'Alice', 60000, 'Engineering');
+INSERT INTO employees VALUES (2, 'Bob', 45000, 'HR');
+INSERT INTO employees VALUES (3, 'Charlie', 75000, 'Engineering');
+INSERT INTO employees VALUES (4, 'David', 50000, 'Marketing');
+
+CREATE TABLE students (id INT, name TEXT, grade INT);
+INSERT INTO students VALUES (1, 'John', 85);
+INSERT INTO students VALUES (2, 'Jane', 92);
+INSERT INTO students VALUES (3, 'Doe', 78);
+"""
+
+# Authorizer actions that never change the database (transactions are
+# rolled back at the end of the request)
+READ_ACTIONS = {
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE,
+    sqlite3.SQLITE_TRANSACTION, sqlite3.SQLITE_SAVEPOINT,
+}
+DENIED_ACTIONS = {sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH}
+# Schema introspection is the only PRAGMA use the exercises need
+ALLOWED_PRAGMAS = {"table_info", "table_xinfo", "table_list", "index_list", "index_info"}
+
+
+class SqlError(Exception):
+    pass
+
+
+class SqlTimeout(SqlError):
+    pass
+
+
+class SessionBusy(SqlError):
+    pass
+
+
+class Guard:
+    """Authorizer and progress handler of one connection. `wrote` is set when
+    a prepared statement may change the database."""
+
+    def __init__(self):
+        self.wrote = False
+        self.interrupted = None
+        self.disarm()
+
+    def arm(self, time_budget, max_instructions):
+        self.wrote = False
+        self.interrupted = None
+        self.time_budget = time_budget
+        self.deadline = time.monotonic() + time_budget
+        self.instructions_left = max_instructions
+
+    def disarm(self):
+        self.time_budget = None
+        self.deadline = float("inf")
+        self.instructions_left = float("inf")
+
+    def authorize(self, action, arg1, arg2, database, trigger):
+        if action in DENIED_ACTIONS:
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_PRAGMA:
+            return sqlite3.SQLITE_OK if (arg1 or "").lower() in ALLOWED_PRAGMAS else sqlite3.SQLITE_DENY
+        if action not in READ_ACTIONS:
+            self.wrote = True
+        return sqlite3.SQLITE_OK
+
+    def progress(self):
+        self.instructions_left -= PROGRESS_INTERVAL
+        if self.instructions_left < 0:
+            self.interrupted = "instruction"
+        elif time.monotonic() > self.deadline:
+            self.interrupted = "time"
+        # Non-zero aborts the running statement
+        return 1 if self.interrupted else 0
+
+
+def guard_connection(connection):
+    connection.execute(f"PRAGMA max_page_count = {SQL_MAX_PAGES}")
+    connection.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, SQL_MAX_LENGTH)
+    guard = Guard()
+    connection.set_authorizer(guard.authorize)
+    connection.set_progress_handler(guard.progress, PROGRESS_INTERVAL)
+    return connection, guard
+
+
+def open_connection(template=None):
+    connection = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+    if template is not None:
+        template.backup(connection)
+    else:
+        connection.executescript(SEED_SQL)
+    return guard_connection(connection)
+
+
+def open_session_database(path):
+    connection = sqlite3.connect(path, isolation_level=None)
+    # Practice data: a crash may lose the last changes, but never corrupts the file
+    connection.execute("PRAGMA synchronous = OFF")
+    return guard_connection(connection)
+
+
+def session_name(session_id):
+    # Session ids come from the client, they never become file names directly
+    return hashlib.sha256(session_id.encode("utf-8", "surrogatepass")).hexdigest()[:32]
+
+
+class SessionLocks:
+    """One query at a time per session, across all uvicorn workers: a POSIX
+    record lock on one byte of a shared lock file (at an offset derived from
+    the session), plus a thread lock, since record locks belong to the process."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.pid = None
+        self.lock = threading.Lock()
+        # Session name -> [thread lock, threads using it]
+        self.threads = {}
+
+    def file(self):
+        # One descriptor per process; closing any descriptor of the file would drop its locks
+        if self.fd is None or self.pid != os.getpid():
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self.pid = os.getpid()
+        return self.fd
+
+    def lock_record(self, offset, deadline):
+        while True:
+            try:
+                fcntl.lockf(self.file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(LOCK_POLL)
+
+    @contextmanager
+    def hold(self, name, timeout):
+        """Holds the session's lock; raises SessionBusy after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            entry = self.threads.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(timeout=timeout):
+                raise SessionBusy("Another query is still running in this session")
+            try:
+                offset = int(name[:12], 16)
+                if fcntl is not None and not self.lock_record(offset, deadline):
+                    raise SessionBusy("Another query is still running in this session")
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.lockf(self.file(), fcntl.LOCK_UN, 1, offset)
+            finally:
+                entry[0].release()
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.threads[name]
+
+
+def json_value(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+class SqlSandbox:
+    def __init__(self, directory=SQL_SESSION_DIR, pool_size=SQL_POOL_SIZE, max_sessions=SQL_MAX_SESSIONS,
+                 session_ttl=SQL_SESSION_TTL):
+        self.directory = directory
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.lock = threading.Lock()
+        self.locks = None
+        self.template = None
+        self.pool = []
+        self.clones = 0
+
+    def template_connection(self):
+        # Under self.lock
+        if self.template is None:
+            self.template, _ = open_connection()
+        return self.template
+
+    def acquire_pristine(self):
+        with self.lock:
+            if self.pool:
+                return self.pool.pop()
+            template = self.template_connection()
+            self.clones += 1
+            # The template is only ever read, cloning it under the lock keeps that safe
+            return open_connection(template)
+
+    def release_pristine(self, entry):
+        with self.lock:
+            if len(self.pool) < self.pool_size:
+                self.pool.append(entry)
+                return
+        entry[0].close()
+
+    def session_locks(self):
+        with self.lock:
+            if self.locks is None:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+                self.locks = SessionLocks(os.path.join(self.directory, "sessions.lock"))
+            return self.locks
+
+    def database_path(self, name):
+        return os.path.join(self.directory, name + ".sqlite3")
+
+    def save(self, connection, name):
+        """Makes a pristine connection that has been written to the session's database."""
+        path = self.database_path(name)
+        target = sqlite3.connect(path + ".tmp")
+        try:
+            connection.backup(target)
+        finally:
+            target.close()
+        # Readers in other workers see either no database or the whole copy
+        os.replace(path + ".tmp", path)
+
+    def sweep(self):
+        """Deletes the databases of sessions that idled out, then the least
+        recently used ones above max_sessions. Sessions in use are skipped."""
+        now = time.time()
+        databases = []
+        for entry in os.scandir(self.directory):
+            name, _, extension = entry.name.partition(".")
+            if not extension.startswith("sqlite3"):
+                continue
+            try:
+                used = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if extension == "sqlite3":
+                databases.append((used, name))
+            elif now - used > self.session_ttl:
+                # Leftover .tmp or journal of a worker that died mid-write
+                self.delete(name, entry.name)
+        databases.sort(reverse=True)
+        for index, (used, name) in enumerate(databases):
+            if index >= self.max_sessions or now - used > self.session_ttl:
+                self.delete(name, name + ".sqlite3")
+
+    def delete(self, name, file_name):
+        try:
+            with self.session_locks().hold(name, 0):
+                os.remove(os.path.join(self.directory, file_name))
+        except (SessionBusy, FileNotFoundError):
+            pass
+
+    def reset(self, session_id):
+        """Drops a session's changes; its next query sees the seeded database.
+        Returns whether the session had any."""
+        name = session_name(session_id)
+        # Waits for a query still running in the session
+        with self.session_locks().hold(name, SQL_TIME_BUDGET + 1):
+            try:
+                os.remove(self.database_path(name))
+            except FileNotFoundError:
+                return False
+        return True
+
+    def execute(self, sql, session_id=None, max_rows=SQL_MAX_ROWS,
+                time_budget=SQL_TIME_BUDGET, max_instructions=SQL_MAX_INSTRUCTIONS):
+        """Runs one statement. Returns {session_id, columns, rows, truncated,
+        changes}. Raises SqlError, SqlTimeout or SessionBusy."""
+        session_id = session_id or uuid.uuid4().hex
+        name = session_name(session_id)
+        # Waiting longer than a query may run means the session is stuck on something else
+        with self.session_locks().hold(name, time_budget):
+            path = self.database_path(name)
+            own = os.path.exists(path)
+            if own:
+                connection, guard = open_session_database(path)
+                # Its modification time is what the session idles out by
+                os.utime(path)
+            else:
+                connection, guard = self.acquire_pristine()
+            guard.arm(time_budget, max_instructions)
+            before = connection.total_changes
+            try:
+                result = self.run(connection, guard, sql, max_rows)
+                result["changes"] = connection.total_changes - before
+            finally:
+                if connection.in_transaction:
+                    # The session's next request may run on another worker
+                    connection.rollback()
+                if own:
+                    connection.close()
+                elif guard.wrote:
+                    # Diverged from the template: it is this session's database now
+                    self.save(connection, name)
+                    connection.close()
+                else:
+                    self.release_pristine((connection, guard))
+        if not own and guard.wrote:
+            self.sweep()
+        result["session_id"] = session_id
+        return result
+
+    def run(self, connection, guard, sql, max_rows):
+        try:
+            cursor = connection.execute(sql)
+            rows = cursor.fetchmany(max_rows + 1)
+        except sqlite3.Warning as e:
+            # e.g. "You can only execute one statement at a time."
+            raise SqlError(str(e))
+        except sqlite3.Error as e:
+            if guard.interrupted == "time":
+                raise SqlTimeout(f"Query exceeded the {guard.time_budget:g}s time limit")
+            if guard.interrupted == "instruction":
+                raise SqlTimeout("Query exceeded the instruction limit")
+            raise SqlError(str(e))
+        finally:
+            guard.disarm()
+        columns = [column[0] for column in cursor.description or ()]
+        cursor.close()
+        truncated = len(rows) > max_rows
+        rows = [[json_value(value) for value in row] for row in rows[:max_rows]]
+        return {"columns": columns, "rows": rows, "truncated": truncated}
+
+    def stats(self):
+        databases = 0
+        if os.path.isdir(self.directory):
+            databases = sum(1 for entry in os.scandir(self.directory) if entry.name.endswith(".sqlite3"))
+        with self.lock:
+            return {
+                "directory": self.directory,
+                "private_databases": databases,
+                "pool": len(self.pool),
+                "clones": self.clones,
+            }
+
+
+sql_sandbox = SqlSandbox()
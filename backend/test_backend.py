@@ -55,8 +55,36 @@ public class Test {
     except Exception as e:
         print(f"Java Test Failed: {e}")
 
+def test_batch():
+    items = [
+        {"id": "py", "language": "python", "code": "x = 5\nprint(x)"},
+        {"id": "java", "language": "java", "code": "int x = ;"},
+        {"id": "js", "language": "javascript", "code": "let x = 5;"},
+    ]
+    try:
+        response = requests.post(f"{BASE_URL}/generate-flowchart/batch", json={"items": items})
+        print("\nBatch Test:")
+        for result in response.json()['results']:
+            print(result['id'], "ok" if result['ok'] else f"error: {result.get('error')}")
+    except Exception as e:
+        print(f"Batch Test Failed: {e}")
+
+def test_long_expression():
+    # 2,000 terms nest 2,000 BinOps deep: too deep for recursive AST walks
+    code = "total = " + " + ".join(f"x{i}" for i in range(2000)) + "\n"
+    try:
+        print("\nLong Expression Test:")
+        # The outline request fingerprints the AST (its sourceId)
+        for options in ({}, {"outline": True}):
+            response = requests.post(f"{BASE_URL}/generate-flowchart", json={"language": "python", "code": code, **options})
+            print(response.status_code, "error" in response.json(), len(response.json()['mermaid']))
+    except Exception as e:
+        print(f"Long Expression Test Failed: {e}")
+
 if __name__ == "__main__":
     print("Running tests...")
     test_python()
     test_js()
     test_java()
+    test_batch()
+    test_long_expression()
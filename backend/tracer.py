@@ -0,0 +1,380 @@
+"""Execution tracer behind /api/visualize.
+
+Uses sys.monitoring (PEP 669, Python 3.12+) when available and falls back to
+sys.settrace. Both only instrument the user's code object tree, so library
+calls run at full speed. Variable snapshots are delta-encoded against the
+previous step with a full keyframe every KEYFRAME_INTERVAL steps; long traces
+therefore stay small in memory and on the wire, and can still be seeked.
+
+This runs untrusted code in-process: call it from a disposable worker that
+has been through lock_down() (see flowchart_engine), never from the API
+process itself.
+"""
+import builtins
+import io
+import math
+import os
+import reprlib
+import signal
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+FILENAME = "<visualize>"
+
+MAX_STEPS = int(os.getenv("TRACE_MAX_STEPS", "100000"))
+TIME_BUDGET = float(os.getenv("TRACE_TIME_BUDGET", "5"))
+KEYFRAME_INTERVAL = int(os.getenv("TRACE_KEYFRAME_INTERVAL", "100"))
+# Address space a trace worker may add on top of what it uses after start-up
+MEMORY_LIMIT = int(os.getenv("TRACE_MEMORY_MB", "512")) * 1024 * 1024
+MAX_OPEN_FILES = int(os.getenv("TRACE_MAX_OPEN_FILES", "64"))
+
+# Variables the traced program may still see in its worker's environment
+KEPT_ENVIRONMENT = ("PATH", "LANG", "LC_ALL", "TZ")
+
+# Audit events (PEP 578) the traced program may not raise: starting or
+# signalling processes, loading native code, networking, changing files and
+# raising its own limits
+BLOCKED_EVENTS = frozenset({
+    "os.system", "os.exec", "os.posix_spawn", "os.spawn", "os.fork", "os.forkpty",
+    "subprocess.Popen", "os.kill", "os.killpg", "signal.pthread_kill",
+    "ctypes.dlopen", "ctypes.dlsym", "ctypes.call_function",
+    "socket.bind", "socket.connect", "socket.sendmsg", "socket.sendto",
+    "os.remove", "os.rename", "os.rmdir", "os.mkdir", "os.chmod", "os.chown",
+    "os.link", "os.symlink", "os.truncate", "shutil.rmtree",
+    "resource.setrlimit", "resource.prlimit",
+})
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+value_repr = reprlib.Repr()
+value_repr.maxstring = 60
+value_repr.maxother = 60
+value_repr.maxlist = value_repr.maxtuple = value_repr.maxdict = value_repr.maxset = 10
+
+
+class TraceLimit(BaseException):
+    """Raised inside the traced program to stop it. BaseException so a user's
+    `except Exception` can't swallow it."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class OutputCapture(io.TextIOBase):
+    def __init__(self):
+        self.parts = []
+        self.pending = []
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.pending.append(text)
+        return len(text)
+
+    def take(self):
+        if not self.pending:
+            return ""
+        text = "".join(self.pending)
+        self.pending.clear()
+        return text
+
+
+def on_alarm(signum, frame):
+    # Backstop for loops that never produce a new line event (`while True: pass`)
+    raise TraceLimit("timeout")
+
+
+def no_input(*args, **kwargs):
+    raise RuntimeError("input() is not supported in the visualizer")
+
+
+def lock_down(memory_limit=MEMORY_LIMIT, max_open_files=MAX_OPEN_FILES, cpu_seconds=TIME_BUDGET):
+    """Confines a trace worker process before it runs any traced code. Limits
+    are set as both soft and hard limits, so the program can't lift them.
+
+    The worker must be fresh (not forked from the API process, whose memory
+    holds other requests) and run a single trace: `cpu_seconds` is its CPU
+    time for good. The environment is scrubbed of everything but locale and
+    PATH, and files outside the Python installation can't be opened at all,
+    which also keeps /proc/*/environ (the server's original environment) out
+    of reach.
+    """
+    for name in list(os.environ):
+        if name not in KEPT_ENVIRONMENT:
+            del os.environ[name]
+    os.chdir("/")
+    sys.dont_write_bytecode = True
+
+    if resource is not None:
+        used_cpu = sum(os.times()[:2])
+        cpu_limit = math.ceil(used_cpu + cpu_seconds) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max_open_files, max_open_files))
+        try:
+            with open("/proc/self/statm") as statm:
+                in_use = int(statm.read().split()[0]) * resource.getpagesize()
+        except OSError:
+            in_use = 0
+        resource.setrlimit(resource.RLIMIT_AS, (in_use + memory_limit, in_use + memory_limit))
+
+    readable = tuple({
+        os.path.join(os.path.realpath(prefix), "")
+        for prefix in (sys.prefix, sys.base_prefix, sys.exec_prefix, sys.base_exec_prefix)
+    })
+
+    def audit(event, args):
+        if event in BLOCKED_EVENTS:
+            raise PermissionError(f"{event} is not allowed in the visualizer")
+        if event == "open":
+            path, mode, flags = args
+            writing = (mode is not None and any(c in mode for c in "wax+")) or (flags or 0) & WRITE_FLAGS
+            if path is None or isinstance(path, int) or writing:
+                raise PermissionError("Opening files is not allowed in the visualizer")
+            if not os.path.realpath(os.fsdecode(path)).startswith(readable):
+                raise PermissionError("Opening files is not allowed in the visualizer")
+
+    # Audit hooks can't be removed once added
+    sys.addaudithook(audit)
+
+
+def snapshot_variables(frame):
+    variables = {}
+    for name, value in frame.f_locals.items():
+        if name.startswith("__"):
+            continue
+        try:
+            variables[name] = value_repr.repr(value)
+        except Exception:
+            variables[name] = "<unrepresentable>"
+    return variables
+
+
+class ExecutionTracer:
+    def __init__(self, max_steps=MAX_STEPS, time_budget=TIME_BUDGET, keyframe_interval=KEYFRAME_INTERVAL):
+        self.max_steps = max_steps
+        self.time_budget = time_budget
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.steps = []
+        self.output = OutputCapture()
+        self.deadline = None
+        self.stopped = None
+        # Last snapshot, one {name: repr} dict per frame from the module up
+        self.stack_names = []
+        self.stack_vars = []
+
+    # -- recording -------------------------------------------------------
+
+    def user_stack(self, frame):
+        frames = []
+        while frame is not None and frame.f_code.co_filename == FILENAME:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        return frames
+
+    def record(self, event, frame):
+        if self.stopped:
+            raise TraceLimit(self.stopped)
+        step_number = len(self.steps) + 1
+        if step_number > self.max_steps:
+            self.stopped = "step_limit"
+            raise TraceLimit(self.stopped)
+        if step_number % 64 == 0 and time.perf_counter() > self.deadline:
+            self.stopped = "timeout"
+            raise TraceLimit(self.stopped)
+
+        # Wire format is sparse: empty output/delta are omitted and code_line
+        # is filled in from the source by expand_steps
+        step = {"step_number": step_number, "event": event, "line_number": frame.f_lineno}
+        output = self.output.take()
+        if output:
+            step["output"] = output
+
+        frames = self.user_stack(frame)
+        names = [f.f_code.co_name for f in frames]
+        keyframe = (step_number - 1) % self.keyframe_interval == 0
+
+        # Every frame is re-read: a call can mutate objects its callers hold
+        stack_vars = [snapshot_variables(f) for f in frames]
+        if keyframe:
+            step["frames"] = [{"name": n, "variables": v} for n, v in zip(names, stack_vars)]
+        else:
+            changes = {}
+            for index, current in enumerate(stack_vars):
+                previous = self.stack_vars[index] if index < len(self.stack_vars) and self.stack_names[index] == names[index] else {}
+                set_vars = {k: v for k, v in current.items() if previous.get(k) != v}
+                del_vars = [k for k in previous if k not in current]
+                if set_vars or del_vars:
+                    change = {}
+                    if set_vars:
+                        change["set"] = set_vars
+                    if del_vars:
+                        change["del"] = del_vars
+                    changes[str(index)] = change
+            if names != self.stack_names:
+                step["stack"] = names
+            if changes:
+                step["changes"] = changes
+
+        self.stack_names = names
+        self.stack_vars = stack_vars
+        self.steps.append(step)
+
+    # -- backends --------------------------------------------------------
+
+    def run_with_monitoring(self, code_obj, namespace):
+        monitoring = sys.monitoring
+        tool = monitoring.DEBUGGER_ID
+        events = monitoring.events
+
+        def on_line(code, line_number):
+            if code.co_filename != FILENAME:
+                return monitoring.DISABLE
+            self.record("line", sys._getframe(1))
+
+        def on_start(code, offset):
+            if code.co_filename != FILENAME:
+                return monitoring.DISABLE
+            if code is not code_obj:
+                self.record("call", sys._getframe(1))
+
+        def on_return(code, offset, retval):
+            if code.co_filename != FILENAME:
+                return monitoring.DISABLE
+            if code is not code_obj:
+                self.record("return", sys._getframe(1))
+
+        monitoring.use_tool_id(tool, "codelearn-visualizer")
+        try:
+            monitoring.register_callback(tool, events.LINE, on_line)
+            monitoring.register_callback(tool, events.PY_START, on_start)
+            monitoring.register_callback(tool, events.PY_RETURN, on_return)
+            monitoring.set_events(tool, events.LINE | events.PY_START | events.PY_RETURN)
+            exec(code_obj, namespace)
+        finally:
+            monitoring.set_events(tool, 0)
+            monitoring.register_callback(tool, events.LINE, None)
+            monitoring.register_callback(tool, events.PY_START, None)
+            monitoring.register_callback(tool, events.PY_RETURN, None)
+            monitoring.free_tool_id(tool)
+
+    def run_with_settrace(self, code_obj, namespace):
+        def local_trace(frame, event, arg):
+            if event == "line" or (event == "return" and frame.f_code is not code_obj):
+                self.record(event, frame)
+            return local_trace
+
+        def global_trace(frame, event, arg):
+            if frame.f_code.co_filename != FILENAME:
+                return None
+            if frame.f_code is not code_obj:
+                self.record("call", frame)
+            return local_trace
+
+        sys.settrace(global_trace)
+        try:
+            exec(code_obj, namespace)
+        finally:
+            sys.settrace(None)
+
+    # -- entry point -----------------------------------------------------
+
+    def run(self, code):
+        """Returns {"status", "steps"}; status is "ok", "error", "timeout" or "step_limit"."""
+        try:
+            code_obj = compile(code, FILENAME, "exec")
+        except SyntaxError as e:
+            return {"status": "error", "error": f"SyntaxError: {e.msg} (line {e.lineno})", "steps": []}
+
+        namespace = {"__name__": "__main__", "__builtins__": builtins}
+        saved_stdout, saved_input = sys.stdout, builtins.input
+        sys.stdout, builtins.input = self.output, no_input
+        self.deadline = time.perf_counter() + self.time_budget
+        use_alarm = hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+        if use_alarm:
+            saved_handler = signal.signal(signal.SIGALRM, on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.time_budget + 0.5)
+            # Sent when a locked down worker reaches its CPU limit
+            saved_xcpu = signal.signal(signal.SIGXCPU, on_alarm)
+        status, error = "ok", None
+        try:
+            if hasattr(sys, "monitoring"):
+                self.run_with_monitoring(code_obj, namespace)
+            else:
+                self.run_with_settrace(code_obj, namespace)
+        except TraceLimit as e:
+            status = e.reason
+        except Exception as e:
+            status = "error"
+            error = "".join(traceback.format_exception_only(type(e), e)).strip()
+            self.steps.append({
+                "step_number": len(self.steps) + 1,
+                "event": "exception",
+                "line_number": self.steps[-1]["line_number"] if self.steps else None,
+                "output": self.output.take() + error + "\n",
+            })
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, saved_handler)
+                signal.signal(signal.SIGXCPU, saved_xcpu)
+            sys.stdout, builtins.input = saved_stdout, saved_input
+
+        remaining = self.output.take()
+        if remaining and self.steps:
+            self.steps[-1]["output"] = self.steps[-1].get("output", "") + remaining
+
+        result = {"status": status, "steps": self.steps, "keyframe_interval": self.keyframe_interval}
+        if error:
+            result["error"] = error
+        return result
+
+
+def expand_steps(steps, code):
+    """Turns sparse, delta-encoded steps into full per-step frames with
+    code_line and output filled in (the shape App.jsx reads)."""
+    source_lines = code.splitlines()
+    names, stack_vars = [], []
+    expanded = []
+    for step in steps:
+        line = step["line_number"]
+        full = {
+            "step_number": step["step_number"],
+            "event": step["event"],
+            "line_number": line,
+            "code_line": source_lines[line - 1].strip() if line and 0 < line <= len(source_lines) else "",
+            "output": step.get("output", ""),
+        }
+        if "frames" in step:
+            names = [frame["name"] for frame in step["frames"]]
+            stack_vars = [dict(frame["variables"]) for frame in step["frames"]]
+        else:
+            if "stack" in step:
+                new_names = step["stack"]
+                stack_vars = [
+                    stack_vars[i] if i < len(names) and names[i] == name else {}
+                    for i, name in enumerate(new_names)
+                ]
+                names = new_names
+            else:
+                stack_vars = list(stack_vars)
+            for index, change in step.get("changes", {}).items():
+                variables = stack_vars[int(index)] = dict(stack_vars[int(index)])
+                variables.update(change.get("set", {}))
+                for name in change.get("del", []):
+                    variables.pop(name, None)
+        full["frames"] = [{"name": n, "variables": v} for n, v in zip(names, stack_vars)]
+        expanded.append(full)
+    return expanded
+
+
+def run_trace(code, max_steps=MAX_STEPS, time_budget=TIME_BUDGET):
+    return ExecutionTracer(max_steps, time_budget).run(code)
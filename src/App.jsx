@@ -230,7 +230,7 @@ public class Main {
         }
       }
 
-      const apiBase = (import.meta && import.meta.env && import.meta.env.VITE_API_URL) ? import.meta.env.VITE_API_URL : 'http://127.0.0.1:5001'
+      const apiBase = (import.meta && import.meta.env && import.meta.env.VITE_API_URL) ? import.meta.env.VITE_API_URL : ''  // relative: the vite /api proxy forwards to the backend on 8000
       const resp = await fetch(`${apiBase}/api/visualize`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
@@ -283,7 +283,7 @@ public class Main {
       setPlaying(false)
 
       if (String(err).includes('Failed to fetch') || String(err).includes('NetworkError')) {
-        alert('⚠️ The "Execute" feature is currently unavailable (Backend port 5001 not running).\n\n✅ Please use the "Generate Flowchart" button in the top header instead! (Backend port 8000)');
+        alert('⚠️ The "Execute" feature is currently unavailable (Backend port 8000 not running).');
       } else {
         alert('Visualization failed: ' + (err && err.message ? err.message : String(err)))
       }
@@ -547,6 +547,7 @@ public class Main {
         onClose={() => setIsAssistantOpen(false)}
         theme={theme}
         code={code}
+        language={language}
       />
 
       {/* Floating Toggle Button (only visible when closed) */}
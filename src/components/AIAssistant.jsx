@@ -49,7 +49,7 @@ const NotionAuthModal = ({ isOpen, onClose, onSave, isDark }) => {
     );
 };
 
-export default function AIAssistant({ isOpen, onClose, theme, code }) {
+export default function AIAssistant({ isOpen, onClose, theme, code, language }) {
     const [messages, setMessages] = useState([
         { role: 'assistant', content: 'Hi! I am your AI coding assistant. How can I help you with your code today?' }
     ]);
@@ -109,15 +109,20 @@ export default function AIAssistant({ isOpen, onClose, theme, code }) {
     const handleFileSelect = (e) => {
         const file = e.target.files[0];
         if (file) {
-            const reader = new FileReader();
-            reader.onloadend = () => {
-                setSelectedFile(reader.result); // This is the base64 data URL
-                setFileName(file.name);
-            };
-            reader.readAsDataURL(file);
+            // Kept as a File: images are uploaded as multipart and downscaled by the backend
+            setSelectedFile(file);
+            setFileName(file.name);
         }
+        e.target.value = '';
     };
 
+    const readAsDataURL = (file) => new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onloadend = () => resolve(reader.result);
+        reader.onerror = reject;
+        reader.readAsDataURL(file);
+    });
+
     const handleSend = async () => {
         if (!input.trim() && !activeModel && !selectedFile) return;
 
@@ -171,26 +176,42 @@ export default function AIAssistant({ isOpen, onClose, theme, code }) {
         setInput('');
 
         // Store file data to send and clear state
-        const imageToSend = selectedFile;
+        const fileToSend = selectedFile;
         const fileNameToSend = fileName;
         setSelectedFile(null);
         setFileName('');
 
+        const fields = {
+            message: messageContent || input, // Use processed message or original
+            model: modelName,
+            apiKey: modelName === 'notion' ? notionKey : undefined,
+            currentCode: code,
+            language,
+            fileName: fileNameToSend
+        };
+
         try {
-            const response = await fetch('/api/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    message: messageContent || input, // Use processed message or original
-                    model: modelName,
-                    apiKey: modelName === 'notion' ? notionKey : undefined,
-                    currentCode: code,
-                    image: imageToSend,
-                    fileName: fileNameToSend
-                }),
-            });
+            let response;
+            if (fileToSend && fileToSend.type.startsWith('image/')) {
+                // Streamed to the backend as-is instead of as a base64 string
+                const form = new FormData();
+                Object.entries(fields).forEach(([key, value]) => {
+                    if (value !== undefined && value !== null) form.append(key, value);
+                });
+                form.append('image', fileToSend, fileNameToSend);
+                response = await fetch('/api/chat/upload', { method: 'POST', body: form });
+            } else {
+                response = await fetch('/api/chat', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        ...fields,
+                        image: fileToSend ? await readAsDataURL(fileToSend) : undefined
+                    }),
+                });
+            }
 
             if (!response.ok) {
                 throw new Error('Network response was not ok');
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { DndProvider, useDrop } from 'react-dnd';
 import { HTML5Backend } from 'react-dnd-html5-backend';
 import SqlBlock from './SqlBlock';
@@ -49,6 +49,8 @@ const SqlBuilderContent = ({ theme }) => {
     const [queryBlocks, setQueryBlocks] = useState([]);
     const [result, setResult] = useState(null);
     const [error, setError] = useState(null);
+    // The backend keeps a private copy of the practice database per session
+    const sqlSession = useRef(null);
     const [selectedCategory, setSelectedCategory] = useState('basic');
     const [currentQuestion, setCurrentQuestion] = useState(QUESTIONS.basic[0]);
 
@@ -81,18 +83,24 @@ const SqlBuilderContent = ({ theme }) => {
         setResult(null);
 
         try {
-            const response = await fetch('http://localhost:3001/run-sql', {
+            const response = await fetch('/api/sql', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ sql })
+                body: JSON.stringify({ sql, session_id: sqlSession.current })
             });
 
-            const data = await response.json();
-            if (data.error) {
-                setError(data.error);
-            } else {
-                setResult(data.results);
+            if (!response.ok) {
+                const data = await response.json();
+                setError(data.detail);
+                return;
             }
+
+            // NDJSON: a header with the columns, then pages of rows
+            const lines = (await response.text()).split('\n').filter(Boolean).map(line => JSON.parse(line));
+            const [header, ...rest] = lines;
+            sqlSession.current = header.session_id;
+            const rows = rest.filter(line => line.rows).flatMap(line => line.rows);
+            setResult(rows.map(row => Object.fromEntries(header.columns.map((column, i) => [column, row[i]]))));
         } catch (err) {
             setError("Failed to connect to backend.");
         }
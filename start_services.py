@@ -1,50 +1,177 @@
+"""Starts and supervises the Python backend (and the Node.js service, if used).
+
+The backend runs as BACKEND_WORKERS uvicorn processes (default: one per core)
+that all accept connections from one listening socket opened here, so a
+crashed worker can be restarted on its own. Children that exit unexpectedly
+are restarted with exponential backoff. On SIGTERM/SIGINT every child gets
+SIGTERM (uvicorn stops accepting and finishes in-flight requests) and is
+killed if it hasn't exited after DRAIN_TIMEOUT seconds.
+
+Each backend worker warms its flowchart pool (javalang, esprima and the generators)
+during startup, before it accepts its first connection; /readyz reports when
+that is done and /healthz that the process is alive.
+"""
 import subprocess
 import time
 import os
+import shutil
 import signal
+import socket
 import sys
 
+BACKEND_HOST = os.getenv("BACKEND_HOST", "0.0.0.0")
+BACKEND_PORT = int(os.getenv("BACKEND_PORT", "8000"))
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", str(os.cpu_count() or 1)))
+# The Node service is only needed when JavaScript flowcharts go to it (JS_GENERATOR=node)
+START_JS_SERVICE = os.getenv("START_JS_SERVICE", "1" if os.getenv("JS_GENERATOR") == "node" else "0") == "1"
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+RESTART_BACKOFF = float(os.getenv("RESTART_BACKOFF", "0.5"))
+RESTART_BACKOFF_MAX = float(os.getenv("RESTART_BACKOFF_MAX", "30"))
+# A child that stayed up this long is considered healthy again
+STABLE_AFTER = 30
+
+
+class Child:
+    def __init__(self, name, args, cwd, env=None, pass_fds=()):
+        self.name = name
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.pass_fds = pass_fds
+        self.process = None
+        self.started_at = 0
+        self.failures = 0
+        self.restart_at = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.args,
+            cwd=self.cwd,
+            env=self.env,
+            pass_fds=self.pass_fds,
+            stdout=sys.stdout,
+            stderr=sys.stderr,
+        )
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        print(f"[supervisor] started {self.name} (pid {self.process.pid})")
+
+    def check(self, now):
+        """Schedules a restart if the child died, and performs due restarts."""
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.start()
+            return
+
+        code = self.process.poll()
+        if code is None:
+            return
+        forget_process(self.process.pid)
+        if now - self.started_at >= STABLE_AFTER:
+            self.failures = 0
+        delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF * (2 ** self.failures))
+        self.failures += 1
+        self.restart_at = now + delay
+        print(f"[supervisor] {self.name} exited with {code}, restarting in {delay:.1f}s")
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+def forget_process(pid):
+    # Drops the dead worker's live gauges from the shared metrics directory
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+        except ImportError:
+            pass
+
+
+def prepare_metrics_dir():
+    # Samples from a previous run must not leak into this one
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def listen_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((BACKEND_HOST, BACKEND_PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
 def start_services():
     # Get absolute paths
     base_dir = os.path.dirname(os.path.abspath(__file__))
     js_service_dir = os.path.join(base_dir, 'backend', 'js_service')
-    python_main = os.path.join(base_dir, 'backend', 'main.py')
+    backend_dir = os.path.join(base_dir, 'backend')
     venv_python = os.path.join(base_dir, 'backend', 'venv', 'bin', 'python')
+    python = venv_python if os.path.exists(venv_python) else sys.executable
 
     print(f"Starting services from {base_dir}...")
+    prepare_metrics_dir()
+
+    children = []
+    if START_JS_SERVICE:
+        print("Starting Node.js Service (Port 3001)...")
+        children.append(Child("js-service", ['npm', 'start'], js_service_dir))
+
+    print(f"Starting Python Backend (Port {BACKEND_PORT}, {BACKEND_WORKERS} workers)...")
+    sock = listen_socket()
+    env = dict(os.environ)
+    # Share the cores between the uvicorn workers' flowchart pools
+    env.setdefault("FLOWCHART_WORKERS", str(max(1, (os.cpu_count() or 1) // BACKEND_WORKERS)))
+    for index in range(BACKEND_WORKERS):
+        children.append(Child(
+            f"backend-{index}",
+            [python, "-m", "uvicorn", "main:app", "--fd", str(sock.fileno()),
+             "--timeout-graceful-shutdown", str(int(DRAIN_TIMEOUT))],
+            backend_dir,
+            env=env,
+            pass_fds=(sock.fileno(),),
+        ))
 
-    # Start Node.js Service
-    print("Starting Node.js Service (Port 3001)...")
-    js_process = subprocess.Popen(
-        ['npm', 'start'], 
-        cwd=js_service_dir,
-        stdout=sys.stdout,
-        stderr=sys.stderr
-    )
-
-    # Start Python Backend
-    print("Starting Python Backend (Port 8000)...")
-    python_process = subprocess.Popen(
-        [venv_python, python_main],
-        cwd=base_dir,
-        stdout=sys.stdout,
-        stderr=sys.stderr
-    )
+    stopping = []
 
     def signal_handler(sig, frame):
-        print("\nShutting down services...")
-        js_process.terminate()
-        python_process.terminate()
-        sys.exit(0)
+        if not stopping:
+            print("\nShutting down services...")
+        stopping.append(sig)
 
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    for child in children:
+        child.start()
+
+    # Keep running until interrupted, restarting children that die
+    while not stopping:
+        now = time.monotonic()
+        for child in children:
+            child.check(now)
+        time.sleep(0.2)
 
-    try:
-        # Keep running until interrupted
-        python_process.wait()
-        js_process.wait()
-    except KeyboardInterrupt:
-        signal_handler(None, None)
+    # Drain: uvicorn finishes in-flight requests on SIGTERM
+    sock.close()
+    for child in children:
+        child.terminate()
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    for child in children:
+        if child.process is None:
+            continue
+        try:
+            child.process.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            print(f"[supervisor] {child.name} did not drain in time, killing it")
+            child.process.kill()
+            child.process.wait()
+    sys.exit(0)
 
 if __name__ == "__main__":
     start_services()